@@ -0,0 +1,33 @@
+from inkplate6 import Inkplate
+from textreader import TextReader
+from touchpad import PRESS
+
+display = Inkplate(Inkplate.INKPLATE_1BIT)
+
+if __name__ == "__main__":
+    display.begin()
+
+    # The first open pages through the book once and stores sd/book.txt.idx, later opens
+    # jump straight to a page
+    book = TextReader(display, "sd/book.txt", x=20, y=20, w=760, h=560, size=2)
+    print("pages:", book.pageCount)
+
+    page = 0
+    book.showPage(page)
+    display.display()
+
+    # pad 1 turns back a page, pad 3 forward; events come from the touchpad interrupt, so the
+    # loop sleeps until a pad is pressed and each press turns one page
+    pads = display.touchpads()
+    while True:
+        pad, kind = pads.get()
+        if kind != PRESS:
+            continue
+        if pad == 1 and page > 0:
+            page -= 1
+        elif pad == 3 and page < book.pageCount - 1:
+            page += 1
+        else:
+            continue
+        book.showPage(page)
+        display.partialUpdate()
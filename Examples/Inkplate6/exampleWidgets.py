@@ -0,0 +1,37 @@
+# A counter built from widgets: pads 1 and 3 change it, pad 2 resets it. Only the widgets that
+# changed are redrawn and refreshed.
+from inkplate6 import Inkplate
+from touchpad import PRESS, RELEASE
+from widgets import Screen, Label, Value, ProgressBar, Button
+
+display = Inkplate(Inkplate.INKPLATE_1BIT)
+
+if __name__ == "__main__":
+    display.begin()
+    display.clearDisplay()
+    display.display()
+
+    screen = Screen(display)
+    screen.add(Label(100, 40, "1 AND 3 CHANGE THE COUNT, 2 RESETS IT", size=2))
+    count = screen.add(Value(100, 120, 0, "COUNT: %d", size=4))
+    bar = screen.add(ProgressBar(100, 200, 600, 40, 0, 20))
+    buttons = [
+        Button(100, 300, 180, 60, "-", 3),
+        Button(310, 300, 180, 60, "RESET", 3),
+        Button(520, 300, 180, 60, "+", 3),
+    ]
+    screen.add(*buttons)
+    screen.commit(full=True)
+
+    n = 0
+    pads = display.touchpads()
+    while True:
+        pad, kind = pads.get()
+        if kind != PRESS and kind != RELEASE:
+            continue
+        buttons[pad - 1].set(pressed=kind == PRESS)
+        if kind == PRESS:
+            n = 0 if pad == 2 else max(0, min(20, n + (1 if pad == 3 else -1)))
+            count.set(value=n)
+            bar.set(value=n)
+        screen.commit()
@@ -0,0 +1,41 @@
+# Moves a circle with the touchpads like touchpads.py, but waits for pad events from the
+# MCP23017 interrupt instead of polling the pads in a loop
+from inkplate6 import Inkplate
+from touchpad import PRESS, LONG_PRESS
+
+display = Inkplate(Inkplate.INKPLATE_1BIT)
+
+circle_x = 400
+circle_y = 300
+circle_r = 40
+
+if __name__ == "__main__":
+    display.begin()
+    display.clearDisplay()
+    display.display()
+
+    def draw():
+        display.clearDisplay()
+        display.setTextSize(2)
+        display.printText(100, 10, "1, 3 MOVE THE CIRCLE, 2 RESETS IT, HOLD 2 TO REFRESH")
+        display.drawCircle(circle_x, circle_y, circle_r, display.BLACK)
+
+    draw()
+    display.display()
+
+    pads = display.touchpads()
+    while True:
+        pad, kind = pads.get()
+        if kind == PRESS and pad == 1:
+            circle_x -= 40
+        elif kind == PRESS and pad == 3:
+            circle_x += 40
+        elif kind == PRESS and pad == 2:
+            circle_x = 400
+        elif kind == LONG_PRESS and pad == 2:
+            display.display()
+            continue
+        else:
+            continue
+        draw()
+        display.partialUpdate()
@@ -0,0 +1,37 @@
+from inkplate6_COLOR import Inkplate
+import uasyncio as asyncio
+
+display = Inkplate()
+
+
+async def blink():
+    # Runs while the panel refreshes
+    for i in range(20):
+        print("still responsive", i)
+        await asyncio.sleep(1)
+
+
+async def main():
+    display.fillRect(100, 100, 200, 150, display.RED)
+    display.printText(120, 300, "Refreshing in the background", display.BLACK)
+
+    # Starts the refresh and returns right after the image is sent to the panel
+    display.displayAsync()
+    task = asyncio.create_task(blink())
+
+    # Waits for the BUSY interrupt without blocking the other task
+    await display.waitDisplay()
+    print("refresh done")
+    task.cancel()
+
+    # Without asyncio, poll instead
+    display.clearDisplay()
+    display.displayAsync()
+    while not display.displayDone():
+        pass
+
+
+if __name__ == "__main__":
+    # Must be called before using, line in Arduino
+    display.begin()
+    asyncio.run(main())
@@ -13,3 +13,16 @@ f = open("sd/text.txt", "r")
 # Print file contents
 print(f.read())
 f.close()
+
+time.sleep(5)
+
+# Colours are matched to the seven inks, Floyd-Steinberg dithering mixes them for the rest
+display.drawImageFile(0, 0, "sd/1.png", dither=display.DITHER_FLOYD_STEINBERG)
+
+display.display()
+
+time.sleep(5)
+
+# A full-screen frame already in the panel's 4-bit format (600 x 448 ink indices, two per
+# byte) is streamed straight to the panel, without using the framebuffer
+display.displayFromFile("sd/frame.bin")
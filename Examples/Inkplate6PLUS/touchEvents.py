@@ -0,0 +1,29 @@
+# Prints touchscreen gestures as they come in, read when the controller raises its interrupt
+# rather than by polling touchInArea in a loop
+from inkplate6_PLUS import Inkplate
+import touchscreen
+
+display = Inkplate(Inkplate.INKPLATE_1BIT)
+
+NAMES = {
+    touchscreen.TAP: "tap",
+    touchscreen.LONG_PRESS: "long press",
+    touchscreen.SWIPE_LEFT: "swipe left",
+    touchscreen.SWIPE_RIGHT: "swipe right",
+    touchscreen.SWIPE_UP: "swipe up",
+    touchscreen.SWIPE_DOWN: "swipe down",
+    touchscreen.TWO_FINGER: "two fingers",
+}
+
+if __name__ == "__main__":
+    display.begin()
+    display.tsInit(1)
+    display.setTextSize(2)
+    display.printText(100, 100, "TAP, HOLD OR SWIPE ANYWHERE")
+    display.display()
+
+    events = display.touchEvents()
+    while True:
+        kind, x, y = events.get()
+        if kind in NAMES:
+            print("%s at %d, %d" % (NAMES[kind], x, y))
@@ -0,0 +1,147 @@
+# BMP reader for the Inkplate image pipeline. Uncompressed 1, 4, 8, 16 (RGB555, or RGB565 with
+# bit field masks), 24 and 32 bit images are supported. Rows are read one at a time by seeking
+# to them, so they come out top to bottom like for the other decoders, and only one row is held
+# in memory.
+import micropython
+from micropython import const
+from uarray import array
+
+SIGNATURE = b"BM"
+
+# Indices into the info array handed to _convert
+_I_WIDTH = const(0)
+_I_DEPTH = const(1)
+_I_RGB = const(2)
+_I_X0 = const(3)
+_I_565 = const(4)
+
+# BI_BITFIELDS masks (red, green, blue) that can be decoded
+_MASKS_555 = (0x7C00, 0x3E0, 0x1F)
+_MASKS_565 = (0xF800, 0x7E0, 0x1F)
+_MASKS_32 = (0xFF0000, 0xFF00, 0xFF)
+
+
+# _convert turns info[_I_WIDTH] BMP pixels, starting with pixel info[_I_X0] of src, into 8-bit
+# luminance or, if info[_I_RGB] is set, RGB triplets. Palette indices are looked up in lut
+# (256 luminance values, or 768 RGB values). 16-bit pixels are RGB565 if info[_I_565] is set.
+@micropython.viper
+def _convert(src, dst, lut, info):
+    s = ptr8(src)
+    d = ptr8(dst)
+    t = ptr8(lut)
+    inf = ptr32(info)
+    w = int(inf[_I_WIDTH])
+    depth = int(inf[_I_DEPTH])
+    rgb = int(inf[_I_RGB])
+    x0 = int(inf[_I_X0])
+    f565 = int(inf[_I_565])
+    for i in range(w):
+        p = x0 + i
+        if depth <= 8:
+            bit = p * depth
+            v = (int(s[bit >> 3]) >> (8 - depth - (bit & 7))) & ((1 << depth) - 1)
+            if rgb:
+                d[3 * i] = t[3 * v]
+                d[3 * i + 1] = t[3 * v + 1]
+                d[3 * i + 2] = t[3 * v + 2]
+            else:
+                d[i] = t[v]
+            continue
+        if depth == 16:
+            px = int(s[2 * p]) | (int(s[2 * p + 1]) << 8)
+            if f565:
+                r = (px & 0xF800) >> 8
+                g = (px & 0x7E0) >> 3
+            else:
+                r = (px & 0x7C00) >> 7
+                g = (px & 0x3E0) >> 2
+            b = (px & 0x1F) << 3
+        else:
+            j = p * (depth >> 3)
+            b = int(s[j])
+            g = int(s[j + 1])
+            r = int(s[j + 2])
+        if rgb:
+            d[3 * i] = r
+            d[3 * i + 1] = g
+            d[3 * i + 2] = b
+        else:
+            d[i] = (54 * r + 183 * g + 19 * b) >> 8
+
+
+# BMP parses the header of a BMP file and then reads it one row at a time. The file object
+# must stay open while rows are being read.
+class BMP:
+    def __init__(self, f):
+        self._f = f
+        header14 = f.read(14)
+        if header14[0:2] != SIGNATURE:
+            raise ValueError("not a BMP file")
+        header40 = f.read(40)
+        self.width = int.from_bytes(header40[4:8], "little")
+        h = int.from_bytes(header40[8:12], "little")
+        # a negative height means the rows are stored top-down
+        self._topDown = h >= 1 << 31
+        self.height = (1 << 32) - h if self._topDown else h
+        self._dataStart = int.from_bytes(header14[10:14], "little")
+        self.depth = int.from_bytes(header40[14:16], "little")
+        if self.depth not in (1, 4, 8, 16, 24, 32):
+            raise ValueError("unsupported BMP depth")
+        compression = int.from_bytes(header40[16:20], "little")
+        if compression not in (0, 3):
+            raise ValueError("compressed BMP not supported")
+        self._565 = False
+        if compression == 3:
+            # BI_BITFIELDS: the red, green and blue masks follow the 40 byte header
+            m = f.read(12)
+            masks = tuple(int.from_bytes(m[i : i + 4], "little") for i in (0, 4, 8))
+            if self.depth == 16 and masks in (_MASKS_555, _MASKS_565):
+                self._565 = masks == _MASKS_565
+            elif self.depth != 32 or masks != _MASKS_32:
+                raise ValueError("unsupported BMP bit field masks")
+        self._rowSize = 4 * ((self.depth * self.width + 31) // 32)
+        self._palette = None
+        if self.depth <= 8:
+            colors = int.from_bytes(header40[32:36], "little") or 1 << self.depth
+            if colors > 1 << self.depth:
+                raise ValueError("bad BMP palette size")
+            f.seek(14 + int.from_bytes(header40[0:4], "little"))
+            self._palette = f.read(colors * 4)
+
+    # _lut builds the palette index -> luminance (or RGB) table, palette entries are BGRx
+    def _lut(self, rgb):
+        p = self._palette
+        lut = bytearray(768 if rgb else 256)
+        for i in range(len(p) // 4):
+            b, g, r = p[4 * i], p[4 * i + 1], p[4 * i + 2]
+            if rgb:
+                lut[3 * i] = r
+                lut[3 * i + 1] = g
+                lut[3 * i + 2] = b
+            else:
+                lut[i] = (54 * r + 183 * g + 19 * b) >> 8
+        return lut
+
+    # rows yields (y, row) for every row of the image from top to bottom, row holding width
+    # bytes of luminance (0=black..255=white), or 3*width bytes of RGB if rgb is True.
+    # The same buffer is reused for every row.
+    # A window of columns x0..x1-1 and rows y0..y1-1 can be requested, only the bytes holding
+    # those pixels are read from the file.
+    def rows(self, rgb=False, x0=0, y0=0, x1=None, y1=None):
+        x1 = self.width if x1 is None else x1
+        y1 = self.height if y1 is None else y1
+        f = self._f
+        depth = self.depth
+        start = (x0 * depth) >> 3  # first byte of the window in a row
+        buf = bytearray((((x1 * depth) + 7) >> 3) - start)
+        out = bytearray((x1 - x0) * 3 if rgb else x1 - x0)
+        lut = self._lut(rgb) if self._palette else b""
+        # pixel offset of x0 within the first byte (pixels smaller than a byte)
+        sub = x0 - (start << 3) // depth
+        info = array("i", (x1 - x0, depth, 1 if rgb else 0, sub, 1 if self._565 else 0))
+        for y in range(y0, y1):
+            r = y if self._topDown else self.height - 1 - y
+            f.seek(self._dataStart + r * self._rowSize + start)
+            f.readinto(buf)
+            _convert(buf, out, lut, info)
+            yield y, out
@@ -0,0 +1,273 @@
+# Dither reduces rows of 8-bit luminance to the few grey levels a panel can show. It is the
+# quantization stage of the image pipeline: every decoder hands its rows to an ImageSink, which
+# runs them through a Dither before packing them into the framebuffer.
+# Error diffusion keeps the error of at most the next two rows, everything is integer
+# arithmetic and the per-pixel work is table lookups.
+import micropython
+from micropython import const
+from uarray import array
+
+# Dithering methods
+NONE = const(0)  # plain thresholding to the nearest level
+FLOYD_STEINBERG = const(1)
+ATKINSON = const(2)
+BAYER = const(3)  # 8x8 ordered dither
+
+# Layout of the state array handed to _dither
+_S_N = const(0)  # pixels per row
+_S_METHOD = const(1)
+_S_Y = const(2)  # row number, for the ordered dither
+_S_E0 = const(3)  # index of the error row for the current image row
+_S_E1 = const(4)  # ... for the next row
+_S_E2 = const(5)  # ... for the row after that (Atkinson only)
+_S_INV = const(6)  # 0xFF to invert the image
+_S_BAYER = const(7)  # 64 threshold offsets
+_S_ERR = const(71)  # three error rows of n+4 entries, indexed -2..n+1
+
+# Layout of the table array handed to _dither
+_T_LUM = const(256)  # luminance of each level
+_T_VAL = const(272)  # panel value of each level
+
+
+# _dither quantizes a row of luminance from src into panel values in dst
+@micropython.viper
+def _dither(src, dst, state, tabs):
+    s = ptr8(src)
+    d = ptr8(dst)
+    st = ptr32(state)
+    t = ptr8(tabs)
+    n = int(st[_S_N])
+    method = int(st[_S_METHOD])
+    brow = _S_BAYER + ((int(st[_S_Y]) & 7) << 3)
+    e0 = int(st[_S_E0])
+    e1 = int(st[_S_E1])
+    e2 = int(st[_S_E2])
+    inv = int(st[_S_INV])
+    for i in range(n):
+        v = int(s[i]) ^ inv
+        if method == BAYER:
+            v += int(st[brow + (i & 7)])
+        elif method != NONE:
+            v += int(st[e0 + i])
+        if v < 0:
+            v = 0
+        elif v > 255:
+            v = 255
+        q = int(t[v])
+        d[i] = t[_T_VAL + q]
+        if method == FLOYD_STEINBERG:
+            e = v - int(t[_T_LUM + q])
+            st[e0 + i + 1] = int(st[e0 + i + 1]) + ((e * 7) >> 4)
+            st[e1 + i - 1] = int(st[e1 + i - 1]) + ((e * 3) >> 4)
+            st[e1 + i] = int(st[e1 + i]) + ((e * 5) >> 4)
+            st[e1 + i + 1] = int(st[e1 + i + 1]) + (e >> 4)
+        elif method == ATKINSON:
+            e = (v - int(t[_T_LUM + q])) >> 3
+            st[e0 + i + 1] = int(st[e0 + i + 1]) + e
+            st[e0 + i + 2] = int(st[e0 + i + 2]) + e
+            st[e1 + i - 1] = int(st[e1 + i - 1]) + e
+            st[e1 + i] = int(st[e1 + i]) + e
+            st[e1 + i + 1] = int(st[e1 + i + 1]) + e
+            st[e2 + i] = int(st[e2 + i]) + e
+    # the current error row has been consumed, clear it for reuse
+    for i in range(-2, n + 2):
+        st[e0 + i] = 0
+
+
+# _bayer returns the 8x8 Bayer matrix in row-major order
+def _bayer():
+    m = [0]
+    size = 1
+    while size < 8:
+        m = [
+            4 * m[(y % size) * size + x % size] + (0, 2, 3, 1)[(y // size) * 2 + x // size]
+            for y in range(2 * size)
+            for x in range(2 * size)
+        ]
+        size *= 2
+    return m
+
+
+class Dither:
+    # method is one of the constants above, width the number of pixels per row and values the
+    # panel value to output for each level, ordered from black to white (e.g. (0, 1, 2, 3) for
+    # 2-bit greyscale or (1, 0) for a monochrome framebuffer where 1 is black).
+    def __init__(self, method, width, values, invert=False):
+        levels = len(values)
+        st = array("i", bytes(4 * (_S_ERR + 3 * (width + 4))))
+        st[_S_N] = width
+        st[_S_METHOD] = method
+        st[_S_E0] = _S_ERR + 2
+        st[_S_E1] = _S_ERR + 2 + (width + 4)
+        st[_S_E2] = _S_ERR + 2 + 2 * (width + 4)
+        st[_S_INV] = 0xFF if invert else 0
+        step = 255 // (levels - 1)
+        if method == BAYER:
+            for i, m in enumerate(_bayer()):
+                st[_S_BAYER + i] = (2 * m + 1) * step // 128 - step // 2
+        tabs = bytearray(_T_VAL + 16)
+        for v in range(256):
+            tabs[v] = (v * (levels - 1) + 127) // 255
+        for q in range(levels):
+            tabs[_T_LUM + q] = q * 255 // (levels - 1)
+            tabs[_T_VAL + q] = values[q]
+        self._state = st
+        self._tabs = tabs
+        self._three = method == ATKINSON
+
+    # row quantizes row y of luminance (0=black..255=white) in lum into panel values in out.
+    # Error diffusion expects consecutive rows.
+    def row(self, y, lum, out):
+        st = self._state
+        st[_S_Y] = y
+        _dither(lum, out, st, self._tabs)
+        self._rotate(st)
+
+    # _rotate rotates the error rows: the cleared current row becomes the last one
+    def _rotate(self, st):
+        e0 = st[_S_E0]
+        st[_S_E0] = st[_S_E1]
+        if self._three:
+            st[_S_E1] = st[_S_E2]
+            st[_S_E2] = e0
+        else:
+            st[_S_E1] = e0
+
+
+# Additional state used by _dither_rgb
+_S_TMP = const(71)  # the current pixel's r, g, b
+_S_PAL = const(74)  # palette colours, 3 entries each (up to _MAX_COLORS)
+_S_RGB_ERR = const(95)  # three error rows of 3*(n+4) entries, indexed -6..3n+5
+
+_MAX_COLORS = const(7)
+
+_luts = {}  # palette -> RGB565 lookup table, shared by all ColorDither instances
+
+
+# freeLuts drops the colour lookup tables kept for later ColorDithers, 64 KB per palette used,
+# e.g. once a colour image has been drawn. ColorDithers that still exist keep theirs.
+def freeLuts():
+    _luts.clear()
+
+
+# _build_lut fills lut with the index of the nearest palette colour for every RGB565 value.
+# pal holds the number of colours followed by their r, g, b. Distances use the "redmean"
+# weighting, a cheap approximation of perceptual colour difference.
+@micropython.viper
+def _build_lut(lut, pal):
+    t = ptr8(lut)
+    p = ptr32(pal)
+    npal = int(p[0])
+    for k in range(65536):
+        r = ((k >> 8) & 0xF8) | (k >> 13)
+        g = ((k >> 3) & 0xFC) | ((k >> 9) & 3)
+        b = ((k << 3) & 0xF8) | ((k >> 2) & 7)
+        best = 0
+        bestd = 0x7FFFFFFF
+        for q in range(npal):
+            pr = int(p[1 + 3 * q])
+            dr = r - pr
+            dg = g - int(p[2 + 3 * q])
+            db = b - int(p[3 + 3 * q])
+            rm = (r + pr) >> 1
+            dist = (((512 + rm) * dr * dr) >> 8) + 4 * dg * dg + (((767 - rm) * db * db) >> 8)
+            if dist < bestd:
+                bestd = dist
+                best = q
+        t[k] = best
+
+
+# _dither_rgb maps a row of RGB triplets from src to palette indices in dst
+@micropython.viper
+def _dither_rgb(src, dst, state, lut):
+    s = ptr8(src)
+    d = ptr8(dst)
+    st = ptr32(state)
+    t = ptr8(lut)
+    n = int(st[_S_N])
+    method = int(st[_S_METHOD])
+    brow = _S_BAYER + ((int(st[_S_Y]) & 7) << 3)
+    e0 = int(st[_S_E0])
+    e1 = int(st[_S_E1])
+    e2 = int(st[_S_E2])
+    inv = int(st[_S_INV])
+    for i in range(n):
+        j = 3 * i
+        for c in range(3):
+            v = int(s[j + c]) ^ inv
+            if method == BAYER:
+                v += int(st[brow + (i & 7)])
+            elif method != NONE:
+                v += int(st[e0 + j + c])
+            if v < 0:
+                v = 0
+            elif v > 255:
+                v = 255
+            st[_S_TMP + c] = v
+        r = int(st[_S_TMP])
+        g = int(st[_S_TMP + 1])
+        b = int(st[_S_TMP + 2])
+        q = int(t[((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)])
+        d[i] = q
+        if method == FLOYD_STEINBERG or method == ATKINSON:
+            for c in range(3):
+                e = int(st[_S_TMP + c]) - int(st[_S_PAL + 3 * q + c])
+                k = j + c
+                if method == FLOYD_STEINBERG:
+                    st[e0 + k + 3] = int(st[e0 + k + 3]) + ((e * 7) >> 4)
+                    st[e1 + k - 3] = int(st[e1 + k - 3]) + ((e * 3) >> 4)
+                    st[e1 + k] = int(st[e1 + k]) + ((e * 5) >> 4)
+                    st[e1 + k + 3] = int(st[e1 + k + 3]) + (e >> 4)
+                else:
+                    e = e >> 3
+                    st[e0 + k + 3] = int(st[e0 + k + 3]) + e
+                    st[e0 + k + 6] = int(st[e0 + k + 6]) + e
+                    st[e1 + k - 3] = int(st[e1 + k - 3]) + e
+                    st[e1 + k] = int(st[e1 + k]) + e
+                    st[e1 + k + 3] = int(st[e1 + k + 3]) + e
+                    st[e2 + k] = int(st[e2 + k]) + e
+    for i in range(-6, 3 * n + 6):
+        st[e0 + i] = 0
+
+
+# ColorDither maps rows of RGB to the nearest colours of a small palette (such as the seven
+# inks of the Inkplate 6COLOR), with optional dithering. Colour matching is a single lookup in
+# a 64 KB table indexed by RGB565, built once per palette (see freeLuts). palette is a sequence
+# of at most 7 (r, g, b) tuples; the output values are indices into it.
+class ColorDither(Dither):
+    def __init__(self, method, width, palette, invert=False):
+        if len(palette) > _MAX_COLORS:
+            raise ValueError("at most %d palette colours" % _MAX_COLORS)
+        key = tuple(palette)
+        lut = _luts.get(key)
+        if lut is None:
+            pal = array("i", [len(palette)] + [c for rgb in palette for c in rgb])
+            lut = bytearray(65536)
+            _build_lut(lut, pal)
+            _luts[key] = lut
+        rowlen = 3 * (width + 4)
+        st = array("i", bytes(4 * (_S_RGB_ERR + 3 * rowlen)))
+        st[_S_N] = width
+        st[_S_METHOD] = method
+        st[_S_E0] = _S_RGB_ERR + 6
+        st[_S_E1] = _S_RGB_ERR + 6 + rowlen
+        st[_S_E2] = _S_RGB_ERR + 6 + 2 * rowlen
+        st[_S_INV] = 0xFF if invert else 0
+        if method == BAYER:
+            for i, m in enumerate(_bayer()):
+                st[_S_BAYER + i] = (2 * m + 1) - 64
+        for i, rgb in enumerate(palette):
+            st[_S_PAL + 3 * i] = rgb[0]
+            st[_S_PAL + 3 * i + 1] = rgb[1]
+            st[_S_PAL + 3 * i + 2] = rgb[2]
+        self._state = st
+        self._tabs = lut
+        self._three = method == ATKINSON
+
+    # row maps row y of RGB triplets in rgb to palette indices in out. Error diffusion expects
+    # consecutive rows.
+    def row(self, y, rgb, out):
+        st = self._state
+        st[_S_Y] = y
+        _dither_rgb(rgb, out, st, self._tabs)
+        self._rotate(st)
@@ -0,0 +1,100 @@
+# Saving the frame shown on the panel to flash or SD, so that it survives a deep sleep and the
+# first update after waking can be a partial one. A state file holds a few ints describing the
+# display, some extra bytes, then the framebuffer run-length coded a row at a time with rle.py,
+# the offset of every row first so that it can be decoded row by row. It is written to a
+# temporary file first, so a reset while saving leaves the previous state intact.
+import os
+import rle
+from uarray import array
+
+_MAGIC = 0x32534653  # "SFS2"
+_HEADER = 5  # magic, info and extra lengths, row length, rows
+
+
+# save writes info (a sequence of ints), extra (bytes) and framebuffer fb, made of rows of rowLen
+# bytes, to path. If the frame is already coded by rle.compress_rows, pass its data and offsets
+# as coded and offsets.
+def save(path, info, extra, fb, rowLen, coded=None, offsets=None):
+    rows = len(fb) // rowLen
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(array("I", (_MAGIC, len(info), len(extra), rowLen, rows)))
+        f.write(array("i", info))
+        f.write(extra)
+        if coded is not None:
+            f.write(memoryview(offsets)[: rows + 1])
+            f.write(memoryview(coded)[: offsets[rows]])
+        else:
+            # the offsets are only known once the rows are coded, they are written again after
+            at = f.tell()
+            offs = array("I", bytes(4 * (rows + 1)))
+            f.write(offs)
+            out = one = None
+            mv = memoryview(fb)
+            for r in range(rows):
+                out, one = rle.compress_rows(mv[r * rowLen : (r + 1) * rowLen], rowLen, out, one)
+                f.write(memoryview(out)[: one[1]])
+                offs[r + 1] = offs[r] + one[1]
+            f.seek(at)
+            f.write(offs)
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    os.rename(tmp, path)
+
+
+# _open opens path and reads the header, it returns (file, header, info, extra) or None if path
+# holds no valid state
+def _open(path):
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return None
+    hdr = f.read(4 * _HEADER)
+    if len(hdr) == 4 * _HEADER:
+        hdr = array("I", hdr)
+        if hdr[0] == _MAGIC:
+            info = f.read(4 * hdr[1])
+            extra = f.read(hdr[2])
+            if len(info) == 4 * hdr[1] and len(extra) == hdr[2]:
+                return f, hdr, array("i", info), extra
+    f.close()
+    return None
+
+
+# header returns (info, extra) as given to save, or None if path holds no valid state. It only
+# reads the start of the file, so the state can be checked before anything is decoded.
+def header(path):
+    st = _open(path)
+    if st is None:
+        return None
+    st[0].close()
+    return st[2], st[3]
+
+
+# load decodes the frame saved in path into fb, which must be made of rows of rowLen bytes like
+# the saved one. It returns False if it isn't, or the data is cut short or corrupt; fb may then
+# have been partly overwritten.
+def load(path, fb, rowLen):
+    st = _open(path)
+    if st is None:
+        return False
+    f, hdr, _, _ = st
+    with f:
+        rows = hdr[4]
+        if hdr[3] != rowLen or rows * rowLen != len(fb):
+            return False
+        offs = f.read(4 * (rows + 1))
+        if len(offs) != 4 * (rows + 1):
+            return False
+        offs = array("I", offs)
+        buf = bytearray(rle.bound(rowLen))
+        mv = memoryview(fb)
+        for r in range(rows):
+            n = offs[r + 1] - offs[r]
+            if n > len(buf) or f.readinto(memoryview(buf)[:n]) != n:
+                return False
+            if not rle.decompress(memoryview(buf)[:n], mv[r * rowLen : (r + 1) * rowLen]):
+                return False
+    return True
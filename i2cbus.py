@@ -0,0 +1,124 @@
+# I2CBus owns the I2C bus that the MCP23017, the TPS65186 and, on the Inkplate 6PLUS, the
+# touchscreen controller and frontlight DAC share. It has the methods of machine.I2C that the
+# drivers use, so it is passed wherever they take one, and adds:
+# - acquire()/release() around sequences that must not be interleaved with other traffic,
+#   like powering up and driving the panel. Work started from interrupts goes through defer(),
+#   which runs it right away unless the bus is held at its priority or higher; then it's queued
+#   and run when the bus is released, highest priority first. A single transfer never needs
+#   this: scheduled callbacks run between bytecodes, not in the middle of one.
+# - write8/writeReg8/readReg8, which move a byte through preallocated buffers.
+# - Counts of transactions and bytes per device address, see stats().
+from uarray import array
+
+BACKGROUND = 0
+INPUT = 1
+DISPLAY = 2
+
+
+class I2CBus:
+    # i2c is the machine.I2C to use, queue how many deferred jobs can wait at most
+    def __init__(self, i2c, queue=4):
+        self.i2c = i2c
+        self._held = []  # priorities of the current holders
+        self._jobs = []  # deferred (priority, fn, arg)
+        self._queue = queue
+        self._buf1 = bytearray(1)
+        self._stats = {}  # address -> [transactions, bytes]
+
+    def _count(self, addr, n):
+        s = self._stats.get(addr)
+        if s is None:
+            s = self._stats[addr] = array("I", (0, 0))
+        s[0] += 1
+        s[1] += n
+
+    # ===== machine.I2C methods
+
+    def writeto(self, addr, buf, stop=True):
+        self._count(addr, len(buf))
+        return self.i2c.writeto(addr, buf, stop)
+
+    def readfrom(self, addr, n, stop=True):
+        self._count(addr, n)
+        return self.i2c.readfrom(addr, n, stop)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        self._count(addr, len(buf))
+        self.i2c.readfrom_into(addr, buf, stop)
+
+    def writeto_mem(self, addr, reg, buf):
+        self._count(addr, len(buf) + 1)
+        self.i2c.writeto_mem(addr, reg, buf)
+
+    def readfrom_mem(self, addr, reg, n):
+        self._count(addr, n + 1)
+        return self.i2c.readfrom_mem(addr, reg, n)
+
+    def readfrom_mem_into(self, addr, reg, buf):
+        self._count(addr, len(buf) + 1)
+        self.i2c.readfrom_mem_into(addr, reg, buf)
+
+    def scan(self):
+        return self.i2c.scan()
+
+    # ===== single bytes without allocating
+
+    # write8 sends byte v to a device that has no registers
+    def write8(self, addr, v):
+        self._buf1[0] = v
+        self.writeto(addr, self._buf1)
+
+    def writeReg8(self, addr, reg, v):
+        self._buf1[0] = v
+        self.writeto_mem(addr, reg, self._buf1)
+
+    def readReg8(self, addr, reg):
+        self.readfrom_mem_into(addr, reg, self._buf1)
+        return self._buf1[0]
+
+    # ===== access priorities
+
+    # acquire holds the bus at priority level until the matching release
+    def acquire(self, level=DISPLAY):
+        self._held.append(level)
+
+    # release ends the last acquire and, once the bus is free, runs the deferred jobs
+    def release(self):
+        if self._held:
+            self._held.pop()
+        while self._jobs and not self._held:
+            best = 0
+            for i in range(1, len(self._jobs)):
+                if self._jobs[i][0] > self._jobs[best][0]:
+                    best = i
+            _, fn, arg = self._jobs.pop(best)
+            fn(arg)
+
+    # busy returns whether the bus is held at priority level or higher
+    def busy(self, level=INPUT):
+        for h in self._held:
+            if h >= level:
+                return True
+        return False
+
+    # defer calls fn(arg) now if the bus is not busy at priority level, or else queues it for
+    # when it's released; fn is only queued once. It returns False if the queue is full.
+    def defer(self, fn, arg=None, level=INPUT):
+        if not self.busy(level):
+            fn(arg)
+            return True
+        for job in self._jobs:
+            if job[1] is fn:
+                return True
+        if len(self._jobs) >= self._queue:
+            return False
+        self._jobs.append((level, fn, arg))
+        return True
+
+    # stats returns {address: (transactions, bytes)} since the last reset, bytes counting the
+    # register address of register reads and writes
+    def stats(self):
+        return {a: (s[0], s[1]) for a, s in self._stats.items()}
+
+    def resetStats(self):
+        self._stats = {}
@@ -0,0 +1,158 @@
+# ImageCache keeps images that drawImageFile has decoded, dithered and packed for the panel in
+# a directory on the SD card, so drawing the same image again is one sequential read of the
+# framebuffer bytes it covers instead of a decode. Entries are keyed by the source file's path,
+# size and modification time plus everything that affects the output (framebuffer format,
+# rotation, position, scaling and dithering). Once the entries grow over the byte budget the
+# least recently used ones are deleted.
+import os
+import hashlib
+from binascii import hexlify
+from uarray import array
+from imagesink import FMT_NIBBLE
+
+_SHIFT = (3, 2, 1)  # log2 of pixels per byte for FMT_MONO, FMT_GS2 and FMT_NIBBLE
+_HEADER = 20  # format, x, y, w and h of the stored rectangle as 32-bit ints
+
+
+# physicalRect returns the framebuffer rectangle (x, y, w, h) covered by a logical rectangle,
+# using the same transforms as put_row
+def physicalRect(cols, rows, rot, x, y, w, h):
+    if rot == 0:
+        return x, y, w, h
+    if rot == 1:
+        return cols - y - h, x, h, w
+    if rot == 2:
+        return cols - x - w, rows - y - h, w, h
+    return y, rows - x - w, h, w
+
+
+# _mask returns the bits of a framebuffer byte holding pixels a..b-1, which must all be in the
+# same byte
+def _mask(fmt, a, b):
+    sh = _SHIFT[fmt]
+    bits = 8 >> sh
+    m = 0
+    for px in range(a, b):
+        k = px & ((1 << sh) - 1)
+        # 6COLOR nibbles are packed leftmost pixel first, framebuf formats the other way round
+        m |= ((1 << bits) - 1) << (8 - bits * (k + 1) if fmt == FMT_NIBBLE else bits * k)
+    return m
+
+
+class ImageCache:
+    # path is the cache directory, budget the total size of the cached entries in bytes
+    def __init__(self, path="/sd/imagecache", budget=1024 * 1024):
+        self._dir = path
+        self._budget = budget
+        self._index = None  # [name, size] pairs, least recently used first
+        try:
+            os.mkdir(path)
+        except OSError:
+            pass
+
+    # key returns the name of the entry for the image file at path drawn with params, which
+    # must cover every setting that affects the output
+    def key(self, path, *params):
+        st = os.stat(path)
+        h = hashlib.sha256(repr((path, st[6], st[8]) + params).encode())
+        return hexlify(h.digest()[:8]).decode()
+
+    def _loadIndex(self):
+        if self._index is not None:
+            return
+        self._index = []
+        try:
+            with open(self._dir + "/index", "r") as f:
+                for line in f:
+                    name, size = line.split()
+                    self._index.append([name, int(size)])
+        except (OSError, ValueError):
+            pass
+
+    def _saveIndex(self):
+        with open(self._dir + "/index", "w") as f:
+            for name, size in self._index:
+                f.write("%s %d\n" % (name, size))
+
+    # _use moves an entry to the most recently used end of the index
+    def _use(self, name, size):
+        self._loadIndex()
+        for e in self._index:
+            if e[0] == name:
+                self._index.remove(e)
+                break
+        self._index.append([name, size])
+
+    # load copies a cached entry into the framebuffer fb of the given format that is cols
+    # physical pixels wide. It returns False if there is no such entry.
+    def load(self, name, fb, fmt, cols):
+        try:
+            f = open(self._dir + "/" + name, "rb")
+        except OSError:
+            return False
+        with f:
+            hdr = f.read(_HEADER)
+            if len(hdr) < _HEADER:
+                return False
+            hdr = array("i", hdr)
+            if hdr[0] != fmt:
+                return False
+            px, py, pw, ph = hdr[1], hdr[2], hdr[3], hdr[4]
+            sh = _SHIFT[fmt]
+            b0 = px >> sh
+            b1 = ((px + pw - 1) >> sh) + 1
+            n = b1 - b0
+            # pixels outside the rectangle that share its first or last byte must be kept
+            m0 = _mask(fmt, px, min(px + pw, (b0 + 1) << sh))
+            m1 = _mask(fmt, max(px, (b1 - 1) << sh), px + pw)
+            stride = cols >> sh
+            buf = bytearray(n)
+            mv = memoryview(fb)
+            for r in range(ph):
+                if f.readinto(buf) != n:
+                    return False
+                off = (py + r) * stride + b0
+                first = fb[off]
+                last = fb[off + n - 1]
+                mv[off : off + n] = buf
+                fb[off + n - 1] = (last & ~m1) | (buf[n - 1] & m1)
+                fb[off] = (first & ~m0) | (buf[0] & m0)
+        self._use(name, _HEADER + n * ph)
+        self._saveIndex()
+        return True
+
+    # store saves the physical rectangle (px, py, pw, ph) of the framebuffer fb as entry name,
+    # then deletes least recently used entries until the cache fits its budget again
+    def store(self, name, fb, fmt, cols, px, py, pw, ph):
+        sh = _SHIFT[fmt]
+        b0 = px >> sh
+        n = ((px + pw - 1) >> sh) + 1 - b0
+        size = _HEADER + n * ph
+        if size > self._budget:
+            return
+        stride = cols >> sh
+        mv = memoryview(fb)
+        path = self._dir + "/" + name
+        try:
+            with open(path, "wb") as f:
+                f.write(array("i", (fmt, px, py, pw, ph)))
+                for r in range(ph):
+                    off = (py + r) * stride + b0
+                    f.write(mv[off : off + n])
+        except OSError:
+            # most likely a full card, don't leave half an entry behind
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return
+        self._use(name, size)
+        total = sum(e[1] for e in self._index)
+        while total > self._budget:
+            old, oldSize = self._index.pop(0)
+            total -= oldSize
+            try:
+                os.remove(self._dir + "/" + old)
+            except OSError:
+                pass
+        self._saveIndex()
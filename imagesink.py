@@ -0,0 +1,289 @@
+# ImageSink is the last stage of the image pipeline: image decoders (bmp.py, png.py, jpeg.py)
+# hand it one row of 8-bit luminance at a time, it dithers the row to the values the panel
+# understands and packs them straight into the framebuffer bytes. Only a single row of output
+# is buffered, so drawing an image costs O(width) RAM.
+# drawImage sits in front of it to crop and scale images on the fly.
+import micropython
+from micropython import const
+from uarray import array
+from dither import ColorDither, Dither, NONE
+
+# Framebuffer layouts understood by put_row
+FMT_MONO = const(0)  # 1 bit per pixel, bit 0 is the leftmost pixel (framebuf.MONO_HMSB)
+FMT_GS2 = const(1)  # 2 bits per pixel, bits 0-1 are the leftmost pixel (framebuf.GS2_HMSB)
+FMT_NIBBLE = const(2)  # 4 bits per pixel, high nibble is the leftmost pixel (Inkplate 6COLOR)
+
+# Indices into the geometry array handed to put_row (viper functions take at most 4 args)
+_G_FMT = const(0)
+_G_COLS = const(1)
+_G_ROWS = const(2)
+_G_ROT = const(3)
+_G_X = const(4)
+_G_Y = const(5)
+_G_SKIP = const(6)
+
+
+# put_row writes n pixel values from src into a packed framebuffer of cols x rows physical
+# pixels, as a horizontal run starting at logical (x, y). rot selects how logical coordinates
+# map onto the physical framebuffer, using the same transforms as Inkplate.writePixel
+# (0: identity, 1: 90, 2: 180, 3: 270 degrees). The first skip values of src are ignored.
+# The caller must have clipped the run to the screen.
+@micropython.viper
+def put_row(fb, geom, src, n: int):
+    g = ptr32(geom)
+    fmt = int(g[_G_FMT])
+    cols = int(g[_G_COLS])
+    rows = int(g[_G_ROWS])
+    rot = int(g[_G_ROT])
+    x = int(g[_G_X])
+    y = int(g[_G_Y])
+    s = ptr8(src)
+    si = int(g[_G_SKIP])
+    d = ptr8(fb)
+    for i in range(n):
+        lx = x + i
+        if rot == 0:
+            px = lx
+            py = y
+        elif rot == 1:
+            px = cols - 1 - y
+            py = lx
+        elif rot == 2:
+            px = cols - 1 - lx
+            py = rows - 1 - y
+        else:
+            px = y
+            py = rows - 1 - lx
+        v = int(s[si + i])
+        pos = py * cols + px
+        if fmt == FMT_MONO:
+            ix = pos >> 3
+            bit = 1 << (px & 7)
+            if v:
+                d[ix] = d[ix] | bit
+            else:
+                d[ix] = d[ix] & (0xFF ^ bit)
+        elif fmt == FMT_GS2:
+            ix = pos >> 2
+            sh = (px & 3) << 1
+            d[ix] = (d[ix] & (0xFF ^ (3 << sh))) | ((v & 3) << sh)
+        else:
+            ix = pos >> 1
+            if px & 1:
+                d[ix] = (d[ix] & 0xF0) | (v & 0xF)
+            else:
+                d[ix] = (d[ix] & 0x0F) | ((v & 0xF) << 4)
+
+
+# Panel value of each grey level, from black to white, for the framebuffer formats
+_LEVELS = {
+    FMT_MONO: (1, 0),
+    FMT_GS2: (0, 1, 2, 3),
+    FMT_NIBBLE: (0, 1),  # BLACK and WHITE of the 6COLOR palette
+}
+
+
+# ImageSink places rows of an image that is w pixels wide with its top-left corner at logical
+# (x, y) into a framebuffer. fmt, cols, rows and rot describe the framebuffer as for put_row.
+# Rows are reduced to the panel's grey levels with the given dither method (see dither.py).
+# If a palette of (r, g, b) colours is given, rows are taken as RGB instead and mapped to
+# indices into the palette; rgb tells decoders which kind of rows to produce.
+class ImageSink:
+    def __init__(
+        self, fb, fmt, cols, rows, rot, x, y, w, invert=False, dither=NONE, palette=None
+    ):
+        if rot == 0 or rot == 2:
+            lw, lh = cols, rows
+        else:
+            lw, lh = rows, cols
+        # clip the horizontal run once, rows get clipped as they arrive
+        skip = -x if x < 0 else 0
+        self._n = min(w, lw - x) - skip
+        self._y = y
+        self._lh = lh
+        self._fb = fb
+        self._geom = array("i", (fmt, cols, rows, rot, x + skip, y, skip))
+        self.rgb = palette is not None
+        if self.rgb:
+            self._dither = ColorDither(dither, w, palette, invert)
+        else:
+            self._dither = Dither(dither, w, _LEVELS[fmt], invert)
+        self._out = bytearray(w)
+
+    # row takes row j of the image as w bytes of luminance (or 3*w bytes of RGB), rows must
+    # arrive in order
+    def row(self, j, data):
+        ly = self._y + j
+        if self._n <= 0 or ly < 0 or ly >= self._lh:
+            return
+        self._dither.row(j, data, self._out)
+        self._geom[_G_Y] = ly
+        put_row(self._fb, self._geom, self._out, self._n)
+
+
+# Fit modes for drawImage
+FIT_NEAREST = const(0)  # nearest neighbour
+FIT_BOX = const(1)  # average of the source pixels under each output pixel, for downscaling
+
+# Layout of the column table handed to _sample, _box_add and _box_out
+_C_W = const(0)  # output pixels per row
+_C_BPP = const(1)  # bytes per pixel, 1 for luminance or 3 for RGB
+_C_MAP = const(2)  # source column of each output pixel (the first one for FIT_BOX), plus the
+# end of the last one, followed by 65536 / number of source columns of each output pixel
+
+
+# _sample picks the source pixel of every output pixel from a row of the source window
+@micropython.viper
+def _sample(src, dst, cols):
+    s = ptr8(src)
+    d = ptr8(dst)
+    c = ptr32(cols)
+    w = int(c[_C_W])
+    bpp = int(c[_C_BPP])
+    o = 0
+    for i in range(w):
+        j = int(c[_C_MAP + i]) * bpp
+        for k in range(bpp):
+            d[o] = s[j + k]
+            o += 1
+
+
+# _box_add adds the average of the source pixels under every output pixel to acc
+@micropython.viper
+def _box_add(src, acc, cols):
+    s = ptr8(src)
+    a = ptr32(acc)
+    c = ptr32(cols)
+    w = int(c[_C_W])
+    bpp = int(c[_C_BPP])
+    rcp = _C_MAP + w + 1
+    o = 0
+    for i in range(w):
+        j0 = int(c[_C_MAP + i])
+        j1 = int(c[_C_MAP + i + 1])
+        if j1 <= j0:
+            j1 = j0 + 1
+        r = int(c[rcp + i])
+        for k in range(bpp):
+            t = 0
+            j = j0
+            while j < j1:
+                t += int(s[j * bpp + k])
+                j += 1
+            a[o] = int(a[o]) + ((t * r + 32768) >> 16)
+            o += 1
+
+
+# _box_out writes the averages of the n rows summed in acc to dst, rcp being 65536 / n, and
+# clears acc
+@micropython.viper
+def _box_out(acc, dst, cols, rcp: int):
+    a = ptr32(acc)
+    d = ptr8(dst)
+    c = ptr32(cols)
+    n = int(c[_C_W]) * int(c[_C_BPP])
+    for i in range(n):
+        d[i] = (int(a[i]) * rcp + 32768) >> 16
+        a[i] = 0
+
+
+# _span returns the first source pixel and the end of the source pixels that output pixel u
+# of a run of n pixels covers, when src source pixels starting at c are scaled to n
+def _span(c, src, n, u, fit):
+    if fit == FIT_BOX:
+        a = c + u * src // n
+        return a, max(c + (u + 1) * src // n, a + 1)
+    a = c + (2 * u + 1) * src // (2 * n)
+    return a, a + 1
+
+
+# drawImage draws the crop rectangle (cx, cy, cw, ch) of img (a decoder from bmp.py, png.py
+# or jpeg.py), by default all of it, scaled to w x h pixels with its top-left corner at
+# logical (x, y) of a lw x lh screen. If only one of w and h is given the other follows from
+# the aspect ratio; with neither the image is drawn at its own size, JPEG images being shrunk
+# to fit the screen. fit is FIT_NEAREST or FIT_BOX. sink(x, y, w) must return an ImageSink
+# for a run of w pixels at (x, y). The logical rectangle (x, y, w, h) that was drawn on is
+# returned, or None if the image is off the screen.
+# Only the source rows and columns that end up on the screen are requested from the decoder,
+# and JPEG images are decoded at the smallest scale that still covers the target size.
+def drawImage(img, sink, lw, lh, x, y, w=None, h=None, crop=None, fit=FIT_NEAREST):
+    jpeg = hasattr(img, "setScale")
+    srcW = img.srcWidth if jpeg else img.width
+    srcH = img.srcHeight if jpeg else img.height
+    cx, cy, cw, ch = crop or (0, 0, srcW, srcH)
+    cx, cy = max(cx, 0), max(cy, 0)
+    cw, ch = min(cw, srcW - cx), min(ch, srcH - cy)
+    if cw <= 0 or ch <= 0:
+        return
+    if w is None and h is None:
+        if jpeg:
+            scale = 8
+            for s in (1, 2, 4):
+                if (cw + s - 1) // s <= lw - x and (ch + s - 1) // s <= lh - y:
+                    scale = s
+                    break
+            w, h = (cw + scale - 1) // scale, (ch + scale - 1) // scale
+        else:
+            w, h = cw, ch
+    elif w is None:
+        w = max(1, (h * cw + ch // 2) // ch)
+    elif h is None:
+        h = max(1, (w * ch + cw // 2) // cw)
+    if jpeg:
+        scale = 1
+        for s in (2, 4, 8):
+            if (cw + s - 1) // s >= w and (ch + s - 1) // s >= h:
+                scale = s
+        img.setScale(scale)
+        cx, cy = cx // scale, cy // scale
+        cw = min((cw + scale - 1) // scale, img.width - cx)
+        ch = min((ch + scale - 1) // scale, img.height - cy)
+    # the part of the target box that is on the screen, relative to the box
+    u0, u1 = max(0, -x), min(w, lw - x)
+    v0, v1 = max(0, -y), min(h, lh - y)
+    if u0 >= u1 or v0 >= v1:
+        return
+    s = sink(x + u0, y + v0, u1 - u0)
+    bpp = 3 if s.rgb else 1
+    # column table, relative to the first source column that is needed
+    n = u1 - u0
+    sx0 = _span(cx, cw, w, u0, fit)[0]
+    sx1 = _span(cx, cw, w, u1 - 1, fit)[1]
+    cols = array("i", bytes(4 * (_C_MAP + 2 * n + 1)))
+    cols[_C_W] = n
+    cols[_C_BPP] = bpp
+    for i in range(n):
+        a, b = _span(cx, cw, w, u0 + i, fit)
+        cols[_C_MAP + i] = a - sx0
+        cols[_C_MAP + n + 1 + i] = 65536 // (b - a)
+    cols[_C_MAP + n] = sx1 - sx0
+    out = bytearray(n * bpp)
+    acc = array("i", bytes(4 * n * bpp)) if fit == FIT_BOX else None
+    sy0 = _span(cy, ch, h, v0, fit)[0]
+    sy1 = _span(cy, ch, h, v1 - 1, fit)[1]
+    v = v0
+    first, end = _span(cy, ch, h, v, fit)
+    summed = 0
+    j = 0
+    for sy, row in img.rows(s.rgb, sx0, sy0, sx1, sy1):
+        if sy < first:
+            continue
+        if acc is None:
+            _sample(row, out, cols)
+        else:
+            _box_add(row, acc, cols)
+            summed += 1
+            if sy < end - 1:
+                continue
+            _box_out(acc, out, cols, 65536 // summed)
+            summed = 0
+        # when enlarging, several output rows come from the same source row
+        while v < v1 and end - 1 <= sy:
+            s.row(j, out)
+            j += 1
+            v += 1
+            if v < v1:
+                first, end = _span(cy, ch, h, v, fit)
+        if v >= v1:
+            break
+    return x + u0, y + v0, u1 - u0, v1 - v0
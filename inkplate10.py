@@ -3,11 +3,16 @@ import time
 import micropython
 import framebuf
 import os
-from machine import ADC, I2C, Pin, SDCard
+from machine import ADC, I2C, Pin, SDCard, Timer
 from uarray import array
 from mcp23017 import MCP23017
+from i2cbus import I2CBus, INPUT
 from micropython import const
 from shapes import Shapes
+from imagesink import ImageSink, drawImage, FMT_MONO, FMT_GS2
+from imagecache import physicalRect
+import rle
+import framestate
 
 from gfx import GFX
 from gfx_standard_font_01 import text_dict as std_font
@@ -34,6 +39,37 @@ WAVE_2B = (  # original mpy driver for Ink 6, differs from arduino driver below
 # {{0,0,0,0,0,0,1,0},{0,0,2,2,2,1,1,0},{0,2,1,1,2,2,1,0},{1,2,2,1,2,2,1,0},
 #  {0,2,1,2,2,2,1,0},{2,2,2,2,2,2,1,0},{0,0,0,0,2,1,2,0},{0,0,2,2,2,2,2,0}};
 
+# Refresh profiles for display(), see Inkplate.setRefreshProfile. Each one holds the clean
+# sequence run before the image as (pattern, repeats) steps for _Inkplate.clean, the phases of
+# the monochrome waveform (0=white, 1=black, 2=black and white, see InkplateMono._gen_luts),
+# and the first phase of WAVE_2B used in greyscale mode.
+PROFILE_QUALITY = const(0)
+PROFILE_BALANCED = const(1)
+PROFILE_FAST = const(2)
+PROFILES = (
+    # quality: 50 clean passes, 6 mono phases
+    (
+        ((0, 1), (1, 12), (2, 1), (0, 11), (2, 1), (1, 12), (2, 1), (0, 11)),
+        (1, 1, 1, 1, 1, 2),
+        0,
+    ),
+    # balanced: 20 clean passes, 4 mono phases
+    (((0, 1), (1, 4), (2, 1), (0, 4), (2, 1), (1, 4), (2, 1), (0, 4)), (1, 1, 1, 2), 0),
+    # fast: 10 clean passes, 2 mono phases
+    (((1, 4), (2, 1), (0, 4), (2, 1)), (1, 2), 0),
+)
+
+# Temperature compensation of the refresh profiles: the panel responds slower in the cold and
+# faster when warm. display() uses the first band whose upper limit (degrees C) is above the
+# panel temperature. Its second value is the number of black phases added to the monochrome
+# waveform (removed when negative, keeping at least one), the third the number of leading
+# WAVE_2B phases at least skipped in greyscale mode.
+TEMP_BANDS = (
+    (10, 2, 0),  # cold
+    (20, 0, 0),  # cool
+    (1000, -1, 0),  # room temperature and above
+)
+
 TPS65186_addr = const(0x48)  # I2C address
 
 # ESP32 GPIO set and clear registers to twiddle 32 gpio bits at once
@@ -59,43 +95,60 @@ EPD_SPH = const(0x00000002)  # in W1Tx1
 
 
 class _Inkplate:
+    profile = PROFILE_QUALITY  # refresh profile used by display(), index into PROFILES
+    temp_interval_ms = 5 * 60 * 1000  # how long a temperature reading is used by temperature()
+    _temp = None  # last temperature reading
+    _temp_at = 0  # time of the last temperature reading in ticks_ms
+    idle_ms = 0  # how long the panel stays powered after an update, see release
+    power_timer = 0  # id of the machine.Timer used to power off after idle_ms
+    _holds = 0  # open sessions keeping the panel powered
+    _busy = False  # whether an update is driving the panel
+    _idle_at = 0  # end of the last update in ticks_ms
+    _timer = None
+    sampler = None  # background sensor Sampler, see Inkplate.startSampler
+
     @classmethod
     def init(cls, i2c):
         cls._i2c = i2c
         cls._mcp23017 = MCP23017(i2c)
-        # Display control lines
-        cls.EPD_CL = Pin(0, Pin.OUT, value=0)
-        cls.EPD_LE = Pin(2, Pin.OUT, value=0)
-        cls.EPD_CKV = Pin(32, Pin.OUT, value=0)
-        cls.EPD_SPH = Pin(33, Pin.OUT, value=1)
-        cls.EPD_OE = cls._mcp23017.pin(0, Pin.OUT, value=0)
-        cls.EPD_GMODE = cls._mcp23017.pin(1, Pin.OUT, value=0)
-        cls.EPD_SPV = cls._mcp23017.pin(2, Pin.OUT, value=1)
-        # Display data lines - we only use the Pin class to init the pins
-        Pin(4, Pin.OUT)
-        Pin(5, Pin.OUT)
-        Pin(18, Pin.OUT)
-        Pin(19, Pin.OUT)
-        Pin(23, Pin.OUT)
-        Pin(25, Pin.OUT)
-        Pin(26, Pin.OUT)
-        Pin(27, Pin.OUT)
-        # TPS65186 power regulator control
-        cls.TPS_WAKEUP = cls._mcp23017.pin(3, Pin.OUT, value=0)
-        cls.TPS_PWRUP = cls._mcp23017.pin(4, Pin.OUT, value=0)
-        cls.TPS_VCOM = cls._mcp23017.pin(5, Pin.OUT, value=0)
-        cls.TPS_INT = cls._mcp23017.pin(6, Pin.IN)
-        cls.TPS_PWR_GOOD = cls._mcp23017.pin(7, Pin.IN)
-        # Misc
-        cls.GPIO0_PUP = cls._mcp23017.pin(8, Pin.OUT, value=0)
-        cls.VBAT_EN = cls._mcp23017.pin(9, Pin.OUT, value=1)
-        cls.VBAT = ADC(Pin(35))
-        cls.VBAT.atten(ADC.ATTN_11DB)
-        cls.VBAT.width(ADC.WIDTH_12BIT)
-        # Touch sensors
-        cls.TOUCH1 = cls._mcp23017.pin(10, Pin.IN)
-        cls.TOUCH2 = cls._mcp23017.pin(11, Pin.IN)
-        cls.TOUCH3 = cls._mcp23017.pin(12, Pin.IN)
+        # pin setup is sent to the MCP23017 in a few burst writes at the end of the block
+        with cls._mcp23017.batch():
+            # Display control lines
+            cls.EPD_CL = Pin(0, Pin.OUT, value=0)
+            cls.EPD_LE = Pin(2, Pin.OUT, value=0)
+            cls.EPD_CKV = Pin(32, Pin.OUT, value=0)
+            cls.EPD_SPH = Pin(33, Pin.OUT, value=1)
+            cls.EPD_OE = cls._mcp23017.pin(0, Pin.OUT, value=0)
+            cls.EPD_GMODE = cls._mcp23017.pin(1, Pin.OUT, value=0)
+            cls.EPD_SPV = cls._mcp23017.pin(2, Pin.OUT, value=1)
+            # Display data lines - we only use the Pin class to init the pins
+            Pin(4, Pin.OUT)
+            Pin(5, Pin.OUT)
+            Pin(18, Pin.OUT)
+            Pin(19, Pin.OUT)
+            Pin(23, Pin.OUT)
+            Pin(25, Pin.OUT)
+            Pin(26, Pin.OUT)
+            Pin(27, Pin.OUT)
+            # TPS65186 power regulator control
+            cls.TPS_WAKEUP = cls._mcp23017.pin(3, Pin.OUT, value=0)
+            cls.TPS_PWRUP = cls._mcp23017.pin(4, Pin.OUT, value=0)
+            cls.TPS_VCOM = cls._mcp23017.pin(5, Pin.OUT, value=0)
+            cls.TPS_INT = cls._mcp23017.pin(6, Pin.IN)
+            cls.TPS_PWR_GOOD = cls._mcp23017.pin(7, Pin.IN)
+            # pins that are switched together, one write each
+            cls.TPS_POWER = cls._mcp23017.group(3, 4, 5)  # TPS_WAKEUP, TPS_PWRUP, TPS_VCOM
+            cls.EPD_DRIVE = cls._mcp23017.group(0, 1)  # EPD_OE, EPD_GMODE
+            # Misc
+            cls.GPIO0_PUP = cls._mcp23017.pin(8, Pin.OUT, value=0)
+            cls.VBAT_EN = cls._mcp23017.pin(9, Pin.OUT, value=1)
+            cls.VBAT = ADC(Pin(35))
+            cls.VBAT.atten(ADC.ATTN_11DB)
+            cls.VBAT.width(ADC.WIDTH_12BIT)
+            # Touch sensors
+            cls.TOUCH1 = cls._mcp23017.pin(10, Pin.IN)
+            cls.TOUCH2 = cls._mcp23017.pin(11, Pin.IN)
+            cls.TOUCH3 = cls._mcp23017.pin(12, Pin.IN)
 
         cls._on = False  # whether panel is powered on or not
 
@@ -104,7 +157,7 @@ class _Inkplate:
 
     @classmethod
     def begin(self):
-        _Inkplate.init(I2C(0, scl=Pin(22), sda=Pin(21)))
+        _Inkplate.init(I2CBus(I2C(0, scl=Pin(22), sda=Pin(21))))
 
         self.ipg = InkplateGS2()
         self.ipm = InkplateMono()
@@ -154,7 +207,7 @@ class _Inkplate:
     @classmethod
     def read_temperature(cls):
         # start temperature measurement and wait 5 ms
-        cls._i2c.writeto_mem(TPS65186_addr, 0x0D, bytes((0x80,)))
+        cls._tps65186_write(0x0D, 0x80)
         time.sleep_ms(5)
 
         # request temperature data from panel
@@ -165,26 +218,53 @@ class _Inkplate:
         cls.temperatureInt = int.from_bytes(cls._temperature, "big", True)
         return cls.temperatureInt
 
+    # temperature returns the panel temperature, reading it again only if the last reading is
+    # older than temp_interval_ms. The panel must be powered on for a new reading.
+    @classmethod
+    def temperature(cls):
+        if cls.sampler is not None:
+            t = cls.sampler.temperature(cls.temp_interval_ms)
+            if t is not None:
+                return t
+        now = time.ticks_ms()
+        if cls._temp is None or time.ticks_diff(now, cls._temp_at) > cls.temp_interval_ms:
+            cls._temp = cls.read_temperature()
+            cls._temp_at = now
+        return cls._temp
+
+    # temp_band returns the waveform adjustments (extra mono phases, GS2 phases skipped) of the
+    # TEMP_BANDS entry for the current panel temperature
+    @classmethod
+    def temp_band(cls):
+        t = cls.temperature()
+        for band in TEMP_BANDS:
+            if t < band[0]:
+                return band[1], band[2]
+        return TEMP_BANDS[-1][1], TEMP_BANDS[-1][2]
+
     # _tps65186_write writes an 8-bit value to a register
     @classmethod
     def _tps65186_write(cls, reg, v):
-        cls._i2c.writeto_mem(TPS65186_addr, reg, bytes((v,)))
+        cls._i2c.writeReg8(TPS65186_addr, reg, v)
 
     # _tps65186_read reads an 8-bit value from a register
     @classmethod
     def _tps65186_read(cls, reg):
-        cls._i2c.readfrom_mem(TPS65186_addr, reg, 1)[0]
+        return cls._i2c.readReg8(TPS65186_addr, reg)
 
     # power_on turns the voltage regulator on and wakes up the display (GMODE and OE)
     @classmethod
     def power_on(cls):
+        if not cls._busy:
+            cls._busy = True
+            cls._i2c.acquire()  # reads from interrupts wait for the update, see I2CBus
         if cls._on:
+            # still powered after an earlier update, see release
+            cls.EPD_DRIVE(1)
             return
         cls._on = True
         # turn on power regulator
-        cls.TPS_WAKEUP(1)
-        cls.TPS_PWRUP(1)
-        cls.TPS_VCOM(1)
+        cls.TPS_POWER(1)
         # enable all rails
         cls._tps65186_write(0x01, 0x3F)  # ???
         time.sleep_ms(40)
@@ -192,23 +272,75 @@ class _Inkplate:
         time.sleep_ms(2)
         cls._temperature = cls._tps65186_read(1)
         # wake-up display
-        cls.EPD_GMODE(1)
-        cls.EPD_OE(1)
+        cls.EPD_DRIVE(1)
 
     # power_off puts the display to sleep and cuts the power
     # TODO: also tri-state gpio pins to avoid current leakage during deep-sleep
     @classmethod
     def power_off(cls):
+        if cls._busy:
+            cls._busy = False
+            cls._i2c.release()
         if not cls._on:
             return
         cls._on = False
         # put display to sleep
-        cls.EPD_GMODE(0)
-        cls.EPD_OE(0)
-        # turn off power regulator
+        cls.EPD_DRIVE(0)
+        # turn off power regulator, starting its power-down sequence before it goes to sleep
         cls.TPS_PWRUP(0)
-        cls.TPS_WAKEUP(0)
-        cls.TPS_VCOM(0)
+        cls.TPS_POWER(0)
+
+    # release ends an update. The panel is turned off right away unless a session is open (see
+    # hold) or idle_ms is set, then only the display is put to sleep and the regulator stays
+    # on, so that the next update skips the power up sequence. Drivers call it from a finally
+    # block, so that an error during an update doesn't leave the panel and the I2C bus held.
+    @classmethod
+    def release(cls):
+        cls._busy = False
+        if cls._holds:
+            cls.EPD_DRIVE(0)
+        else:
+            cls._settle()
+        cls._i2c.release()
+
+    # _settle powers off now, or after idle_ms without another update
+    @classmethod
+    def _settle(cls):
+        if cls.idle_ms <= 0:
+            cls.power_off()
+            return
+        cls.EPD_DRIVE(0)
+        cls._idle_at = time.ticks_ms()
+        cls._arm(cls.idle_ms)
+
+    @classmethod
+    def _arm(cls, ms):
+        if cls._timer is None:
+            cls._timer = Timer(cls.power_timer)
+        cls._timer.init(mode=Timer.ONE_SHOT, period=max(ms, 1), callback=cls._idle)
+
+    # _idle runs from the timer (ESP32 timer callbacks are scheduled, so I2C can be used) and
+    # powers off if nothing has used the panel for idle_ms
+    @classmethod
+    def _idle(cls, _):
+        if cls._holds or cls._busy or not cls._on:
+            return
+        left = cls.idle_ms - time.ticks_diff(time.ticks_ms(), cls._idle_at)
+        if left > 0:
+            cls._arm(left)
+        else:
+            cls.power_off()
+
+    # hold keeps the panel powered across updates until the matching unhold
+    @classmethod
+    def hold(cls):
+        cls._holds += 1
+
+    @classmethod
+    def unhold(cls):
+        cls._holds -= 1
+        if not cls._holds and cls._on and not cls._busy:
+            cls._settle()
 
     # ===== Methods that are independent of pixel bit depth
 
@@ -308,15 +440,43 @@ class _Inkplate:
             cls.vscan_start()
             cls.fill_screen(data)
 
+    # clean_seq runs a clean sequence of (pattern, repeats) steps and returns the number of passes
+    @classmethod
+    def clean_seq(cls, seq):
+        n = 0
+        for patt, rep in seq:
+            cls.clean(patt, rep)
+            n += rep
+        return n
+
+
+# _mono_phases returns the phases of a monochrome waveform with extra black phases added at the
+# start, or with -extra black phases removed if it is negative (but keeping at least one)
+def _mono_phases(phases, extra):
+    if extra >= 0:
+        return (1,) * extra + phases
+    phases = list(phases)
+    while extra < 0 and phases.count(1) > 1:
+        phases.remove(1)
+        extra += 1
+    return phases
+
+
+# _Session keeps the panel powered for the updates in a with block, see Inkplate.session
+class _Session:
+    def __enter__(self):
+        _Inkplate.hold()
+        return self
+
+    def __exit__(self, *exc):
+        _Inkplate.unhold()
+
 
 class InkplateMono(framebuf.FrameBuffer):
     def __init__(self):
         self._framebuf = bytearray(D_ROWS * D_COLS // 8)
         super().__init__(self._framebuf, D_COLS, D_ROWS, framebuf.MONO_HMSB)
-        ip = InkplateMono
-        ip._gen_luts()
-        ip._wave = [ip.lut_blk, ip.lut_blk, ip.lut_blk,
-                    ip.lut_blk, ip.lut_blk, ip.lut_bw]
+        InkplateMono._gen_luts()
 
     # gen_luts generates the look-up tables to convert a nibble (4 bits) of pixels to the
     # 32-bits that need to be pushed into the gpio port.
@@ -383,47 +543,48 @@ class InkplateMono(framebuf.FrameBuffer):
     # display_mono sends the monochrome buffer to the display, clearing it first
     def display(self):
         ip = _Inkplate
-        ip.power_on()
-
-        # clean the display
-        t0 = time.ticks_ms()
-        ip.clean(0, 1)
-        ip.clean(1, 12)
-        ip.clean(2, 1)
-        ip.clean(0, 11)
-        ip.clean(2, 1)
-        ip.clean(1, 12)
-        ip.clean(2, 1)
-        ip.clean(0, 11)
-
-        # the display gets written N times
-        t1 = time.ticks_ms()
-        n = 0
-        send_row = InkplateMono._send_row
-        vscan_write = ip.vscan_write
-        fb = self._framebuf
-        for lut in self._wave:
-            ip.vscan_start()
-            # write all rows
-            r = D_ROWS - 1
-            while r >= 0:
-                send_row(lut, fb, r)
-                vscan_write()
-                r -= 1
-            n += 1
-
-        t2 = time.ticks_ms()
-        tc = time.ticks_diff(t1, t0)
-        td = time.ticks_diff(t2, t1)
-        tt = time.ticks_diff(t2, t0)
-        print(
-            "Mono: clean %dms (%dms ea), draw %dms (%dms ea), total %dms"
-            % (tc, tc // (4 + 22 + 24), td, td // len(self._wave), tt)
-        )
+        try:
+            ip.power_on()
+
+            # waveform adjustment for the panel temperature
+            extra, _ = ip.temp_band()
+
+            # clean the display
+            t0 = time.ticks_ms()
+            seq, mono, gs2 = PROFILES[ip.profile]
+            passes = ip.clean_seq(seq)
+
+            # the display gets written N times
+            t1 = time.ticks_ms()
+            n = 0
+            send_row = InkplateMono._send_row
+            vscan_write = ip.vscan_write
+            fb = self._framebuf
+            luts = (self.lut_wht, self.lut_blk, self.lut_bw)
+            wave = [luts[i] for i in _mono_phases(mono, extra)]
+            for lut in wave:
+                ip.vscan_start()
+                # write all rows
+                r = D_ROWS - 1
+                while r >= 0:
+                    send_row(lut, fb, r)
+                    vscan_write()
+                    r -= 1
+                n += 1
+
+            t2 = time.ticks_ms()
+            tc = time.ticks_diff(t1, t0)
+            td = time.ticks_diff(t2, t1)
+            tt = time.ticks_diff(t2, t0)
+            print(
+                "Mono: clean %dms (%dms ea), draw %dms (%dms ea), total %dms"
+                % (tc, tc // passes, td, td // len(wave), tt)
+            )
 
-        ip.clean(2, 2)
-        ip.clean(3, 1)
-        ip.power_off()
+            ip.clean(2, 2)
+            ip.clean(3, 1)
+        finally:
+            ip.release()
 
     # @micropython.viper
     def clear(self):
@@ -495,47 +656,47 @@ class InkplateGS2(framebuf.FrameBuffer):
     # display_mono sends the monochrome buffer to the display, clearing it first
     def display(self):
         ip = _Inkplate
-        ip.power_on()
-
-        # clean the display
-        t0 = time.ticks_ms()
-        ip.clean(0, 1)
-        ip.clean(1, 12)
-        ip.clean(2, 1)
-        ip.clean(0, 11)
-        ip.clean(2, 1)
-        ip.clean(1, 12)
-        ip.clean(2, 1)
-        ip.clean(0, 11)
-
-        # the display gets written N times
-        t1 = time.ticks_ms()
-        n = 0
-        send_row = InkplateGS2._send_row
-        vscan_write = ip.vscan_write
-        fb = self._framebuf
-        for lut in InkplateGS2._wave:
-            ip.vscan_start()
-            # write all rows
-            r = D_ROWS - 1
-            while r >= 0:
-                send_row(lut, fb, r)
-                vscan_write()
-                r -= 1
-            n += 1
-
-        t2 = time.ticks_ms()
-        tc = time.ticks_diff(t1, t0)
-        td = time.ticks_diff(t2, t1)
-        tt = time.ticks_diff(t2, t0)
-        print(
-            "GS2: clean %dms (%dms ea), draw %dms (%dms ea), total %dms"
-            % (tc, tc // (4 + 22 + 24), td, td // len(InkplateGS2._wave), tt)
-        )
+        try:
+            ip.power_on()
+
+            # waveform adjustment for the panel temperature
+            _, skip = ip.temp_band()
+
+            # clean the display
+            t0 = time.ticks_ms()
+            seq, mono, gs2 = PROFILES[ip.profile]
+            passes = ip.clean_seq(seq)
+
+            # the display gets written N times
+            t1 = time.ticks_ms()
+            n = 0
+            send_row = InkplateGS2._send_row
+            vscan_write = ip.vscan_write
+            fb = self._framebuf
+            wave = InkplateGS2._wave[max(gs2, skip):]
+            for lut in wave:
+                ip.vscan_start()
+                # write all rows
+                r = D_ROWS - 1
+                while r >= 0:
+                    send_row(lut, fb, r)
+                    vscan_write()
+                    r -= 1
+                n += 1
+
+            t2 = time.ticks_ms()
+            tc = time.ticks_diff(t1, t0)
+            td = time.ticks_diff(t2, t1)
+            tt = time.ticks_diff(t2, t0)
+            print(
+                "GS2: clean %dms (%dms ea), draw %dms (%dms ea), total %dms"
+                % (tc, tc // passes, td, td // len(wave), tt)
+            )
 
-        ip.clean(2, 1)  # ??
-        ip.clean(3, 1)
-        ip.power_off()
+            ip.clean(2, 1)  # ??
+            ip.clean(3, 1)
+        finally:
+            ip.release()
 
     # @micropython.viper
     def clear(self):
@@ -554,57 +715,149 @@ Shapes.__mix_me_in(InkplateGS2)
 
 
 class InkplatePartial:
-    def __init__(self, base):
+    # With compressed set the reference copy is kept run-length coded row by row (see rle.py),
+    # so that it takes memory in proportion to what is on the screen rather than its size. The
+    # buffer it is coded into is reused, it keeps the size of the busiest frame coded so far.
+    def __init__(self, base, compressed=False):
         self._base = base
-        self._framebuf = bytearray(len(base._framebuf))
+        if compressed:
+            self._framebuf = bytearray(0)
+            self._offsets = array("I", bytes(4 * (D_ROWS + 1)))
+            self._line = bytearray(D_COLS >> 3)  # scratch for the row being sent
+        else:
+            self._framebuf = bytearray(len(base._framebuf))
+            self._line = None
         InkplatePartial._gen_lut_mono()
 
-    # start makes a reference copy of the current framebuffer
-    def start(self):
-        self._framebuf[:] = self._base._framebuf[:]
+    # start makes a reference copy of the current framebuffer, or of its rows y0..y1-1 only
+    def start(self, y0=0, y1=D_ROWS):
+        ROW_LEN = D_COLS >> 3
+        if self._line is None:
+            mv = memoryview(self._base._framebuf)
+            self._framebuf[y0 * ROW_LEN : y1 * ROW_LEN] = mv[y0 * ROW_LEN : y1 * ROW_LEN]
+            return
+        if y0 == 0 and y1 == D_ROWS:
+            self._framebuf, self._offsets = rle.compress_rows(
+                self._base._framebuf, ROW_LEN, self._framebuf, self._offsets
+            )
+            return
+        # code the rows again and put them in place of the old ones, moving the rows after them
+        mv = memoryview(self._base._framebuf)
+        mid, moffs = rle.compress_rows(mv[y0 * ROW_LEN : y1 * ROW_LEN], ROW_LEN)
+        offs = self._offsets
+        n = moffs[y1 - y0]
+        head = offs[y0]
+        tail = offs[y1]
+        end = offs[D_ROWS]
+        old = memoryview(self._framebuf)
+        if n == tail - head:
+            old[head:tail] = memoryview(mid)[:n]
+        else:
+            out = bytearray(head + n + end - tail)
+            out[:head] = old[:head]
+            out[head : head + n] = memoryview(mid)[:n]
+            out[head + n :] = old[tail:end]
+            self._framebuf = out
+            old = None
+            delta = n - (tail - head)
+            for r in range(y1 + 1, D_ROWS + 1):
+                offs[r] += delta
+        for r in range(y0 + 1, y1 + 1):
+            offs[r] = head + moffs[r - y0]
+
+    # save writes the reference copy, that is what is on the panel, to path, see framestate.py
+    def save(self, path, info, extra):
+        if self._line is None:
+            framestate.save(path, info, extra, self._framebuf, D_COLS >> 3)
+        else:
+            fb = self._base._framebuf  # only its size is used
+            framestate.save(path, info, extra, fb, D_COLS >> 3, self._framebuf, self._offsets)
+
+    # restore loads a frame written by save into the framebuffer and makes it the reference
+    # copy. It returns False if path holds no valid frame for this panel.
+    def restore(self, path):
+        if not framestate.load(path, self._base._framebuf, D_COLS >> 3):
+            return False
+        self.start()
+        return True
+
+    # changes returns the number of pixels that differ between the reference copy and the
+    # current framebuffer in each of bands horizontal bands of the panel, top band first. Only
+    # panel rows y0..y1-1 are compared, the bands outside of them count 0.
+    def changes(self, bands, y0=0, y1=D_ROWS):
+        band = (D_ROWS + bands - 1) // bands  # rows per band
+        counts = array("i", bytes(4 * bands))
+        nfb = self._base._framebuf
+        line = self._line
+        if line is None and y0 == 0 and y1 == D_ROWS:
+            InkplatePartial._count_changed(self._framebuf, nfb, counts, band)
+            return counts
+        ROW_LEN = D_COLS >> 3
+        mv = memoryview(nfb)
+        ofb = memoryview(self._framebuf)
+        old = line
+        one = array("i", (0,))
+        for r in range(y0, y1):
+            if line is None:
+                old = ofb[r * ROW_LEN : (r + 1) * ROW_LEN]
+            else:
+                rle.decompress_row(self._framebuf, self._offsets, r, line)
+            one[0] = 0
+            InkplatePartial._count_changed(old, mv[r * ROW_LEN : (r + 1) * ROW_LEN], one, 1)
+            counts[r // band] += one[0]
+        return counts
 
     # display the changes between our reference copy and the current framebuffer contents
     def display(self, x=0, y=0, w=D_COLS, h=D_ROWS):
         ip = _Inkplate
-        ip.power_on()
-
-        # the display gets written a couple of times
-        t0 = time.ticks_ms()
-        n = 0
-        send_row = InkplatePartial._send_row
-        skip_rows = InkplatePartial._skip_rows
-        vscan_write = ip.vscan_write
-        nfb = self._base._framebuf  # new framebuffer
-        ofb = self._framebuf  # old framebuffer
-        lut = InkplatePartial._lut_mono
-        h -= 1
-        for _ in range(5):
-            ip.vscan_start()
-            r = D_ROWS - 1
-            # skip rows that supposedly have no change
-            if r > y + h:
-                skip_rows(r - (y + h))
-                r = y + h
-            # write changed rows
-            while r >= y:
-                send_row(lut, ofb, nfb, r)
-                vscan_write()
-                r -= 1
-            # skip remaining rows (doesn't seem to be necessary for Inkplate 6 but it is for 10)
-            if r > 0:
-                skip_rows(r)
-            n += 1
-
-        t1 = time.ticks_ms()
-        td = time.ticks_diff(t1, t0)
-        print(
-            "Partial: draw %dms (%dms/frame %dus/row) (y=%d..%d)"
-            % (td, td // n, td * 1000 // n // (D_ROWS - y), y, y + h + 1)
-        )
+        try:
+            ip.power_on()
+
+            # the display gets written a couple of times
+            t0 = time.ticks_ms()
+            n = 0
+            send_row = InkplatePartial._send_row
+            skip_rows = InkplatePartial._skip_rows
+            vscan_write = ip.vscan_write
+            nfb = self._base._framebuf  # new framebuffer
+            ofb = self._framebuf  # old framebuffer
+            line = self._line
+            offsets = self._offsets if line is not None else None
+            decompress_row = rle.decompress_row
+            lut = InkplatePartial._lut_mono
+            h -= 1
+            for _ in range(5):
+                ip.vscan_start()
+                r = D_ROWS - 1
+                # skip rows that supposedly have no change
+                if r > y + h:
+                    skip_rows(r - (y + h))
+                    r = y + h
+                # write changed rows
+                while r >= y:
+                    if line is not None:
+                        decompress_row(ofb, offsets, r, line)
+                        send_row(lut, line, nfb, r)
+                    else:
+                        send_row(lut, ofb, nfb, r)
+                    vscan_write()
+                    r -= 1
+                # skip remaining rows (doesn't seem to be necessary for Inkplate 6 but it is for 10)
+                if r > 0:
+                    skip_rows(r)
+                n += 1
+
+            t1 = time.ticks_ms()
+            td = time.ticks_diff(t1, t0)
+            print(
+                "Partial: draw %dms (%dms/frame %dus/row) (y=%d..%d)"
+                % (td, td // n, td * 1000 // n // (D_ROWS - y), y, y + h + 1)
+            )
 
-        ip.clean(2, 2)
-        ip.clean(3, 1)
-        ip.power_off()
+            ip.clean(2, 2)
+            ip.clean(3, 1)
+        finally:
+            ip.release()
 
     # gen_lut_mono generates a look-up tables to change the display from a nibble of old
     # pixels (4 bits = 4 pixels) to a nibble of new pixels. The LUT contains the
@@ -661,7 +914,42 @@ class InkplatePartial:
             rows -= 1
             time.sleep_us(50)
 
-    # _send_row writes a row of data to the display
+    # _count_changed adds the number of pixels that differ between old and new, which hold the
+    # same whole number of rows, to counts: rows 0..band-1 go to counts[0], the next band rows
+    # to counts[1] and so on
+    @micropython.viper
+    @staticmethod
+    def _count_changed(old, new, counts, band: int):
+        ROW_LEN = D_COLS >> 3  # length of row in bytes
+        o = ptr8(old)
+        n = ptr8(new)
+        c = ptr32(counts)
+        size = int(len(new))
+        end = ROW_LEN  # end of the current row
+        left = band  # rows left in the current band
+        b = 0
+        acc = 0
+        i = 0
+        while i < size:
+            x = int(o[i]) ^ int(n[i])
+            if x:
+                # count the set bits of x
+                x = x - ((x >> 1) & 0x55)
+                x = (x & 0x33) + ((x >> 2) & 0x33)
+                acc += (x + (x >> 4)) & 0x0F
+            i += 1
+            if i == end:
+                end += ROW_LEN
+                left -= 1
+                if left == 0:
+                    c[b] = int(c[b]) + acc
+                    acc = 0
+                    b += 1
+                    left = band
+        if acc:
+            c[b] = int(c[b]) + acc
+
+    # _send_row writes a row of data to the display. old_framebuf may also be just the old row.
     @micropython.viper
     @staticmethod
     def _send_row(lut_in, old_framebuf, new_framebuf, row: int):
@@ -673,9 +961,11 @@ class InkplatePartial:
         ofb = ptr8(old_framebuf)
         nfb = ptr8(new_framebuf)
         ix = int(row * ROW_LEN + (ROW_LEN - 1))  # index into framebuffer
+        # index into the old framebuffer is oix + ix
+        oix = 0 if int(len(old_framebuf)) > ROW_LEN else 0 - row * ROW_LEN
         lut = ptr32(lut_in)
         # send first byte
-        odata = int(ofb[ix])
+        odata = int(ofb[oix + ix])
         ndata = int(nfb[ix])
         ix -= 1
         w1tc0[0] = off
@@ -694,7 +984,7 @@ class InkplatePartial:
             w1tc0[0] = off
         # send the remaining bytes
         for c in range(ROW_LEN - 1):
-            odata = int(ofb[ix])
+            odata = int(ofb[oix + ix])
             ndata = int(nfb[ix])
             ix -= 1
             if odata == ndata:
@@ -718,6 +1008,34 @@ class Inkplate:
     BLACK = 1
     WHITE = 0
 
+    DITHER_NONE = 0
+    DITHER_FLOYD_STEINBERG = 1
+    DITHER_ATKINSON = 2
+    DITHER_BAYER = 3
+
+    FIT_NEAREST = 0
+    FIT_BOX = 1
+
+    PROFILE_QUALITY = 0
+    PROFILE_BALANCED = 1
+    PROFILE_FAST = 2
+
+    # keep the reference frame for partial updates run-length coded (set before begin)
+    PARTIAL_COMPRESSED = False
+
+    # update() refresh policy: the screen is split into UPDATE_BANDS horizontal bands. A full
+    # refresh is done when more than UPDATE_FULL_PERCENT of the pixels changed, or when a band
+    # that changed has already had GHOST_BUDGET partial updates since the last full refresh.
+    UPDATE_BANDS = 8
+    UPDATE_FULL_PERCENT = 30
+    GHOST_BUDGET = 20
+    _ghost = None  # partial updates per band since the last full refresh, array("H")
+
+    # bytes of compressed framebuffers kept by savePage
+    PAGE_CACHE_BUDGET = 256 * 1024
+    _pages = None
+    _touchpads = None
+
     _width = D_COLS
     _height = D_ROWS
 
@@ -741,11 +1059,11 @@ class Inkplate:
             print("Sd card could not be read")
 
     def begin(self):
-        _Inkplate.init(I2C(0, scl=Pin(22), sda=Pin(21)))
+        _Inkplate.init(I2CBus(I2C(0, scl=Pin(22), sda=Pin(21))))
 
         self.ipg = InkplateGS2()
         self.ipm = InkplateMono()
-        self.ipp = InkplatePartial(self.ipm)
+        self.ipp = InkplatePartial(self.ipm, self.PARTIAL_COMPRESSED)
 
         self.TOUCH1 = _Inkplate.TOUCH1
         self.TOUCH2 = _Inkplate.TOUCH2
@@ -773,24 +1091,147 @@ class Inkplate:
             self.ipg.display()
 
         self.ipp.start()  # making framebuffer copy for partial update
+        self._ghost = array("H", bytes(2 * self.UPDATE_BANDS))
 
-    def partialUpdate(self):
+    # setRefreshProfile selects how display() refreshes the screen: PROFILE_QUALITY (the
+    # default), PROFILE_BALANCED or PROFILE_FAST, which trade contrast and ghosting for speed
+    def setRefreshProfile(self, profile):
+        _Inkplate.profile = profile
+
+    def getRefreshProfile(self):
+        return _Inkplate.profile
+
+    # partialUpdate shows what changed since the last refresh without the full clean. Given a
+    # rectangle (x, y, w, h) only the panel rows it covers are scanned, changes outside of them
+    # stay pending for a later refresh. The bands it changes count against the ghosting budget
+    # of update(); bands without changed pixels are only driven with "no change" and don't.
+    def partialUpdate(self, x=None, y=None, w=None, h=None):
         if self.displayMode == self.INKPLATE_2BIT:
             return
-        self.ipp.display()
-        self.ipp.start()  # making framebuffer copy for partial update
+        if x is None:
+            y0, y1 = 0, D_ROWS
+        else:
+            px, py, pw, ph = physicalRect(D_COLS, D_ROWS, self.rotation, x, y, w, h)
+            y0 = max(py, 0)
+            y1 = min(py + ph, D_ROWS)
+            if y1 <= y0:
+                return
+        counts = None
+        if self._ghost is not None:
+            counts = self.ipp.changes(len(self._ghost), y0, y1)
+        if x is None:
+            self.ipp.display()
+            self._addGhost(0, D_ROWS, counts)
+            self.ipp.start()  # making framebuffer copy for partial update
+        else:
+            self.ipp.display(0, y0, D_COLS, y1 - y0)
+            self._addGhost(y0, y1, counts)
+            self.ipp.start(y0, y1)  # the reference only changes where it was shown
+
+    # _addGhost counts a partial update of panel rows y0..y1-1 against the ghosting budget of
+    # the bands they cover (see UPDATE_BANDS), only those with changes if counts from
+    # ipp.changes() are given
+    def _addGhost(self, y0, y1, counts=None):
+        ghost = self._ghost
+        if ghost is None:
+            return
+        band = (D_ROWS + len(ghost) - 1) // len(ghost)
+        for b in range(y0 // band, (y1 - 1) // band + 1):
+            if (counts is None or counts[b]) and ghost[b] < 0xFFFF:
+                ghost[b] += 1
+
+    # update shows the framebuffer with a partial update of the bands that changed, or with a
+    # full refresh if too much changed or the ghosting budget of a changed band is used up (see
+    # UPDATE_BANDS). It returns True if it did a full refresh. In 2-bit mode, or before the
+    # first display(), it always does a full refresh.
+    def update(self):
+        ghost = self._ghost
+        if self.displayMode == self.INKPLATE_2BIT or ghost is None:
+            self.display()
+            return True
+        bands = len(ghost)
+        counts = self.ipp.changes(bands)
+        changed = [b for b in range(bands) if counts[b]]
+        if not changed:
+            return False
+        if sum(counts) * 100 > self.UPDATE_FULL_PERCENT * D_COLS * D_ROWS or any(
+            ghost[b] >= self.GHOST_BUDGET for b in changed
+        ):
+            self.display()
+            return True
+        band = (D_ROWS + bands - 1) // bands
+        y = changed[0] * band
+        y1 = min(D_ROWS, (changed[-1] + 1) * band)
+        self.ipp.display(0, y, D_COLS, y1 - y)
+        self._addGhost(y, y1, counts)
+        self.ipp.start()
+        return False
+
+    # saveState writes what is on the panel, with the display mode, rotation and the ghosting
+    # counts of update(), to path on flash or SD, e.g. right before machine.deepsleep(). After
+    # waking restoreState brings the frame back into the framebuffer and as the reference for
+    # partial updates, so that a dashboard only has to redraw and partially refresh what
+    # changed. Only a state saved in 1-bit mode is restored.
+    def saveState(self, path="/inkplate.state"):
+        ghost = bytes(self._ghost) if self._ghost is not None else b""
+        info = (self.displayMode, self.rotation, D_COLS, D_ROWS)
+        self.ipp.save(path, info, ghost)
+
+    # restoreState restores the state written by saveState. It returns False if there is none
+    # (or it is from another display or mode), then the screen needs a full display(). The
+    # state is checked before the framebuffer is touched.
+    def restoreState(self, path="/inkplate.state"):
+        state = framestate.header(path)
+        if state is None:
+            return False
+        info, ghost = state
+        if len(info) < 4 or info[0] != self.INKPLATE_1BIT:
+            return False
+        if info[2] != D_COLS or info[3] != D_ROWS:
+            return False
+        if not self.ipp.restore(path):
+            return False
+        self.displayMode = info[0]
+        self.setRotation(info[1])
+        self._ghost = array("H", ghost) if len(ghost) == 2 * self.UPDATE_BANDS else None
+        return True
+
+    # savePage keeps a compressed copy of the framebuffer of the current display mode as page
+    # slot (any hashable key), see pagecache.py
+    def savePage(self, slot):
+        if self._pages is None:
+            from pagecache import PageCache
+
+            self._pages = PageCache(self.PAGE_CACHE_BUDGET)
+        fb, fmt = self._imageTarget()
+        return self._pages.save(slot, fb, fmt)
+
+    # showPage puts page slot back into the framebuffer and shows it, with a partial update if
+    # partial is set and the display is in 1-bit mode. It returns False if the page is not
+    # cached (any more), in which case it has to be drawn again.
+    def showPage(self, slot, partial=False):
+        fb, fmt = self._imageTarget()
+        if self._pages is None or not self._pages.restore(slot, fb, fmt):
+            return False
+        if partial and self.displayMode == self.INKPLATE_1BIT:
+            self.partialUpdate()
+        else:
+            self.display()
+        return True
 
     def clean(self):
-        self.einkOn()
-        _Inkplate.clean(0, 1)
-        _Inkplate.clean(1, 12)
-        _Inkplate.clean(2, 1)
-        _Inkplate.clean(0, 11)
-        _Inkplate.clean(2, 1)
-        _Inkplate.clean(1, 12)
-        _Inkplate.clean(2, 1)
-        _Inkplate.clean(0, 11)
-        self.einkOff()
+        try:
+            self.einkOn()
+            _Inkplate.clean(0, 1)
+            _Inkplate.clean(1, 12)
+            _Inkplate.clean(2, 1)
+            _Inkplate.clean(0, 11)
+            _Inkplate.clean(2, 1)
+            _Inkplate.clean(1, 12)
+            _Inkplate.clean(2, 1)
+            _Inkplate.clean(0, 11)
+        finally:
+            self.einkOff()
 
     def einkOn(self):
         _Inkplate.power_on()
@@ -798,12 +1239,68 @@ class Inkplate:
     def einkOff(self):
         _Inkplate.power_off()
 
+    # i2cStats returns {address: (transactions, bytes)} of the I2C traffic since begin()
+    def i2cStats(self):
+        return _Inkplate._i2c.stats()
+
+    # session returns a context manager that keeps the panel powered across the updates in its
+    # with block, so back to back partial updates skip the power up sequence:
+    #   with display.session():
+    #       ...
+    def session(self):
+        return _Session()
+
+    # setPowerIdle keeps the panel powered for ms milliseconds after each update, so that an
+    # update that follows soon skips the power up sequence. 0, the default, powers off at once.
+    def setPowerIdle(self, ms):
+        _Inkplate.idle_ms = ms
+
+    # touchpads returns the Touchpads object (see touchpad.py) that turns the MCP23017 interrupt
+    # into pad events, so that apps don't have to poll TOUCH1..TOUCH3. intPin is the ESP32 pin
+    # wired to the MCP23017 INTB output.
+    def touchpads(self, intPin=34):
+        if self._touchpads is None:
+            from touchpad import Touchpads
+
+            self._touchpads = Touchpads(_Inkplate._mcp23017, intPin=intPin)
+        return self._touchpads
+
+    # readBattery and readTemperature return the smoothed readings of the sampler if it runs
+    # (see startSampler), otherwise they read the sensors
     def readBattery(self):
+        s = _Inkplate.sampler
+        if s is not None and s.battery() is not None:
+            return s.battery()
         return _Inkplate.read_battery()
 
     def readTemperature(self):
+        s = _Inkplate.sampler
+        if s is not None and s.temperature() is not None:
+            return s.temperature()
         return _Inkplate.read_temperature()
 
+    # startSampler reads the battery and panel temperature in the background every period
+    # seconds, see sensors.py. readBattery and readTemperature then return at once and display()
+    # takes the temperature from it. timer is the id of the machine.Timer it uses. It returns
+    # the Sampler, which also reports trends.
+    def startSampler(self, period=60, size=16, timer=1):
+        if _Inkplate.sampler is None:
+            from sensors import Sampler
+
+            _Inkplate.sampler = Sampler(_Inkplate, size, timer)
+        _Inkplate.sampler.start(int(period * 1000))
+        return _Inkplate.sampler
+
+    def stopSampler(self):
+        if _Inkplate.sampler is not None:
+            _Inkplate.sampler.stop()
+            _Inkplate.sampler = None
+
+    # setTemperatureInterval sets how many minutes a panel temperature reading is used to pick
+    # the waveform before the next display() reads it again
+    def setTemperatureInterval(self, minutes):
+        _Inkplate.temp_interval_ms = int(minutes * 60 * 1000)
+
     def width(self):
         return self._width
 
@@ -981,101 +1478,73 @@ class Inkplate:
                     self.writePixel(x + i, y + j, 1)
         self.endWrite()
 
-    def drawImageFile(self, x, y, path, invert=False):
+    # _imageTarget returns the framebuffer of the current display mode and its format
+    def _imageTarget(self):
+        if self.displayMode == self.INKPLATE_1BIT:
+            return self.ipm._framebuf, FMT_MONO
+        return self.ipg._framebuf, FMT_GS2
+
+    # _imageSink returns the pipeline stage that dithers image rows w pixels wide and packs them
+    # into the framebuffer of the current display mode at (x, y)
+    def _imageSink(self, x, y, w, invert, dither):
+        fb, fmt = self._imageTarget()
+        return ImageSink(fb, fmt, D_COLS, D_ROWS, self.rotation, x, y, w, invert, dither)
+
+    # drawImageFile draws a BMP, PNG or JPEG file with its top-left corner at (x, y). JPEG images
+    # that do not fit on the screen are downscaled by 1/2, 1/4 or 1/8 while decoding. dither
+    # selects how the image is reduced to the panel's grey levels (one of the DITHER_ constants).
+    # The image, or the part of it given by crop=(x, y, w, h) in image pixels, can be scaled to
+    # a w x h box (keeping the aspect ratio if only one is given) with fit FIT_NEAREST or
+    # FIT_BOX. Parts of the image that fall off the screen are not decoded.
+    # With an ImageCache (see imagecache.py) as cache, the result is kept on the SD card and
+    # later draws of the same file with the same settings just copy it back.
+    def drawImageFile(
+        self,
+        x,
+        y,
+        path,
+        invert=False,
+        dither=DITHER_NONE,
+        w=None,
+        h=None,
+        crop=None,
+        fit=FIT_NEAREST,
+        cache=None,
+    ):
+        if cache:
+            fb, fmt = self._imageTarget()
+            key = cache.key(path, fmt, self.rotation, x, y, w, h, crop, fit, invert, dither)
+            if cache.load(key, fb, fmt, D_COLS):
+                return
         with open(path, "rb") as f:
-            header14 = f.read(14)
-            if header14[0] != 0x42 or header14[1] != 0x4D:
-                return 0
-            header40 = f.read(40)
+            magic = f.read(4)
+            f.seek(0)
+            if magic == b"\x89PNG":
+                from png import PNG
 
-            w = int(
-                (header40[7] << 24)
-                + (header40[6] << 16)
-                + (header40[5] << 8)
-                + header40[4]
-            )
-            h = int(
-                (header40[11] << 24)
-                + (header40[10] << 16)
-                + (header40[9] << 8)
-                + header40[8]
+                img = PNG(f)
+            elif magic[:2] == b"\xff\xd8":
+                from jpeg import JPEG
+
+                img = JPEG(f)
+            elif magic[:2] == b"BM":
+                from bmp import BMP
+
+                img = BMP(f)
+            else:
+                return 0
+            rect = drawImage(
+                img,
+                lambda sx, sy, sw: self._imageSink(sx, sy, sw, invert, dither),
+                self.width(),
+                self.height(),
+                x,
+                y,
+                w,
+                h,
+                crop,
+                fit,
             )
-            dataStart = int((header14[11] << 8) + header14[10])
-
-            depth = int((header40[15] << 8) + header40[14])
-            totalColors = int((header40[33] << 8) + header40[32])
-
-            rowSize = 4 * ((depth * w + 31) // 32)
-
-            if totalColors == 0:
-                totalColors = 1 << depth
-
-            palette = None
-
-            if depth <= 8:
-                palette = [0 for i in range(totalColors)]
-                p = f.read(totalColors * 4)
-                for i in range(totalColors):
-                    palette[i] = (
-                        54 * p[i * 4] + 183 * p[i * 4 + 1] + 19 * p[i * 4 + 2]
-                    ) >> 14
-            # print(palette)
-            f.seek(dataStart)
-            for j in range(h):
-                # print(100 * j // h, "% complete")
-                buffer = f.read(rowSize)
-                for i in range(w):
-                    val = 0
-                    if depth == 1:
-                        px = int(
-                            invert
-                            ^ (palette[0] < palette[1])
-                            ^ bool(buffer[i >> 3] & (1 << (7 - i & 7)))
-                        )
-                        val = palette[px]
-                    elif depth == 4:
-                        px = (buffer[i >> 1] & (0x0F if i & 1 == 1 else 0xF0)) >> (
-                            0 if i & 1 else 4
-                        )
-                        val = palette[px]
-                        if invert:
-                            val = 3 - val
-                    elif depth == 8:
-                        px = buffer[i]
-                        val = palette[px]
-                        if invert:
-                            val = 3 - val
-                    elif depth == 16:
-                        px = (buffer[(i << 1) | 1] << 8) | buffer[(i << 1)]
-
-                        r = (px & 0x7C00) >> 7
-                        g = (px & 0x3E0) >> 2
-                        b = (px & 0x1F) << 3
-
-                        val = (54 * r + 183 * g + 19 * b) >> 14
-
-                        if invert:
-                            val = 3 - val
-                    elif depth == 24:
-                        r = buffer[i * 3]
-                        g = buffer[i * 3 + 1]
-                        b = buffer[i * 3 + 2]
-
-                        val = (54 * r + 183 * g + 19 * b) >> 14
-
-                        if invert:
-                            val = 3 - val
-                    elif depth == 32:
-                        r = buffer[i * 4]
-                        g = buffer[i * 4 + 1]
-                        b = buffer[i * 4 + 2]
-
-                        val = (54 * r + 183 * g + 19 * b) >> 14
-
-                        if invert:
-                            val = 3 - val
-
-                    if self.getDisplayMode() == self.INKPLATE_1BIT:
-                        val >>= 1
-
-                    self.drawPixel(x + i, y + h - j, val)
+        if cache and rect:
+            pr = physicalRect(D_COLS, D_ROWS, self.rotation, *rect)
+            cache.store(key, fb, fmt, D_COLS, *pr)
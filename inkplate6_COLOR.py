@@ -4,7 +4,10 @@ import os
 from machine import ADC, I2C, SPI, Pin, SDCard
 from micropython import const
 from shapes import Shapes
+from imagesink import ImageSink, drawImage, FMT_NIBBLE
+from imagecache import physicalRect
 from mcp23017 import MCP23017
+from i2cbus import I2CBus
 from machine import Pin as mPin
 from gfx import GFX
 from gfx_standard_font_01 import text_dict as std_font
@@ -50,6 +53,87 @@ VCM_DC_SET_REGISTER = "\x02"
 D_COLS = const(600)
 D_ROWS = const(448)
 
+# Approximate appearance of the seven inks as (r, g, b), in the order of the colour constants
+# (BLACK, WHITE, GREEN, BLUE, RED, YELLOW, ORANGE). Used to match image colours to inks.
+PALETTE = (
+    (57, 48, 57),
+    (255, 255, 255),
+    (58, 91, 70),
+    (61, 59, 94),
+    (156, 72, 75),
+    (208, 190, 71),
+    (177, 106, 73),
+)
+
+# Size of the buffer displayFromStream sends data through
+_STREAM_CHUNK = const(4096)
+
+# Pseudo commands in the sequence tables replayed by Inkplate._run, outside the range of the
+# controller's commands
+_OP_FRAME = const(0xF0)  # send the frame
+_OP_BUSY_HIGH = const(0xF1)  # wait for BUSY to go high
+_OP_BUSY_LOW = const(0xF2)  # wait for BUSY to go low
+_OP_DELAY = const(0xF3)  # sleep for as many milliseconds as the data byte says
+_OP_REFRESH = const(0xF4)  # start the refresh and wait for it to end
+
+# timings entry for the phases of a sequence
+_PHASES = {
+    _OP_FRAME: "upload",
+    _OP_BUSY_HIGH: "powerOn",
+    _OP_REFRESH: "refresh",
+    _OP_BUSY_LOW: "powerOff",
+}
+
+# Command sequences, one table per operation. Every entry is a command, the number of data
+# bytes and the data bytes.
+_INIT_SEQ = bytes(
+    (
+        0x00, 2, 0xEF, 0x08,  # panel setting
+        0x01, 4, 0x37, 0x00, 0x23, 0x23,  # power setting
+        0x03, 1, 0x00,  # power off sequence
+        0x06, 3, 0xC7, 0xC7, 0x1D,  # booster soft start
+        0x30, 1, 0x3C,  # PLL
+        0x40, 1, 0x00,  # temperature sensor
+        0x50, 1, 0x37,  # VCOM and data interval
+        0x60, 1, 0x20,  # TCON
+        0x61, 4, 0x02, 0x58, 0x01, 0xC0,  # resolution, 600 x 448
+        0xE3, 1, 0xAA,  # power saving
+        _OP_DELAY, 1, 100,
+        0x50, 1, 0x37,
+    )
+)
+
+# Used by display, clean and the displayFrom functions. The resolution is set once by
+# _INIT_SEQ, it does not need repeating for every frame.
+_DISPLAY_SEQ = bytes(
+    (
+        0x10, 0,  # data start transmission
+        _OP_FRAME, 0,
+        0x04, 0,  # POWER_OFF_REGISTER
+        _OP_BUSY_HIGH, 0,
+        _OP_REFRESH, 0,
+        0x04, 0,  # POWER_OFF_REGISTER
+        _OP_BUSY_LOW, 0,
+        _OP_DELAY, 1, 200,
+    )
+)
+
+_SLEEP_SEQ = bytes(
+    (
+        _OP_DELAY, 1, 10,
+        0x07, 1, 0xA5,  # deep sleep
+        _OP_DELAY, 1, 100,
+    )
+)
+
+# State of a refresh started by displayAsync
+_REFRESH_IDLE = const(0)
+_REFRESH_RUNNING = const(1)
+_REFRESH_ENDED = const(2)  # BUSY has risen, the panel still has to be powered down
+
+# writePixel's rotations expressed as the framebuffer transforms of imagesink.put_row
+_IMAGE_ROTATION = (2, 1, 0, 3)
+
 MCP23017_INT_ADDR = const(0x20)
 MCP23017_EXT_ADDR = const(0x20)
 
@@ -115,6 +199,14 @@ class Inkplate:
     YELLOW = const(0b00000101)
     ORANGE = const(0b00000110)
 
+    DITHER_NONE = 0
+    DITHER_FLOYD_STEINBERG = 1
+    DITHER_ATKINSON = 2
+    DITHER_BAYER = 3
+
+    FIT_NEAREST = 0
+    FIT_BOX = 1
+
     _width = D_COLS
     _height = D_ROWS
 
@@ -123,7 +215,22 @@ class Inkplate:
 
     _panelState = False
 
-    _framebuf = bytearray([0x11] * (D_COLS * D_ROWS // 2))
+    # SPI clock for the panel, can be changed with begin(spiBaudrate=...). 2 MHz is the known
+    # good rate; 10 MHz shortens the transfers but has not been verified on a panel, so it is
+    # opt-in: begin(spiBaudrate=10000000).
+    SPI_BAUDRATE = 2000000
+
+    # time spent in each phase of the last refresh, in milliseconds
+    timings = {}
+
+    _refreshState = _REFRESH_IDLE
+    _refreshFlag = None
+
+    # allocated on first use, see _frame
+    _framebuf = None
+    _streamBuf = None
+
+    _touchpads = None  # see touchpads
 
     @classmethod
     def __init__(self):
@@ -140,25 +247,29 @@ class Inkplate:
         except:
             print("Sd card could not be read")
 
+    # begin initializes the board and the panel. spiBaudrate overrides the SPI clock used to
+    # talk to the panel (see SPI_BAUDRATE).
     @classmethod
-    def begin(self):
-        self.wire = I2C(0, scl=Pin(22), sda=Pin(21))
+    def begin(self, spiBaudrate=None):
+        if spiBaudrate:
+            self.SPI_BAUDRATE = spiBaudrate
+
+        self.wire = I2CBus(I2C(0, scl=Pin(22), sda=Pin(21)))
         self._mcp23017 = MCP23017(self.wire)
-        self.TOUCH1 = self._mcp23017.pin(10, Pin.IN)
-        self.TOUCH2 = self._mcp23017.pin(11, Pin.IN)
-        self.TOUCH3 = self._mcp23017.pin(12, Pin.IN)
+        with self._mcp23017.batch():
+            self.TOUCH1 = self._mcp23017.pin(10, Pin.IN)
+            self.TOUCH2 = self._mcp23017.pin(11, Pin.IN)
+            self.TOUCH3 = self._mcp23017.pin(12, Pin.IN)
 
         self.spi = SPI(2)
 
-        self.spi.init(baudrate=2000000, firstbit=SPI.MSB, polarity=0, phase=0)
+        self.spi.init(baudrate=self.SPI_BAUDRATE, firstbit=SPI.MSB, polarity=0, phase=0)
 
         self.EPAPER_BUSY_PIN = Pin(EPAPER_BUSY_PIN, Pin.IN)
         self.EPAPER_RST_PIN = Pin(EPAPER_RST_PIN, Pin.OUT)
         self.EPAPER_DC_PIN = Pin(EPAPER_DC_PIN, Pin.OUT)
         self.EPAPER_CS_PIN = Pin(EPAPER_CS_PIN, Pin.OUT)
 
-        self.framebuf = bytearray(D_ROWS * D_COLS // 2)
-
         self.GFX = GFX(
             D_COLS,
             D_ROWS,
@@ -179,31 +290,7 @@ class Inkplate:
         if not self.EPAPER_BUSY_PIN.value():
             return False
 
-        self.sendCommand(PANEL_SET_REGISTER)
-        self.sendData(b"\xef\x08")
-        self.sendCommand(POWER_SET_REGISTER)
-        self.sendData(b"\x37\x00\x23\x23")
-        self.sendCommand(POWER_OFF_SEQ_SET_REGISTER)
-        self.sendData(b"\x00")
-        self.sendCommand(BOOSTER_SOFTSTART_REGISTER)
-        self.sendData(b"\xc7\xc7\x1d")
-        self.sendCommand(PLL_CONTROL_REGISTER)
-        self.sendData(b"\x3c")
-        self.sendCommand(TEMP_SENSOR_REGISTER)
-        self.sendData(b"\x00")
-        self.sendCommand(VCOM_DATA_INTERVAL_REGISTER)
-        self.sendData(b"\x37")
-        self.sendCommand(b"\x60")
-        self.sendData(b"\x20")
-        self.sendCommand(RESOLUTION_SET_REGISTER)
-        self.sendData(b"\x02\x58\x01\xc0")
-        self.sendCommand(b"\xE3")
-        self.sendData(b"\xaa")
-
-        time.sleep_ms(100)
-
-        self.sendCommand(b"\x50")
-        self.sendData(b"\x37")
+        self._run(_INIT_SEQ)
 
         self.setMCPForLowPower()
 
@@ -212,18 +299,19 @@ class Inkplate:
 
     @classmethod
     def setMCPForLowPower(self):
-        self._mcp23017.pin(10,  mode=mPin.IN)
-        self._mcp23017.pin(11,  mode=mPin.IN)
-        self._mcp23017.pin(12,  mode=mPin.IN)
+        with self._mcp23017.batch():
+            self._mcp23017.pin(10,  mode=mPin.IN)
+            self._mcp23017.pin(11,  mode=mPin.IN)
+            self._mcp23017.pin(12,  mode=mPin.IN)
 
-        self._mcp23017.pin(9, value=0,  mode=mPin.OUT)
+            self._mcp23017.pin(9, value=0,  mode=mPin.OUT)
 
-        for x in range(8):
-            self._mcp23017.pin(x, value=0, mode=mPin.OUT)
-        self._mcp23017.pin(8, value=0, mode=mPin.OUT)
-        self._mcp23017.pin(13, value=0, mode=mPin.OUT)
-        self._mcp23017.pin(14, value=0, mode=mPin.OUT)
-        self._mcp23017.pin(15, value=0, mode=mPin.OUT)
+            for x in range(8):
+                self._mcp23017.pin(x, value=0, mode=mPin.OUT)
+            self._mcp23017.pin(8, value=0, mode=mPin.OUT)
+            self._mcp23017.pin(13, value=0, mode=mPin.OUT)
+            self._mcp23017.pin(14, value=0, mode=mPin.OUT)
+            self._mcp23017.pin(15, value=0, mode=mPin.OUT)
 
     @classmethod
     def getPanelDeepSleepState(self):
@@ -231,18 +319,15 @@ class Inkplate:
 
     @classmethod
     def setPanelDeepSleepState(self, state):
-        _panelState = False if state == 0 else True
-
-        if _panelState:
+        if state:
             self.begin()
         else:
-            time.sleep_ms(10)
-            self.sendCommand(DEEP_SLEEP_REGISTER)
-            self.sendData(b"\xA5")
-            time.sleep_ms(100)
-            EPAPER_RST_PIN.value(0)
-            EPAPER_DC_PIN.value(0)
-            EPAPER_CS_PIN.value(0)
+            self._waitRefresh()
+            self._run(_SLEEP_SEQ)
+            self.EPAPER_RST_PIN.value(0)
+            self.EPAPER_DC_PIN.value(0)
+            self.EPAPER_CS_PIN.value(0)
+            self._panelState = False
 
     @classmethod
     def resetPanel(self):
@@ -269,71 +354,186 @@ class Inkplate:
 
         self.EPAPER_CS_PIN.value(1)
 
+    # _run replays a command sequence table (see _INIT_SEQ), keeping CS low for each run of
+    # commands. frame is what _OP_FRAME sends, see _writeFrame. With wait=False the run stops
+    # once the refresh has started, and the position to resume from later is returned.
+    # The time spent in each phase is recorded in timings, in milliseconds.
+    @classmethod
+    def _run(self, seq, pos=0, frame=None, wait=True):
+        spi = self.spi
+        cs = self.EPAPER_CS_PIN
+        dc = self.EPAPER_DC_PIN
+        busy = self.EPAPER_BUSY_PIN
+        mv = memoryview(seq)
+        cs(0)
+        while pos < len(seq):
+            op = seq[pos]
+            n = seq[pos + 1]
+            pos += 2 + n
+            if op < _OP_FRAME:
+                dc(0)
+                spi.write(mv[pos - n - 2 : pos - n - 1])
+                if n:
+                    dc(1)
+                    spi.write(mv[pos - n : pos])
+                continue
+            cs(1)
+            t = time.ticks_ms()
+            if op == _OP_FRAME:
+                dc(1)
+                cs(0)
+                self._writeFrame(frame)
+                cs(1)
+            elif op == _OP_BUSY_HIGH:
+                while not busy():
+                    pass
+            elif op == _OP_BUSY_LOW:
+                while busy():
+                    pass
+            elif op == _OP_DELAY:
+                time.sleep_ms(seq[pos - 1])
+            elif op == _OP_REFRESH:
+                self._refreshStart = t
+                if not wait:
+                    # BUSY is high now, it goes low during the refresh and rises again after
+                    self._refreshState = _REFRESH_RUNNING
+                    busy.irq(trigger=Pin.IRQ_RISING, handler=self._busyIrq)
+                    self.sendCommand(DISPLAY_REF_REGISTER)
+                    return pos
+                self.sendCommand(DISPLAY_REF_REGISTER)
+                while not busy():
+                    pass
+            if op in _PHASES:
+                self.timings[_PHASES[op]] = time.ticks_diff(time.ticks_ms(), t)
+            cs(0)
+        cs(1)
+        return pos
+
+    # _writeFrame sends a frame as data: a buffer is written in one go, a stream (anything with
+    # readinto) is copied in fixed-size chunks, and whatever is missing (all of it for None) is
+    # filled with white
+    @classmethod
+    def _writeFrame(self, frame):
+        if frame is not None and not hasattr(frame, "readinto"):
+            self.spi.write(frame)
+            return
+        if self._streamBuf is None:
+            self._streamBuf = bytearray(_STREAM_CHUNK)
+        mv = memoryview(self._streamBuf)
+        left = D_COLS * D_ROWS // 2
+        while frame is not None and left:
+            n = frame.readinto(mv[: min(left, _STREAM_CHUNK)])
+            if not n:
+                break
+            self.spi.write(mv[:n])
+            left -= n
+        if left:
+            for i in range(_STREAM_CHUNK):
+                mv[i] = 0x11
+            while left:
+                n = min(left, _STREAM_CHUNK)
+                self.spi.write(mv[:n])
+                left -= n
+
+    # _frame returns the framebuffer, allocating it on first use so that programs that only
+    # stream images to the panel never need its 134 KB
+    @classmethod
+    def _frame(self):
+        if self._framebuf is None:
+            self._framebuf = bytearray([0x11] * (D_COLS * D_ROWS // 2))
+        return self._framebuf
+
     @classmethod
     def clearDisplay(self):
-        self._framebuf = bytearray([0x11] * (D_COLS * D_ROWS // 2))
+        self._framebuf = None
+
+    # _waitRefresh waits for a refresh started by displayAsync to finish
+    @classmethod
+    def _waitRefresh(self):
+        while not self.displayDone():
+            time.sleep_ms(10)
 
     @classmethod
     def display(self):
         if not self._panelState:
             return
 
-        self.sendCommand(b"\x61")
-        self.sendData(b"\x02\x58\x01\xc0")
+        self._waitRefresh()
+        self._run(_DISPLAY_SEQ, 0, self._frame())
 
-        self.sendCommand(b"\x10")
+    # displayFromStream shows a full-screen frame read from stream (anything with readinto),
+    # given in the controller's own format: D_COLS x D_ROWS ink indices in physical pixel order,
+    # two per byte with the left one in the high nibble. The data goes straight to the
+    # controller's frame memory in fixed-size chunks, the framebuffer is not used at all. A
+    # short stream leaves the rest of the frame white.
+    @classmethod
+    def displayFromStream(self, stream):
+        if not self._panelState:
+            return
 
-        self.EPAPER_DC_PIN.value(1)
-        self.EPAPER_CS_PIN.value(0)
+        self._waitRefresh()
+        self._run(_DISPLAY_SEQ, 0, stream)
 
-        self.spi.write(self._framebuf)
+    # displayFromFile shows a full-screen frame stored in a file, see displayFromStream
+    @classmethod
+    def displayFromFile(self, path):
+        with open(path, "rb") as f:
+            self.displayFromStream(f)
 
-        self.EPAPER_CS_PIN.value(1)
+    # displayAsync uploads the framebuffer and starts the refresh, but returns without waiting
+    # for the panel, which takes tens of seconds. The end of the refresh raises an interrupt on
+    # the BUSY pin; poll displayDone(), or await waitDisplay() from asyncio code, to find out
+    # when it has happened. The framebuffer can be drawn into as soon as displayAsync returns.
+    @classmethod
+    def displayAsync(self):
+        if not self._panelState:
+            return
 
-        self.sendCommand(POWER_OFF_REGISTER)
-        while not self.EPAPER_BUSY_PIN.value():
-            pass
+        self._waitRefresh()
+        self._resume = self._run(_DISPLAY_SEQ, 0, self._frame(), False)
 
-        self.sendCommand(DISPLAY_REF_REGISTER)
-        while not self.EPAPER_BUSY_PIN.value():
-            pass
+    @classmethod
+    def _busyIrq(self, pin):
+        pin.irq(handler=None)
+        if self._refreshState == _REFRESH_RUNNING:
+            self._refreshEnd = time.ticks_ms()
+            self._refreshState = _REFRESH_ENDED
+            if self._refreshFlag is not None:
+                self._refreshFlag.set()
 
-        self.sendCommand(POWER_OFF_REGISTER)
-        while self.EPAPER_BUSY_PIN.value():
-            pass
+    # displayDone returns True when no refresh started by displayAsync is in progress. The
+    # first call after a refresh has ended powers the panel down.
+    @classmethod
+    def displayDone(self):
+        if self._refreshState == _REFRESH_RUNNING:
+            return False
+        if self._refreshState == _REFRESH_ENDED:
+            self._refreshState = _REFRESH_IDLE
+            self.timings["refresh"] = time.ticks_diff(self._refreshEnd, self._refreshStart)
+            self._run(_DISPLAY_SEQ, self._resume)
+        return True
 
-        time.sleep_ms(200)
+    # waitDisplay waits for a refresh started by displayAsync to finish without blocking other
+    # asyncio tasks
+    @classmethod
+    async def waitDisplay(self):
+        if self._refreshFlag is None:
+            try:
+                import asyncio
+            except ImportError:
+                import uasyncio as asyncio
+            self._refreshFlag = asyncio.ThreadSafeFlag()
+        while self._refreshState == _REFRESH_RUNNING:
+            await self._refreshFlag.wait()
+        self.displayDone()
 
     @classmethod
     def clean(self):
         if not self._panelState:
             return
 
-        self.sendCommand(b"\x61")
-        self.sendData(b"\x02\x58\x01\xc0")
-
-        self.sendCommand(b"\x10")
-
-        self.EPAPER_DC_PIN.value(1)
-        self.EPAPER_CS_PIN.value(0)
-
-        self.spi.write(bytearray(0x11 for x in range(D_COLS * D_ROWS // 2)))
-
-        self.EPAPER_CS_PIN.value(1)
-
-        self.sendCommand(POWER_OFF_REGISTER)
-        while not self.EPAPER_BUSY_PIN.value():
-            pass
-
-        self.sendCommand(DISPLAY_REF_REGISTER)
-        while not self.EPAPER_BUSY_PIN.value():
-            pass
-
-        self.sendCommand(POWER_OFF_REGISTER)
-        while self.EPAPER_BUSY_PIN.value():
-            pass
-
-        time.sleep_ms(200)
+        self._waitRefresh()
+        self._run(_DISPLAY_SEQ)
 
     @classmethod
     def width(self):
@@ -385,8 +585,9 @@ class Inkplate:
         _x = x // 2
         _x_sub = x % 2
 
-        temp = self._framebuf[D_COLS * y // 2 + _x]
-        self._framebuf[D_COLS * y // 2 + _x] = (pixelMaskGLUT[_x_sub] & temp) |\
+        fb = self._frame()
+        temp = fb[D_COLS * y // 2 + _x]
+        fb[D_COLS * y // 2 + _x] = (pixelMaskGLUT[_x_sub] & temp) |\
             (c if _x_sub else c << 4)
 
     @classmethod
@@ -493,6 +694,22 @@ class Inkplate:
     def printText(self, x, y, s, c=BLACK):
         self.GFX._very_slow_text(x, y, s, self.textSize, c)
 
+    # touchpads returns the Touchpads object (see touchpad.py) that turns the MCP23017 interrupt
+    # into pad events, so that apps don't have to poll TOUCH1..TOUCH3. intPin is the ESP32 pin
+    # wired to the MCP23017 INTB output.
+    @classmethod
+    def touchpads(self, intPin=34):
+        if self._touchpads is None:
+            from touchpad import Touchpads
+
+            self._touchpads = Touchpads(self._mcp23017, intPin=intPin)
+        return self._touchpads
+
+    # i2cStats returns {address: (transactions, bytes)} of the I2C traffic since begin()
+    @classmethod
+    def i2cStats(self):
+        return self.wire.stats()
+
     @classmethod
     def readBattery(self):
         self.VBAT_EN.value(0)
@@ -518,102 +735,75 @@ class Inkplate:
                     self.writePixel(x + i, y + j, c)
         self.endWrite()
 
-    # @classmethod
-    # def drawImageFile(self, x, y, path, invert=False):
-    #     with open(path, "rb") as f:
-    #         header14 = f.read(14)
-    #         if header14[0] != 0x42 or header14[1] != 0x4D:
-    #             return 0
-    #         header40 = f.read(40)
-
-    #         w = int(
-    #             (header40[7] << 24)
-    #             + (header40[6] << 16)
-    #             + (header40[5] << 8)
-    #             + header40[4]
-    #         )
-    #         h = int(
-    #             (header40[11] << 24)
-    #             + (header40[10] << 16)
-    #             + (header40[9] << 8)
-    #             + header40[8]
-    #         )
-    #         dataStart = int((header14[11] << 8) + header14[10])
-
-    #         depth = int((header40[15] << 8) + header40[14])
-    #         totalColors = int((header40[33] << 8) + header40[32])
-
-    #         rowSize = 4 * ((depth * w + 31) // 32)
-
-    #         if totalColors == 0:
-    #             totalColors = 1 << depth
-
-    #         palette = None
-
-    #         if depth <= 8:
-    #             palette = [0 for i in range(totalColors)]
-    #             p = f.read(totalColors * 4)
-    #             for i in range(totalColors):
-    #                 palette[i] = (
-    #                     54 * p[i * 4] + 183 * p[i * 4 + 1] + 19 * p[i * 4 + 2]
-    #                 ) >> 14
-    #         # print(palette)
-    #         f.seek(dataStart)
-    #         for j in range(h):
-    #             # print(100 * j // h, "% complete")
-    #             buffer = f.read(rowSize)
-    #             for i in range(w):
-    #                 val = 0
-    #                 if depth == 1:
-    #                     px = int(
-    #                         invert
-    #                         ^ (palette[0] < palette[1])
-    #                         ^ bool(buffer[i >> 3] & (1 << (7 - i & 7)))
-    #                     )
-    #                     val = palette[px]
-    #                 elif depth == 4:
-    #                     px = (buffer[i >> 1] & (0x0F if i & 1 == 1 else 0xF0)) >> (
-    #                         0 if i & 1 else 4
-    #                     )
-    #                     val = palette[px]
-    #                     if invert:
-    #                         val = 3 - val
-    #                 elif depth == 8:
-    #                     px = buffer[i]
-    #                     val = palette[px]
-    #                     if invert:
-    #                         val = 3 - val
-    #                 elif depth == 16:
-    #                     px = (buffer[(i << 1) | 1] << 8) | buffer[(i << 1)]
-
-    #                     r = (px & 0x7C00) >> 7
-    #                     g = (px & 0x3E0) >> 2
-    #                     b = (px & 0x1F) << 3
-
-    #                     val = (54 * r + 183 * g + 19 * b) >> 14
-
-    #                     if invert:
-    #                         val = 3 - val
-    #                 elif depth == 24:
-    #                     r = buffer[i * 3]
-    #                     g = buffer[i * 3 + 1]
-    #                     b = buffer[i * 3 + 2]
-
-    #                     val = (54 * r + 183 * g + 19 * b) >> 14
-
-    #                     if invert:
-    #                         val = 3 - val
-    #                 elif depth == 32:
-    #                     r = buffer[i * 4]
-    #                     g = buffer[i * 4 + 1]
-    #                     b = buffer[i * 4 + 2]
-
-    #                     val = (54 * r + 183 * g + 19 * b) >> 14
-
-    #                     if invert:
-    #                         val = 3 - val
-
-    #                 if self.getDisplayMode() == self.INKPLATE_1BIT:
-    #                     val >>= 1
-
-    #                 self.drawPixel(x + i, y + h - j, val)
+    # drawImageFile draws a BMP, PNG or JPEG file with its top-left corner at (x, y). Every pixel
+    # is mapped to the nearest of the seven inks through a precomputed RGB565 lookup table,
+    # optionally with dithering (one of the DITHER_ constants). JPEG images that do not fit on
+    # the screen are downscaled by 1/2, 1/4 or 1/8 while decoding.
+    # The image, or the part of it given by crop=(x, y, w, h) in image pixels, can be scaled to
+    # a w x h box (keeping the aspect ratio if only one is given) with fit FIT_NEAREST or
+    # FIT_BOX. Parts of the image that fall off the screen are not decoded.
+    # With an ImageCache (see imagecache.py) as cache, the result is kept on the SD card and
+    # later draws of the same file with the same settings just copy it back.
+    @classmethod
+    def drawImageFile(
+        self,
+        x,
+        y,
+        path,
+        invert=False,
+        dither=DITHER_NONE,
+        w=None,
+        h=None,
+        crop=None,
+        fit=FIT_NEAREST,
+        cache=None,
+    ):
+        rot = _IMAGE_ROTATION[self.rotation]
+        if cache:
+            key = cache.key(path, FMT_NIBBLE, rot, x, y, w, h, crop, fit, invert, dither)
+            if cache.load(key, self._frame(), FMT_NIBBLE, D_COLS):
+                return
+        with open(path, "rb") as f:
+            magic = f.read(4)
+            f.seek(0)
+            if magic == b"\x89PNG":
+                from png import PNG
+
+                img = PNG(f)
+            elif magic[:2] == b"\xff\xd8":
+                from jpeg import JPEG
+
+                img = JPEG(f)
+            elif magic[:2] == b"BM":
+                from bmp import BMP
+
+                img = BMP(f)
+            else:
+                return 0
+            rect = drawImage(
+                img,
+                lambda sx, sy, sw: ImageSink(
+                    self._frame(),
+                    FMT_NIBBLE,
+                    D_COLS,
+                    D_ROWS,
+                    rot,
+                    sx,
+                    sy,
+                    sw,
+                    invert,
+                    dither,
+                    PALETTE,
+                ),
+                self.width(),
+                self.height(),
+                x,
+                y,
+                w,
+                h,
+                crop,
+                fit,
+            )
+        if cache and rect:
+            pr = physicalRect(D_COLS, D_ROWS, rot, *rect)
+            cache.store(key, self._frame(), FMT_NIBBLE, D_COLS, *pr)
@@ -0,0 +1,503 @@
+# Baseline JPEG decoder for the Inkplate image pipeline.
+# The image is decoded one MCU row at a time into a strip that is 8 (or 16, with vertical
+# chroma subsampling) pixels high, so memory use is O(width). The inverse DCT can downscale
+# by 1/2, 1/4 or 1/8: only the low-frequency N x N corner of every 8 x 8 block is transformed,
+# with the basis functions averaged over the pixels they replace, so an oversized camera image
+# is shrunk to fit the panel without full-resolution pixels ever existing. With scale 8 only
+# the DC coefficient is used and no transform is needed at all.
+# Progressive, arithmetic-coded, 12-bit and CMYK JPEGs are not supported.
+import math
+import micropython
+from micropython import const
+from uarray import array
+
+SIGNATURE = b"\xff\xd8"
+
+# Zig-zag order: natural (row-major) index of the k-th coefficient in the stream
+_ZIGZAG = bytes(
+    (
+        0, 1, 8, 16, 9, 2, 3, 10, 17, 24, 32, 25, 18, 11, 4, 5,
+        12, 19, 26, 33, 40, 48, 41, 34, 27, 20, 13, 6, 7, 14, 21, 28,
+        35, 42, 49, 56, 57, 50, 43, 36, 29, 22, 15, 23, 30, 37, 44, 51,
+        58, 59, 52, 45, 38, 31, 39, 46, 53, 60, 61, 54, 47, 55, 62, 63,
+    )
+)
+
+_LOG2 = {1: 0, 2: 1, 4: 2}
+
+_LOOKUP_BITS = const(9)  # Huffman codes up to this length are decoded with one table lookup
+
+# Indices into the scratch array handed to _idct
+_D_N = const(0)
+_D_OFF = const(1)
+_D_STRIDE = const(2)
+_D_TMP = const(3)
+
+
+# _idct transforms the top-left n x n dequantized coefficients of coef (64 ints, natural
+# order) into n x n pixels written to out at d[_D_OFF] with row stride d[_D_STRIDE]. tab holds
+# the n-point basis functions scaled by 2^10 (see _basis). The coefficients used are cleared
+# for the next block.
+@micropython.viper
+def _idct(coef, out, d_in, tab):
+    c = ptr32(coef)
+    o = ptr8(out)
+    d = ptr32(d_in)
+    t = ptr32(tab)
+    n = int(d[_D_N])
+    off = int(d[_D_OFF])
+    stride = int(d[_D_STRIDE])
+    # rows: tmp[v][x] = sum_u t[x][u] * c[v][u]
+    for v in range(n):
+        for x in range(n):
+            s = 0
+            for u in range(n):
+                s += int(t[x * 8 + u]) * int(c[v * 8 + u])
+            d[_D_TMP + v * 8 + x] = (s + 512) >> 10
+    # columns: out[y][x] = sum_v t[y][v] * tmp[v][x], plus level shift and clamping
+    for y in range(n):
+        for x in range(n):
+            s = 0
+            for v in range(n):
+                s += int(t[y * 8 + v]) * int(d[_D_TMP + v * 8 + x])
+            p = ((s + 2048) >> 12) + 128
+            if p < 0:
+                p = 0
+            elif p > 255:
+                p = 255
+            o[off + y * stride + x] = p
+    for v in range(n):
+        for u in range(n):
+            c[v * 8 + u] = 0
+
+
+# _dc_fill fills the 1x1 "block" of an 8x downscaled image from its DC coefficient
+@micropython.viper
+def _dc_fill(coef, out, d_in):
+    c = ptr32(coef)
+    d = ptr32(d_in)
+    o = ptr8(out)
+    p = ((int(c[0]) + 4) >> 3) + 128
+    if p < 0:
+        p = 0
+    elif p > 255:
+        p = 255
+    o[int(d[_D_OFF])] = p
+    c[0] = 0
+
+
+# _upsample fills dst with samples from src starting at off, repeating each sample 2^sh times.
+# xsh is (x0 << 2) | sh: dst starts with output pixel x0 of the row.
+@micropython.viper
+def _upsample(src, dst, off: int, xsh: int):
+    s = ptr8(src)
+    o = ptr8(dst)
+    n = int(len(dst))
+    sh = xsh & 3
+    x0 = xsh >> 2
+    for i in range(n):
+        o[i] = s[off + ((x0 + i) >> sh)]
+
+
+# _grey_rgb expands a row of luminance into RGB triplets in out
+@micropython.viper
+def _grey_rgb(src, out):
+    s = ptr8(src)
+    o = ptr8(out)
+    n = int(len(src))
+    for i in range(n):
+        v = int(s[i])
+        o[3 * i] = v
+        o[3 * i + 1] = v
+        o[3 * i + 2] = v
+
+
+# _ycc_rgb converts rows of Y, Cb and Cr samples into RGB triplets in out
+@micropython.viper
+def _ycc_rgb(y_in, cb_in, cr_in, out):
+    yy = ptr8(y_in)
+    cb = ptr8(cb_in)
+    cr = ptr8(cr_in)
+    o = ptr8(out)
+    n = int(len(y_in))
+    for i in range(n):
+        lum = int(yy[i]) << 16
+        b = int(cb[i]) - 128
+        r = int(cr[i]) - 128
+        v0 = (lum + 91881 * r + 32768) >> 16
+        v1 = (lum - 22554 * b - 46802 * r + 32768) >> 16
+        v2 = (lum + 116130 * b + 32768) >> 16
+        if v0 < 0:
+            v0 = 0
+        elif v0 > 255:
+            v0 = 255
+        if v1 < 0:
+            v1 = 0
+        elif v1 > 255:
+            v1 = 255
+        if v2 < 0:
+            v2 = 0
+        elif v2 > 255:
+            v2 = 255
+        o[3 * i] = v0
+        o[3 * i + 1] = v1
+        o[3 * i + 2] = v2
+
+
+# _basis returns the table of n-point IDCT basis functions for _idct: entry [x*8+u] is
+# C(u) * cos((2x+1)u*pi/2n) scaled by 2^10, where the cosine stands for the average of the
+# 8-point basis function over the 8/n pixels that output pixel x replaces.
+def _basis(n):
+    s = 8 // n
+    tab = array("i", bytes(4 * 64))
+    for u in range(n):
+        cu = math.sqrt(0.5) if u == 0 else 1.0
+        if u:
+            cu *= math.sin(s * u * math.pi / 16) / (s * math.sin(u * math.pi / 16))
+        for x in range(n):
+            tab[x * 8 + u] = round(cu * math.cos((2 * x + 1) * u * math.pi / (2 * n)) * 1024)
+    return tab
+
+
+# _Huffman is a decoding table built from a DHT segment
+class _Huffman:
+    def __init__(self, counts, symbols):
+        self.lookup = array("H", bytes(2 << _LOOKUP_BITS))
+        self.maxcode = [-1] * 17
+        self.valptr = [0] * 17
+        self.mincode = [0] * 17
+        self.symbols = symbols
+        code = 0
+        k = 0
+        for l in range(1, 17):
+            cnt = counts[l - 1]
+            self.valptr[l] = k
+            self.mincode[l] = code
+            for _ in range(cnt):
+                if l <= _LOOKUP_BITS:
+                    sh = _LOOKUP_BITS - l
+                    e = (l << 8) | symbols[k]
+                    for i in range(code << sh, (code + 1) << sh):
+                        self.lookup[i] = e
+                code += 1
+                k += 1
+            if cnt:
+                self.maxcode[l] = code - 1
+            code <<= 1
+
+
+# JPEG parses the headers of a baseline JPEG file and then decodes it one row at a time.
+# The file object must stay open while rows are being read.
+class JPEG:
+    def __init__(self, f):
+        self._f = f
+        if f.read(2) != SIGNATURE:
+            raise ValueError("not a JPEG file")
+        self._qt = [None] * 4
+        self._dc = [None] * 4
+        self._ac = [None] * 4
+        self._restartInterval = 0
+        self._comps = None
+        while True:
+            m = self._marker()
+            if m == 0xD8 or 0xD0 <= m <= 0xD7 or m == 0x01:
+                continue
+            if m == 0xD9:
+                raise ValueError("JPEG file has no image data")
+            length = int.from_bytes(f.read(2), "big") - 2
+            if m == 0xC0 or m == 0xC1:
+                self._sof(f.read(length))
+            elif m == 0xC4:
+                self._dht(f.read(length))
+            elif m == 0xDB:
+                self._dqt(f.read(length))
+            elif m == 0xDD:
+                self._restartInterval = int.from_bytes(f.read(2), "big")
+            elif m == 0xDA:
+                self._sos(f.read(length))
+                break
+            elif 0xC2 <= m <= 0xCF and m not in (0xC4, 0xC8, 0xCC):
+                raise ValueError("only baseline JPEG is supported")
+            else:
+                f.seek(length, 1)
+        self.setScale(1)
+
+    # _marker skips to the next marker and returns its code
+    def _marker(self):
+        f = self._f
+        while True:
+            b = f.read(1)
+            if not b:
+                raise ValueError("truncated JPEG file")
+            if b[0] != 0xFF:
+                continue
+            while b[0] == 0xFF:
+                b = f.read(1)
+                if not b:
+                    raise ValueError("truncated JPEG file")
+            if b[0] != 0:
+                return b[0]
+
+    def _sof(self, d):
+        if d[0] != 8:
+            raise ValueError("only 8-bit JPEG is supported")
+        self.srcHeight = int.from_bytes(d[1:3], "big")
+        self.srcWidth = int.from_bytes(d[3:5], "big")
+        n = d[5]
+        if n != 1 and n != 3:
+            raise ValueError("only greyscale and YCbCr JPEG is supported")
+        # each component: [id, H, V, quant table, dc table, ac table, dc predictor]
+        self._comps = [
+            [d[6 + 3 * i], d[7 + 3 * i] >> 4, d[7 + 3 * i] & 0xF, d[8 + 3 * i], 0, 0, 0]
+            for i in range(n)
+        ]
+        if n == 1:
+            # a single component is never interleaved, its MCU is one block
+            self._comps[0][1] = self._comps[0][2] = 1
+
+    def _dht(self, d):
+        i = 0
+        while i < len(d):
+            tc, th = d[i] >> 4, d[i] & 0xF
+            counts = d[i + 1 : i + 17]
+            total = sum(counts)
+            table = _Huffman(counts, d[i + 17 : i + 17 + total])
+            (self._ac if tc else self._dc)[th] = table
+            i += 17 + total
+
+    def _dqt(self, d):
+        i = 0
+        while i < len(d):
+            pq, tq = d[i] >> 4, d[i] & 0xF
+            if pq:
+                self._qt[tq] = [
+                    int.from_bytes(d[i + 1 + 2 * k : i + 3 + 2 * k], "big") for k in range(64)
+                ]
+                i += 129
+            else:
+                self._qt[tq] = list(d[i + 1 : i + 65])
+                i += 65
+
+    def _sos(self, d):
+        if d[0] != len(self._comps):
+            raise ValueError("multi-scan JPEG not supported")
+        for i in range(d[0]):
+            cid, t = d[1 + 2 * i], d[2 + 2 * i]
+            for c in self._comps:
+                if c[0] == cid:
+                    c[4] = t >> 4
+                    c[5] = t & 0xF
+
+    # setScale selects the downscaling factor (1, 2, 4 or 8) applied while decoding and updates
+    # width and height to the size of the decoded image
+    def setScale(self, scale):
+        if scale not in (1, 2, 4, 8):
+            raise ValueError("scale must be 1, 2, 4 or 8")
+        self.scale = scale
+        self.width = (self.srcWidth + scale - 1) // scale
+        self.height = (self.srcHeight + scale - 1) // scale
+
+    # scaleFor returns the smallest scale that makes the image fit into w x h pixels, or 8 if
+    # even that is too large
+    def scaleFor(self, w, h):
+        for s in (1, 2, 4):
+            if (self.srcWidth + s - 1) // s <= w and (self.srcHeight + s - 1) // s <= h:
+                return s
+        return 8
+
+    # ===== Entropy decoding
+
+    def _byte(self):
+        if self._pos >= len(self._buf):
+            self._buf = self._f.read(512)
+            self._pos = 0
+            if not self._buf:
+                return -1
+        b = self._buf[self._pos]
+        self._pos += 1
+        return b
+
+    # _fill tops up the bit accumulator to at least 17 bits; after a marker zeros are shifted in
+    def _fill(self):
+        while self._n <= 16:
+            b = 0
+            if self._mark is None:
+                b = self._byte()
+                if b == 0xFF:
+                    b2 = self._byte()
+                    while b2 == 0xFF:
+                        b2 = self._byte()
+                    if b2 != 0:
+                        self._mark = b2
+                        b = 0
+                elif b < 0:
+                    self._mark = 0xD9
+                    b = 0
+            self._acc = ((self._acc << 8) | b) & 0xFFFFFF
+            self._n += 8
+
+    def _decode(self, h):
+        if self._n <= 16:
+            self._fill()
+        n = self._n
+        acc = self._acc
+        e = h.lookup[(acc >> (n - _LOOKUP_BITS)) & ((1 << _LOOKUP_BITS) - 1)]
+        if e:
+            self._n = n - (e >> 8)
+            return e & 0xFF
+        for l in range(_LOOKUP_BITS + 1, 17):
+            code = (acc >> (n - l)) & ((1 << l) - 1)
+            if code <= h.maxcode[l]:
+                self._n = n - l
+                return h.symbols[h.valptr[l] + code - h.mincode[l]]
+        raise ValueError("bad Huffman code in JPEG")
+
+    # _receive reads an s-bit value and sign-extends it as per the JPEG spec
+    def _receive(self, s):
+        if self._n < s:
+            self._fill()
+        self._n -= s
+        v = (self._acc >> self._n) & ((1 << s) - 1)
+        if v < 1 << (s - 1):
+            v -= (1 << s) - 1
+        return v
+
+    # _restart handles a restart marker: byte-aligns and resets the DC predictors
+    def _restart(self):
+        self._n = 0
+        self._acc = 0
+        while self._mark is None:
+            b = self._byte()
+            if b < 0:
+                break
+            if b == 0xFF:
+                b = self._byte()
+                if b != 0 and b != 0xFF:
+                    self._mark = b
+        self._mark = None
+        for c in self._comps:
+            c[6] = 0
+
+    # _block decodes one 8x8 block into coef (dequantized, natural order). Only coefficients
+    # whose index is set in keep are stored.
+    def _block(self, comp, coef, keep):
+        q = self._qt[comp[3]]
+        t = self._decode(self._dc[comp[4]])
+        comp[6] += self._receive(t) if t else 0
+        coef[0] = comp[6] * q[0]
+        ac = self._ac[comp[5]]
+        k = 1
+        while k < 64:
+            rs = self._decode(ac)
+            s = rs & 0xF
+            if s:
+                k += rs >> 4
+                v = self._receive(s)
+                if k < 64 and keep[k]:
+                    coef[_ZIGZAG[k]] = v * q[k]
+                k += 1
+            elif rs == 0xF0:
+                k += 16
+            else:
+                break
+
+    # rows yields (y, row) for every row of the (scaled) image from top to bottom, row holding
+    # width bytes of luminance (0=black..255=white), or 3*width bytes of RGB if rgb is True.
+    # Greyscale output only decodes the luma blocks; chroma blocks are skipped after their
+    # Huffman codes are read. The same buffer is reused for every row.
+    # A window of columns x0..x1-1 and rows y0..y1-1 (in scaled pixels) can be requested.
+    # Blocks outside of it are only Huffman decoded, without the inverse DCT, and decoding
+    # stops after the MCU row holding y1-1.
+    def rows(self, rgb=False, x0=0, y0=0, x1=None, y1=None):
+        x1 = self.width if x1 is None else x1
+        y1 = self.height if y1 is None else y1
+        n = 8 // self.scale
+        comps = self._comps
+        for c in comps:
+            c[6] = 0
+        hmax = max(c[1] for c in comps)
+        vmax = max(c[2] for c in comps)
+        mcux = (self.srcWidth + 8 * hmax - 1) // (8 * hmax)
+        mcuy = (self.srcHeight + 8 * vmax - 1) // (8 * vmax)
+        color = rgb and len(comps) == 3
+        # per component: plane buffer holding one MCU row, its stride and whether it is decoded
+        planes = []
+        for i, c in enumerate(comps):
+            stride = mcux * c[1] * n
+            planes.append(bytearray(stride * c[2] * n) if i == 0 or color else None)
+        keep = bytes(
+            1 if (_ZIGZAG[k] & 7) < n and (_ZIGZAG[k] >> 3) < n else 0 for k in range(64)
+        )
+        skip = bytes(64)
+        coef = array("i", bytes(4 * 64))
+        scratch = array("i", bytes(4 * (_D_TMP + 64)))
+        scratch[_D_N] = n
+        tab = _basis(n) if n > 1 else None
+        w = x1 - x0
+        line = [bytearray(w) for _ in comps] if color or hmax > comps[0][1] else None
+        out = bytearray(3 * w) if rgb else None
+        self._buf = b""
+        self._pos = 0
+        self._acc = 0
+        self._n = 0
+        self._mark = None
+        interval = self._restartInterval
+        todo = interval
+        y = 0
+        mw = hmax * n  # size of an MCU in output pixels
+        mh = vmax * n
+        for my in range(mcuy):
+            if my * mh >= y1:
+                return
+            rowVisible = (my + 1) * mh > y0
+            for mx in range(mcux):
+                if interval:
+                    if todo == 0:
+                        self._restart()
+                        todo = interval
+                    todo -= 1
+                visible = rowVisible and mx * mw < x1 and (mx + 1) * mw > x0
+                for ci, c in enumerate(comps):
+                    plane = planes[ci] if visible else None
+                    stride = mcux * c[1] * n
+                    scratch[_D_STRIDE] = stride
+                    for v in range(c[2]):
+                        for h in range(c[1]):
+                            self._block(c, coef, skip if plane is None else keep)
+                            if plane is None:
+                                coef[0] = 0
+                                continue
+                            scratch[_D_OFF] = v * n * stride + (mx * c[1] + h) * n
+                            if tab:
+                                _idct(coef, plane, scratch, tab)
+                            else:
+                                _dc_fill(coef, plane, scratch)
+            # hand out the rows of this MCU row
+            for r in range(mh):
+                if y >= y1:
+                    return
+                if y < y0:
+                    y += 1
+                    continue
+                for ci, c in enumerate(comps):
+                    if planes[ci] is None or line is None:
+                        continue
+                    fy = vmax // c[2]
+                    stride = mcux * c[1] * n
+                    xsh = (x0 << 2) | _LOG2[hmax // c[1]]
+                    _upsample(planes[ci], line[ci], (r // fy) * stride, xsh)
+                if color:
+                    _ycc_rgb(line[0], line[1], line[2], out)
+                    yield y, out
+                else:
+                    fy = vmax // comps[0][2]
+                    if line:
+                        lum = line[0]
+                    else:
+                        off = (r // fy) * mcux * comps[0][1] * n + x0
+                        lum = memoryview(planes[0])[off : off + w]
+                    if rgb:
+                        _grey_rgb(lum, out)
+                        lum = out
+                    yield y, lum
+                y += 1
@@ -4,63 +4,168 @@ from micropython import const
 
 # MCP23017 registers - defined as const(), which makes them module-global
 IODIR = const(0)
+GPINTEN = const(0x4)
+INTCON = const(0x8)
 IOCON = const(0xA)
 GPPU = const(0xC)
+INTF = const(0xE)
+INTCAP = const(0x10)
 GPIO = const(0x12)
 OLAT = const(0x14)
+NREGS = const(0x16)  # number of registers (in IOCON.BANK=0 order, A and B interleaved)
 
 
-# MCP23017 is a minimal driver for an 16-bit I2C I/O expander
+# MCP23017 is a minimal driver for an 16-bit I2C I/O expander.
+# All registers are mirrored in a local shadow copy that is read in one burst at init, so that
+# changing a bit of a configuration register or an output is a single write and reading one is
+# free. Only INTF, INTCAP and GPIO, which the chip changes by itself, are read over I2C. In the
+# shadow copy GPIO holds the output latch, same as OLAT.
+# Writes made inside a `with mcp.batch():` block are only recorded and get sent when the block
+# ends, as one burst write per run of consecutive changed registers.
 class MCP23017:
     def __init__(self, i2c, addr=0x20):
         self.i2c = i2c
         self.addr = addr
+        self._buf1 = bytearray(1)
+        self._buf2 = bytearray(2)
+        self._regs = bytearray(NREGS)
+        self._mv = memoryview(self._regs)
+        self._cap = bytearray(GPIO + 2 - INTF)  # INTF, INTCAP and GPIO of both ports
+        self._batch = 0  # nesting depth of batch() blocks
+        self._dirty = 0  # bit mask of registers changed inside batch()
         self.write(IOCON, 0x00)
-        self.write2(IODIR, 0xFF, 0xFF)  # all inputs
-        self.gpio0 = 0
-        self.gpio1 = 0
-        self.write2(GPIO, 0, 0)
+        self.i2c.readfrom_mem_into(addr, 0, self._regs)
+        self._regs[GPIO] = self._regs[OLAT]
+        self._regs[GPIO + 1] = self._regs[OLAT + 1]
+        with self.batch():
+            self.write2(IODIR, 0xFF, 0xFF)  # all inputs
+            self.write2(GPIO, 0, 0)
 
     # read an 8-bit register, internal method
     def read(self, reg):
-        return self.i2c.readfrom_mem(self.addr, reg, 1)[0]
+        self.i2c.readfrom_mem_into(self.addr, reg, self._buf1)
+        return self._buf1[0]
+
+    # _shadow records v as the new value of a register and returns whether it has to be sent
+    # now, i.e. we're not inside batch()
+    def _shadow(self, reg, v):
+        regs = self._regs
+        regs[reg] = v
+        if reg >= GPIO:
+            regs[GPIO + (reg & 1)] = v  # writing GPIO sets OLAT and vice versa
+            regs[OLAT + (reg & 1)] = v
+        elif reg == IOCON or reg == IOCON + 1:
+            regs[IOCON] = v  # both addresses are the same register
+            regs[IOCON + 1] = v
+        if self._batch:
+            self._dirty |= 1 << reg
+            return False
+        return True
 
     # write an 8-bit register, internal method
     def write(self, reg, v):
-        self.i2c.writeto_mem(self.addr, reg, bytes((v,)))
+        if self._shadow(reg, v):
+            buf = self._buf1
+            buf[0] = v
+            self.i2c.writeto_mem(self.addr, reg, buf)
 
     # write two 8-bit registers, internal method
     def write2(self, reg, v1, v2):
-        self.i2c.writeto_mem(self.addr, reg, bytes((v1, v2)))
+        now = self._shadow(reg, v1)
+        self._shadow(reg + 1, v2)
+        if now:
+            buf = self._buf2
+            buf[0] = v1
+            buf[1] = v2
+            self.i2c.writeto_mem(self.addr, reg, buf)
 
-    # writebuf writes multiple bytes to the same register
+    # writebuf writes multiple bytes to the same register, bypassing the shadow copy
     def writebuf(self, reg, v):
         self.i2c.writeto_mem(self.addr, reg, v)
 
-    # bit reads or sets a bit in a register, caching the gpio register for performance
+    # batch returns a context manager that defers register writes until the outermost block
+    # ends, e.g. `with mcp.batch(): ...`
+    def batch(self):
+        return self
+
+    def __enter__(self):
+        self._batch += 1
+        return self
+
+    def __exit__(self, *args):
+        self._batch -= 1
+        if self._batch == 0 and self._dirty:
+            self._flush()
+
+    # _flush sends the registers changed inside batch(). The output latches go first so that pins
+    # switched to output start at the right level.
+    def _flush(self):
+        dirty = self._dirty
+        self._dirty = 0
+        mv = self._mv
+        for lo, hi in ((GPIO, NREGS), (IODIR, GPIO)):
+            reg = lo
+            while reg < hi:
+                if dirty >> reg & 1:
+                    end = reg + 1
+                    while end < hi and dirty >> end & 1:
+                        end += 1
+                    self.i2c.writeto_mem(self.addr, reg, mv[reg:end])
+                    reg = end
+                else:
+                    reg += 1
+
+    # bit reads or sets a bit in a register. Reads of registers other than INTF, INTCAP and GPIO
+    # come from the shadow copy, writes that don't change the register are skipped.
     def bit(self, reg, num, v=None):
         if v is None:
-            data = self.read(reg)
-            if reg == GPIO:
-                self.gpio0 = data
-            elif reg == GPIO + 1:
-                self.gpio1 = data
+            if INTF <= reg < OLAT:
+                data = self.read(reg)
+            else:
+                data = self._regs[reg]
             return (data >> num) & 1
         else:
             mask = 0xFF ^ (1 << num)
-            if reg == GPIO:
-                self.gpio0 = (self.gpio0 & mask) | ((v & 1) << num)
-                self.write(reg, self.gpio0)
-            elif reg == GPIO + 1:
-                self.gpio1 = (self.gpio1 & mask) | ((v & 1) << num)
-                self.write(reg, self.gpio1)
-            else:
-                data = (self.read(reg) & mask) | ((v & 1) << num)
+            old = self._regs[reg]
+            data = (old & mask) | ((v & 1) << num)
+            if data != old:
                 self.write(reg, data)
 
+    # port sets the output latch bits in mask of port 0 (pins 0-7) or 1 (pins 8-15) to those of
+    # value, with a single write
+    def port(self, port, mask, value):
+        reg = GPIO + port
+        old = self._regs[reg]
+        data = (old & ~mask) | (value & mask)
+        if data != old:
+            self.write(reg, data)
+
+    # interrupts makes the INTA and INTB outputs signal any change of the pins in mask (bit n for
+    # pin n), which must be inputs. The outputs are active high push-pull unless activeLow is
+    # set; with mirror set both signal changes on either port, else each only its own port.
+    def interrupts(self, mask, activeLow=False, mirror=False):
+        regs = self._regs
+        with self.batch():
+            iocon = regs[IOCON] & ~0x46  # MIRROR, ODR and INTPOL bits
+            self.write(IOCON, iocon | (0x40 if mirror else 0) | (0 if activeLow else 0x02))
+            # compare against the previous pin value rather than DEFVAL
+            self.write2(INTCON, regs[INTCON] & ~mask & 0xFF, regs[INTCON + 1] & ~(mask >> 8))
+            self.write2(GPINTEN, regs[GPINTEN] | (mask & 0xFF), regs[GPINTEN + 1] | (mask >> 8))
+
+    # capture reads INTF, INTCAP and GPIO of both ports in one transaction, which also clears a
+    # pending interrupt. It returns the 16-bit values (intf, intcap, gpio), bit n for pin n.
+    def capture(self):
+        cap = self._cap
+        self.i2c.readfrom_mem_into(self.addr, INTF, cap)
+        return cap[0] | cap[1] << 8, cap[2] | cap[3] << 8, cap[4] | cap[5] << 8
+
     def pin(self, num, mode=mPin.IN, pull=None, value=None):
         return Pin(self, num, mode, pull, value)
 
+    # group returns a PinGroup that drives the given pins, all on the same port, together
+    def group(self, *nums):
+        return PinGroup(self, nums)
+
 
 # Pin implements a minimal machine.Pin look-alike for pins on the MCP23017
 class Pin:
@@ -69,10 +174,11 @@ class Pin:
         incr = num >> 3  # bank selector
         self.gpio = GPIO + incr
         self.num = num = num & 0x7
-        if value is not None:
-            self.bit(self.gpio, num, value)
-        self.bit(IODIR + incr, num, 1 if mode == mPin.IN else 0)
-        self.bit(GPPU + incr, num, 1 if pull == mPin.PULL_UP else 0)
+        with mcp23017.batch():
+            if value is not None:
+                self.bit(self.gpio, num, value)
+            self.bit(IODIR + incr, num, 1 if mode == mPin.IN else 0)
+            self.bit(GPPU + incr, num, 1 if pull == mPin.PULL_UP else 0)
 
     # value reads or write a pin value (0 or 1)
     def value(self, v=None):
@@ -82,3 +188,22 @@ class Pin:
             self.bit(self.gpio, self.num, v)
 
     __call__ = value
+
+
+# PinGroup sets several output pins of the same port at once. The pins must have been set up
+# as outputs with pin() first.
+class PinGroup:
+    def __init__(self, mcp23017, nums):
+        self.port = mcp23017.port
+        self.num = nums[0] >> 3
+        self.mask = 0
+        for n in nums:
+            if n >> 3 != self.num:
+                raise ValueError("pins of a PinGroup must be on the same port")
+            self.mask |= 1 << (n & 0x7)
+
+    # value sets all the pins of the group to v (0 or 1)
+    def value(self, v):
+        self.port(self.num, self.mask, self.mask if v else 0)
+
+    __call__ = value
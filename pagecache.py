@@ -0,0 +1,53 @@
+# PageCache keeps snapshots of whole framebuffers in RAM (PSRAM on the boards that have it),
+# run-length coded with rle.py, so that apps flipping between pages can bring one back with a
+# single decode instead of drawing it again. Entries live in numbered slots; once they take
+# more than the byte budget the least recently used ones are dropped.
+import rle
+
+_CHUNK = 1024  # bytes coded at a time, so that no framebuffer sized scratch is needed
+
+
+class PageCache:
+    def __init__(self, budget=256 * 1024):
+        self._budget = budget
+        self._slots = {}  # slot -> (format, compressed data)
+        self._order = []  # slots, least recently used first
+
+    # save stores a copy of framebuffer fb, whose format is fmt, in slot. Only the coded page
+    # is kept; the buffers it is coded into are temporary.
+    def save(self, slot, fb, fmt):
+        out, offsets = rle.compress_rows(fb, _CHUNK)
+        data = bytes(memoryview(out)[: offsets[len(offsets) - 1]])
+        out = offsets = None
+        self.discard(slot)
+        if len(data) > self._budget:
+            return False
+        self._slots[slot] = (fmt, data)
+        self._order.append(slot)
+        while self.size() > self._budget:
+            self.discard(self._order[0])
+        return True
+
+    # restore decodes slot into framebuffer fb and returns True, or returns False if the slot is
+    # empty or holds a framebuffer of another format
+    def restore(self, slot, fb, fmt):
+        e = self._slots.get(slot)
+        if e is None or e[0] != fmt:
+            return False
+        if not rle.decompress(e[1], fb):
+            return False
+        self._order.remove(slot)
+        self._order.append(slot)
+        return True
+
+    def discard(self, slot):
+        if slot in self._slots:
+            del self._slots[slot]
+            self._order.remove(slot)
+
+    def __contains__(self, slot):
+        return slot in self._slots
+
+    # size returns the number of bytes taken by the cached pages
+    def size(self):
+        return sum(len(e[1]) for e in self._slots.values())
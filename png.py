@@ -0,0 +1,279 @@
+# Streaming PNG decoder for the Inkplate image pipeline.
+# The IDAT chunks are inflated through MicroPython's deflate (or older uzlib) module straight
+# into a single scanline buffer; the previous scanline is kept around for the PNG filters. Each
+# row is then converted to 8-bit luminance (or RGB) and handed out, so memory use is O(width)
+# whatever the size of the image. Greyscale, palette and RGB images, with or without alpha, at
+# all bit depths are supported. Interlaced images are not.
+import io
+import micropython
+from micropython import const
+from uarray import array
+
+try:
+    import deflate
+except ImportError:
+    deflate = None
+    import uzlib
+
+SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# PNG colour types
+_GREY = const(0)
+_RGB = const(2)
+_PALETTE = const(3)
+_GREY_ALPHA = const(4)
+_RGBA = const(6)
+
+_CHANNELS = {_GREY: 1, _RGB: 3, _PALETTE: 1, _GREY_ALPHA: 2, _RGBA: 4}
+
+# Indices into the info array handed to _convert
+_I_WIDTH = const(0)
+_I_TYPE = const(1)
+_I_DEPTH = const(2)
+_I_RGB = const(3)
+_I_X0 = const(4)
+
+
+# _IDATStream presents the payload of consecutive IDAT chunks as one stream so it can be fed
+# to the decompressor. It starts positioned at the data of the first IDAT chunk.
+class _IDATStream(io.IOBase):
+    def __init__(self, f, length):
+        self._f = f
+        self._left = length
+
+    def readinto(self, buf):
+        f = self._f
+        while self._left == 0:
+            f.read(4)  # CRC of the previous chunk
+            hdr = f.read(8)
+            if len(hdr) < 8 or hdr[4:8] != b"IDAT":
+                return 0
+            self._left = int.from_bytes(hdr[:4], "big")
+        n = min(len(buf), self._left)
+        n = f.readinto(memoryview(buf)[:n])
+        self._left -= n
+        return n
+
+
+# _unfilter reverses the PNG filter of a scanline in place. cur and prev hold the filter type
+# byte followed by the scanline, n is the length including the filter byte and bpp is the
+# number of bytes per complete pixel (at least 1).
+@micropython.viper
+def _unfilter(cur, prev, n: int, bpp: int):
+    c = ptr8(cur)
+    p = ptr8(prev)
+    ftype = int(c[0])
+    if ftype == 1:  # Sub
+        for i in range(1 + bpp, n):
+            c[i] = int(c[i]) + int(c[i - bpp])
+    elif ftype == 2:  # Up
+        for i in range(1, n):
+            c[i] = int(c[i]) + int(p[i])
+    elif ftype == 3:  # Average
+        for i in range(1, n):
+            a = int(c[i - bpp]) if i > bpp else 0
+            c[i] = int(c[i]) + ((a + int(p[i])) >> 1)
+    elif ftype == 4:  # Paeth
+        for i in range(1, n):
+            b = int(p[i])
+            if i > bpp:
+                a = int(c[i - bpp])
+                cc = int(p[i - bpp])
+            else:
+                a = 0
+                cc = 0
+            pa = b - cc
+            pb = a - cc
+            pc = pa + pb
+            if pa < 0:
+                pa = -pa
+            if pb < 0:
+                pb = -pb
+            if pc < 0:
+                pc = -pc
+            if pa <= pb and pa <= pc:
+                pr = a
+            elif pb <= pc:
+                pr = b
+            else:
+                pr = cc
+            c[i] = int(c[i]) + pr
+
+
+# _over_white composites a channel value v with alpha a over a white background
+@micropython.viper
+def _over_white(v: int, a: int) -> int:
+    t = v * a + 255 * (255 - a) + 128
+    return (t + (t >> 8)) >> 8
+
+
+# _convert turns info[_I_WIDTH] pixels of an unfiltered scanline (after the filter type byte),
+# starting with pixel info[_I_X0], into 8-bit luminance or, if info[_I_RGB] is set, RGB
+# triplets. Greyscale up to 8 bits and palette samples are looked up in lut (256 luminance
+# values, or 768 RGB values). Alpha is composited over white.
+@micropython.viper
+def _convert(src, dst, lut, info):
+    s = ptr8(src)
+    d = ptr8(dst)
+    t = ptr8(lut)
+    inf = ptr32(info)
+    w = int(inf[_I_WIDTH])
+    ctype = int(inf[_I_TYPE])
+    depth = int(inf[_I_DEPTH])
+    rgb = int(inf[_I_RGB])
+    x0 = int(inf[_I_X0])
+    step = 2 if depth == 16 else 1  # samples are 1 or 2 bytes, we only use the high byte
+    o = 0
+    if ctype == _GREY or ctype == _PALETTE:
+        mask = (1 << depth) - 1
+        for i in range(w):
+            if depth >= 8:
+                v = int(s[1 + (x0 + i) * step])
+            else:
+                bit = (x0 + i) * depth
+                v = (int(s[1 + (bit >> 3)]) >> (8 - depth - (bit & 7))) & mask
+            if rgb:
+                d[o] = t[v * 3]
+                d[o + 1] = t[v * 3 + 1]
+                d[o + 2] = t[v * 3 + 2]
+                o += 3
+            else:
+                d[i] = t[v]
+    elif ctype == _GREY_ALPHA:
+        for i in range(w):
+            p = (x0 + i) * 2 * step
+            v = int(_over_white(int(s[1 + p]), int(s[1 + p + step])))
+            if rgb:
+                d[o] = v
+                d[o + 1] = v
+                d[o + 2] = v
+                o += 3
+            else:
+                d[i] = v
+    else:
+        nch = 4 if ctype == _RGBA else 3
+        for i in range(w):
+            j = 1 + (x0 + i) * nch * step
+            r = int(s[j])
+            g = int(s[j + step])
+            b = int(s[j + 2 * step])
+            if nch == 4:
+                a = int(s[j + 3 * step])
+                r = int(_over_white(r, a))
+                g = int(_over_white(g, a))
+                b = int(_over_white(b, a))
+            if rgb:
+                d[o] = r
+                d[o + 1] = g
+                d[o + 2] = b
+                o += 3
+            else:
+                d[i] = (54 * r + 183 * g + 19 * b) >> 8
+
+
+def _read_full(s, buf):
+    mv = memoryview(buf)
+    n = 0
+    while n < len(buf):
+        r = s.readinto(mv[n:])
+        if not r:
+            raise ValueError("truncated PNG data")
+        n += r
+
+
+# PNG parses the header of a PNG file and then decodes it one row at a time. The file object
+# must stay open while rows are being read.
+class PNG:
+    def __init__(self, f):
+        self._f = f
+        if f.read(8) != SIGNATURE:
+            raise ValueError("not a PNG file")
+        palette = None
+        trns = None
+        while True:
+            hdr = f.read(8)
+            if len(hdr) < 8:
+                raise ValueError("PNG file has no image data")
+            length = int.from_bytes(hdr[:4], "big")
+            kind = hdr[4:8]
+            if kind == b"IDAT":
+                self._idat = length
+                break
+            if kind == b"IHDR":
+                d = f.read(length)
+                self.width = int.from_bytes(d[0:4], "big")
+                self.height = int.from_bytes(d[4:8], "big")
+                self.depth = d[8]
+                self.colorType = d[9]
+                if d[12] != 0:
+                    raise ValueError("interlaced PNG not supported")
+            elif kind == b"PLTE":
+                palette = f.read(length)
+            elif kind == b"tRNS":
+                trns = f.read(length)
+            else:
+                f.seek(length, 1)
+            f.read(4)  # CRC
+        if self.colorType not in _CHANNELS:
+            raise ValueError("bad PNG colour type")
+        self._palette = palette
+        self._trns = trns
+
+    # _lut builds the sample -> luminance (or RGB) table for greyscale and palette images
+    def _lut(self, rgb):
+        ctype = self.colorType
+        n = 1 << min(self.depth, 8)
+        lut = bytearray(768 if rgb else 256)
+        trns = self._trns
+        for v in range(n):
+            if ctype == _PALETTE:
+                p = self._palette
+                if 3 * v + 2 >= len(p):
+                    break
+                r, g, b = p[3 * v], p[3 * v + 1], p[3 * v + 2]
+                if trns is not None and v < len(trns):
+                    a = trns[v]
+                    r, g, b = _over_white(r, a), _over_white(g, a), _over_white(b, a)
+            else:
+                r = g = b = v * 255 // (n - 1)
+                if trns is not None and v == int.from_bytes(trns[:2], "big") >> max(
+                    self.depth - 8, 0
+                ):
+                    r = g = b = 255
+            if rgb:
+                lut[3 * v] = r
+                lut[3 * v + 1] = g
+                lut[3 * v + 2] = b
+            else:
+                lut[v] = (54 * r + 183 * g + 19 * b) >> 8
+        return lut
+
+    # rows yields (y, row) for every row of the image from top to bottom, row holding width
+    # bytes of luminance (0=black..255=white), or 3*width bytes of RGB if rgb is True.
+    # The same buffer is reused for every row.
+    # A window of columns x0..x1-1 and rows y0..y1-1 can be requested, only those pixels are
+    # converted and decompression stops after row y1-1. Earlier rows still have to be inflated.
+    def rows(self, rgb=False, x0=0, y0=0, x1=None, y1=None):
+        x1 = self.width if x1 is None else x1
+        y1 = self.height if y1 is None else y1
+        ch = _CHANNELS[self.colorType]
+        bits = ch * self.depth
+        bpp = max(1, bits >> 3)
+        stride = (self.width * bits + 7) >> 3
+        cur = bytearray(stride + 1)
+        prev = bytearray(stride + 1)
+        out = bytearray((x1 - x0) * 3 if rgb else x1 - x0)
+        lut = self._lut(rgb) if self.colorType in (_GREY, _PALETTE) else b""
+        info = array("i", (x1 - x0, self.colorType, self.depth, 1 if rgb else 0, x0))
+        src = _IDATStream(self._f, self._idat)
+        if deflate:
+            z = deflate.DeflateIO(src, deflate.ZLIB)
+        else:
+            z = uzlib.DecompIO(src)
+        for y in range(y1):
+            _read_full(z, cur)
+            _unfilter(cur, prev, stride + 1, bpp)
+            if y >= y0:
+                _convert(cur, out, lut, info)
+                yield y, out
+            cur, prev = prev, cur
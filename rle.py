@@ -0,0 +1,137 @@
+# Byte-oriented run-length coding for framebuffers, which are mostly long runs of white (or
+# black) bytes. The format is PackBits-like: a control byte c below 128 is followed by c+1
+# literal bytes, a control byte c from 128 up means the next byte repeated c-126 times (2 to
+# 129). Encoding and decoding are single viper passes without allocation.
+import micropython
+from micropython import const
+from uarray import array
+
+_MAX_LIT = const(128)
+_MAX_RUN = const(129)
+
+
+# _encode compresses n bytes of src into dst, which must hold at least bound(n) bytes, and
+# returns the compressed length
+@micropython.viper
+def _encode(src, dst, n: int) -> int:
+    s = ptr8(src)
+    d = ptr8(dst)
+    i = 0
+    o = 0
+    lit = 0  # start of the pending literals
+    v = 0
+    while i <= n:
+        r = 0
+        if i < n:
+            v = int(s[i])
+            j = i + 1
+            while j < n and j - i < _MAX_RUN and int(s[j]) == v:
+                j += 1
+            r = j - i
+            if r < 3:
+                # too short to be worth a run, it stays part of the literals
+                i = j
+                continue
+        # a run starts at i (or the data ends), flush the literals before it
+        while lit < i:
+            m = i - lit
+            if m > _MAX_LIT:
+                m = _MAX_LIT
+            d[o] = m - 1
+            o += 1
+            for k in range(lit, lit + m):
+                d[o] = s[k]
+                o += 1
+            lit += m
+        if r == 0:
+            break
+        d[o] = r + 126
+        d[o + 1] = v
+        o += 2
+        i += r
+        lit = i
+    return o
+
+
+# _decode expands the compressed bytes src[i:n] into dst and returns the number of bytes
+# written, or -1 if the data ends in the middle of a literal or run. Data that would run past
+# the end of dst is dropped.
+@micropython.viper
+def _decode(src, i: int, n: int, dst) -> int:
+    s = ptr8(src)
+    d = ptr8(dst)
+    size = int(len(dst))
+    o = 0
+    while i < n:
+        c = int(s[i])
+        i += 1
+        if c < 128:
+            if i + c + 1 > n:
+                return -1
+            for k in range(c + 1):
+                if o < size:
+                    d[o] = s[i + k]
+                o += 1
+            i += c + 1
+        else:
+            if i >= n:
+                return -1
+            v = int(s[i])
+            i += 1
+            for k in range(c - 126):
+                if o < size:
+                    d[o] = v
+                o += 1
+    return o
+
+
+# bound returns the largest possible compressed size of n bytes
+def bound(n):
+    return n + (n + _MAX_LIT - 1) // _MAX_LIT
+
+
+# compress returns data run-length coded as bytes. scratch, if given, must hold bound(len(data))
+# bytes and saves allocating a temporary buffer of that size.
+def compress(data, scratch=None):
+    if scratch is None:
+        scratch = bytearray(bound(len(data)))
+    n = _encode(data, scratch, len(data))
+    return bytes(memoryview(scratch)[:n])
+
+
+# decompress expands compressed data into out, which must have the original size; it returns
+# False if the data is cut short or does not decode to exactly that size
+def decompress(data, out):
+    return _decode(data, 0, len(data), out) == len(out)
+
+
+# compress_rows compresses data as rows of rowLen bytes each (the last one may be shorter), coded
+# back to back into the bytearray out, and returns (out, offsets) where row i is
+# out[offsets[i]:offsets[i + 1]] and the coded data ends at offsets[rows]. out is grown (that is,
+# replaced by a larger one) as needed and may be longer than the coded data; offsets needs an
+# entry per row plus one. Passing back the out and offsets of an earlier call reuses them.
+def compress_rows(data, rowLen, out=None, offsets=None):
+    n = len(data)
+    rows = (n + rowLen - 1) // rowLen
+    if offsets is None or len(offsets) < rows + 1:
+        offsets = array("I", bytes(4 * (rows + 1)))
+    if out is None:
+        out = bytearray(0)
+    mv = memoryview(data)
+    o = 0
+    offsets[0] = 0
+    for r in range(rows):
+        a = r * rowLen
+        m = min(rowLen, n - a)
+        if len(out) - o < bound(m):
+            grown = bytearray(max(2 * len(out), o + bound(m)))
+            grown[:o] = memoryview(out)[:o]
+            out = grown
+        o += _encode(mv[a : a + m], memoryview(out)[o:], m)
+        offsets[r + 1] = o
+    return out, offsets
+
+
+# decompress_row expands row i of rows compressed by compress_rows into out
+def decompress_row(data, offsets, i, out):
+    _decode(data, offsets[i], offsets[i + 1], out)
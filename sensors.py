@@ -0,0 +1,186 @@
+# Sampler reads the battery voltage and the panel temperature in the background and keeps the
+# readings in small rings, so that apps (and the waveform selection of display()) get the
+# latest smoothed value at once instead of blocking on the ADC and the TPS65186. A reading is
+# split into steps a few milliseconds apart on a one-shot machine.Timer, so nothing sleeps:
+# the battery divider is switched on and the TPS65186 woken, then a temperature conversion is
+# started, then both are read, the battery oversampled. The steps go through the board's I2CBus
+# at BACKGROUND priority: while the bus is held, by an update driving the panel or by input, the
+# next step is deferred until it is released. After an I2C error the reading is given up and
+# retried a little later.
+import time
+from machine import Timer
+from uarray import array
+from i2cbus import BACKGROUND, DISPLAY
+
+_WAKE = 0
+_CONVERT = 1
+_READ = 2
+_STEP_MS = 5  # time the TPS65186 gets to wake up and to convert
+_RETRY_MS = 200  # retry delay after an error
+
+
+class Sampler:
+    scale = 1.0  # battery calibration, volts = reading * scale + offset
+    offset = 0.0
+    smooth = 4  # number of readings averaged by battery() and temperature()
+    oversample = 8  # ADC samples per battery reading
+
+    # ip is the board's _Inkplate class, size the number of readings kept and timer the id of
+    # the machine.Timer to use
+    def __init__(self, ip, size=16, timer=1):
+        self._ip = ip
+        self._v = array("f", bytes(4 * size))
+        self._t = array("f", bytes(4 * size))
+        self._at = array("i", bytes(4 * size))  # ticks_ms of each reading
+        self._n = 0  # readings in the rings
+        self._i = 0  # where the next reading goes
+        self._timer = Timer(timer)
+        self._step = _WAKE
+        self._woke = False  # whether we woke the TPS65186
+        self._active = False
+        self._cb = self._run  # one bound method, so I2CBus.defer queues it only once
+        self.period = 60000
+
+    # start takes a reading now and then every period_ms milliseconds
+    def start(self, period_ms=60000):
+        self.period = period_ms
+        self._step = _WAKE
+        self._active = True
+        self._arm(1)
+
+    def stop(self):
+        self._active = False
+        self._timer.deinit()
+
+    def _arm(self, ms):
+        self._timer.init(mode=Timer.ONE_SHOT, period=ms, callback=self._cb)
+
+    # _run does the next step of a reading. ESP32 timer callbacks are scheduled, so I2C can be
+    # used here. While the bus is held the step waits for it in the I2CBus queue. If a step
+    # fails, or the TPS65186 was put to sleep since the last one, the pins are put back and
+    # the reading starts over.
+    def _run(self, _):
+        if not self._active:
+            return
+        bus = self._ip._i2c
+        try:
+            if bus.busy(BACKGROUND):
+                if not bus.defer(self._cb, None, BACKGROUND):
+                    # the queue is full, try again later
+                    self._reset()
+                    self._arm(_RETRY_MS)
+                return
+            if self._step != _WAKE and not self._awake():
+                self._reset()
+                self._arm(_STEP_MS)
+                return
+            self._next()
+        except OSError:
+            try:
+                self._reset()
+            except OSError:
+                self._step = _WAKE
+            self._arm(_RETRY_MS)
+
+    def _next(self):
+        ip = self._ip
+        if self._step == _WAKE:
+            self._woke = not ip._on
+            self._step = _CONVERT  # set first so a failed write below is undone too
+            with ip._mcp23017.batch():
+                ip.VBAT_EN.value(0)
+                if self._woke:
+                    ip.TPS_WAKEUP.value(1)
+            self._arm(_STEP_MS)
+        elif self._step == _CONVERT:
+            ip._tps65186_write(0x0D, 0x80)
+            self._step = _READ
+            self._arm(_STEP_MS)
+        else:
+            adc = ip.VBAT
+            acc = 0
+            uv = hasattr(adc, "read_uv")  # calibrated from eFuse on newer firmware
+            for _ in range(self.oversample):
+                acc += adc.read_uv() if uv else adc.read()
+            raw = ip._tps65186_read(0x00)
+            self._reset()
+            acc /= self.oversample
+            v = acc / 1000000 * 2 if uv else acc / 4095.0 * 1.1 * 3.548133892 * 2
+            self._push(v * self.scale + self.offset, raw - 256 if raw > 127 else raw)
+            self._arm(self.period)
+
+    # _awake returns whether the TPS65186 is still awake: the panel is powered, or we woke it and
+    # nothing has put it back to sleep since
+    def _awake(self):
+        ip = self._ip
+        return ip._on or (self._woke and ip.TPS_WAKEUP.value())
+
+    # _reset undoes the pin changes of the _WAKE step and goes back to it, after a reading or
+    # when one is given up
+    def _reset(self):
+        ip = self._ip
+        if self._step != _WAKE:
+            with ip._mcp23017.batch():
+                ip.VBAT_EN.value(1)
+                if self._woke and not ip._on and not ip._i2c.busy(DISPLAY):
+                    ip.TPS_WAKEUP.value(0)
+        self._step = _WAKE
+        self._woke = False
+
+    def _push(self, v, t):
+        i = self._i
+        self._v[i] = v
+        self._t[i] = t
+        self._at[i] = time.ticks_ms()
+        self._i = (i + 1) % len(self._v)
+        self._n = min(self._n + 1, len(self._v))
+
+    # _recent returns the ring indices of the last n readings, newest first
+    def _recent(self, n):
+        size = len(self._v)
+        return [(self._i - 1 - k) % size for k in range(min(n, self._n))]
+
+    def _mean(self, ring):
+        idx = self._recent(self.smooth)
+        return sum(ring[i] for i in idx) / len(idx)
+
+    # age returns how many milliseconds ago the last reading was taken, or None
+    def age(self):
+        if not self._n:
+            return None
+        return time.ticks_diff(time.ticks_ms(), self._at[self._recent(1)[0]])
+
+    # battery returns the smoothed battery voltage, or None before the first reading
+    def battery(self):
+        return self._mean(self._v) if self._n else None
+
+    # temperature returns the smoothed panel temperature in degrees C, or None before the first
+    # reading or if the last one is older than maxAge milliseconds
+    def temperature(self, maxAge=None):
+        if not self._n or (maxAge is not None and self.age() > maxAge):
+            return None
+        return int(round(self._mean(self._t)))
+
+    # _trend fits a line through the readings in ring and returns its slope per hour
+    def _trend(self, ring):
+        idx = self._recent(self._n)
+        if len(idx) < 2:
+            return None
+        t0 = self._at[idx[0]]
+        xs = [time.ticks_diff(self._at[i], t0) / 3600000 for i in idx]
+        ys = [ring[i] for i in idx]
+        mx = sum(xs) / len(xs)
+        my = sum(ys) / len(ys)
+        sxx = sum((x - mx) * (x - mx) for x in xs)
+        if sxx == 0:
+            return None
+        return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx
+
+    # batteryTrend returns the change of the battery voltage in volts per hour over the readings
+    # kept, or None with fewer than two
+    def batteryTrend(self):
+        return self._trend(self._v)
+
+    # temperatureTrend returns the change of the panel temperature in degrees C per hour
+    def temperatureTrend(self):
+        return self._trend(self._t)
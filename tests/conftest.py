@@ -0,0 +1,73 @@
+# The modules are written for MicroPython. These tests run them under CPython, with just enough
+# of the MicroPython-only modules and builtins stood in for: the viper and native decorators
+# leave the functions as plain Python, and ptr8 / ptr32 index a memoryview of the buffer.
+import array
+import builtins
+import os
+import sys
+import types
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _Ptr:
+    def __init__(self, obj, fmt):
+        self._mv = memoryview(obj).cast("B")
+        if fmt != "B":
+            self._mv = self._mv[: len(self._mv) & ~3].cast(fmt)
+        self._mask = 0xFF if fmt == "B" else None
+
+    def __getitem__(self, i):
+        if i < 0:
+            raise IndexError("negative pointer index %d" % i)
+        return self._mv[i]
+
+    def __setitem__(self, i, v):
+        if i < 0:
+            raise IndexError("negative pointer index %d" % i)
+        # viper stores truncate to the pointer width
+        self._mv[i] = v & 0xFF if self._mask else (v + (1 << 31)) % (1 << 32) - (1 << 31)
+
+
+def _module(name, **attrs):
+    if name not in sys.modules:
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        sys.modules[name] = mod
+
+
+# uzlib.DecompIO, as used by png.py on firmware without the deflate module
+class _DecompIO:
+    def __init__(self, stream):
+        self._s = stream
+        self._d = zlib.decompressobj()
+        self._buf = b""
+
+    def readinto(self, b):
+        while not self._buf:
+            chunk = bytearray(512)
+            n = self._s.readinto(chunk)
+            if not n:
+                self._buf = self._d.flush()
+                if not self._buf:
+                    return 0
+                break
+            self._buf = self._d.decompress(bytes(chunk[:n]))
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+
+_module(
+    "micropython",
+    viper=lambda f: f,
+    native=lambda f: f,
+    const=lambda x: x,
+    schedule=lambda f, a: f(a),
+)
+_module("uarray", array=array.array)
+_module("uzlib", DecompIO=_DecompIO)
+builtins.ptr8 = lambda obj: _Ptr(obj, "B")
+builtins.ptr32 = lambda obj: _Ptr(obj, "i")
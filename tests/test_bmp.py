@@ -0,0 +1,101 @@
+import io
+import struct
+
+import pytest
+
+import bmp
+
+
+# _encode builds a BMP of rows (top to bottom), each row the raw pixel bytes without padding
+def _encode(w, depth, rows, palette=b"", masks=None, topDown=False):
+    stride = 4 * ((depth * w + 31) // 32)
+    data = b"".join(r + bytes(stride - len(r)) for r in (rows if topDown else rows[::-1]))
+    extra = b"" if masks is None else struct.pack("<3I", *masks)
+    start = 14 + 40 + len(extra) + len(palette)
+    h = -len(rows) if topDown else len(rows)
+    info = struct.pack(
+        "<IiiHHIIiiII", 40, w, h, 1, depth, 0 if masks is None else 3, len(data), 0, 0, 0, 0
+    )
+    header = b"BM" + struct.pack("<IHHI", start + len(data), 0, 0, start) + info
+    return header + extra + palette + data
+
+
+def _luma(r, g, b):
+    return (54 * r + 183 * g + 19 * b) >> 8
+
+
+RGB = [[(255, 0, 0), (0, 255, 0), (0, 0, 255)], [(0, 0, 0), (255, 255, 255), (10, 20, 30)]]
+
+
+@pytest.mark.parametrize("topDown", (False, True))
+def test_24(topDown):
+    rows = [b"".join(bytes((b, g, r)) for r, g, b in row) for row in RGB]
+    b = bmp.BMP(io.BytesIO(_encode(3, 24, rows, topDown=topDown)))
+    assert (b.width, b.height, b.depth) == (3, 2, 24)
+    assert [(y, bytes(r)) for y, r in b.rows(rgb=True)] == [
+        (y, bytes(c for px in RGB[y] for c in px)) for y in range(2)
+    ]
+    assert [bytes(r) for _, r in b.rows()] == [bytes(_luma(*px) for px in row) for row in RGB]
+
+
+def test_32_bitfields():
+    rows = [b"".join(bytes((b, g, r, 0)) for r, g, b in row) for row in RGB]
+    b = bmp.BMP(io.BytesIO(_encode(3, 32, rows, masks=(0xFF0000, 0xFF00, 0xFF))))
+    got = [bytes(r) for _, r in b.rows(rgb=True)]
+    assert got == [bytes(c for px in row for c in px) for row in RGB]
+
+
+def test_16():
+    px555 = (0x7C00, 0x03E0, 0x001F, 0x7FFF)
+    rows = [b"".join(struct.pack("<H", p) for p in px555)]
+    for masks in (None, (0x7C00, 0x3E0, 0x1F)):
+        b = bmp.BMP(io.BytesIO(_encode(4, 16, rows, masks=masks)))
+        got = [bytes(r) for _, r in b.rows(rgb=True)]
+        assert got == [bytes((248, 0, 0, 0, 248, 0, 0, 0, 248, 248, 248, 248))]
+    px565 = (0xF800, 0x07E0, 0x001F, 0xFFFF)
+    rows = [b"".join(struct.pack("<H", p) for p in px565)]
+    b = bmp.BMP(io.BytesIO(_encode(4, 16, rows, masks=(0xF800, 0x7E0, 0x1F))))
+    got = [bytes(r) for _, r in b.rows(rgb=True)]
+    assert got == [bytes((248, 0, 0, 0, 252, 0, 0, 0, 248, 248, 252, 248))]
+
+
+@pytest.mark.parametrize("depth", (1, 4, 8))
+def test_palette(depth):
+    colors = 1 << depth
+    palette = b"".join(bytes((3 * i % 256, 5 * i % 256, 7 * i % 256, 0)) for i in range(colors))
+    w = 11
+    values = [[(x * 3 + y) % colors for x in range(w)] for y in range(3)]
+    rows = []
+    for row in values:
+        bits = 0
+        for v in row:
+            bits = (bits << depth) | v
+        pad = (8 - w * depth % 8) % 8
+        rows.append((bits << pad).to_bytes((w * depth + 7) // 8, "big"))
+    b = bmp.BMP(io.BytesIO(_encode(w, depth, rows, palette)))
+    got = [list(r) for _, r in b.rows()]
+    assert got == [[_luma(7 * v % 256, 5 * v % 256, 3 * v % 256) for v in row] for row in values]
+    # a window that starts inside a byte
+    b = bmp.BMP(io.BytesIO(_encode(w, depth, rows, palette)))
+    got = [(y, bytes(r)) for y, r in b.rows(rgb=True, x0=3, y0=1, x1=9, y1=3)]
+    exp = [
+        (y, bytes(c for v in values[y][3:9] for c in (7 * v % 256, 5 * v % 256, 3 * v % 256)))
+        for y in (1, 2)
+    ]
+    assert got == exp
+
+
+def test_bad_files():
+    with pytest.raises(ValueError):
+        bmp.BMP(io.BytesIO(b"\x89PNG\r\n\x1a\n" + bytes(60)))
+    with pytest.raises(ValueError):
+        bmp.BMP(io.BytesIO(_encode(1, 16, [bytes(2)], masks=(0xF00, 0xF0, 0xF))))
+    # more palette entries than the depth can index
+    data = bytearray(_encode(1, 8, [bytes(1)], bytes(4 * 257)))
+    data[46:50] = (257).to_bytes(4, "little")
+    with pytest.raises(ValueError):
+        bmp.BMP(io.BytesIO(bytes(data)))
+    data = bytearray(_encode(1, 8, [bytes(1)], bytes(1024)))
+    data[30] = 1  # RLE8
+    with pytest.raises(ValueError):
+        bmp.BMP(io.BytesIO(bytes(data)))
@@ -0,0 +1,31 @@
+import pytest
+
+import dither
+
+INKS = ((0, 0, 0), (255, 255, 255), (0, 255, 0), (0, 0, 255), (255, 0, 0), (255, 255, 0))
+
+
+def test_color_nearest():
+    d = dither.ColorDither(dither.NONE, 4, INKS)
+    out = bytearray(4)
+    d.row(0, bytes((10, 10, 10, 250, 250, 245, 20, 230, 0, 240, 10, 30)), out)
+    assert list(out) == [0, 1, 2, 4]
+
+
+def test_color_palette_size():
+    dither.ColorDither(dither.NONE, 4, INKS + ((255, 128, 0),))
+    with pytest.raises(ValueError):
+        dither.ColorDither(dither.NONE, 4, INKS + ((255, 128, 0), (128, 128, 128)))
+
+
+def test_free_luts():
+    d = dither.ColorDither(dither.NONE, 2, INKS)
+    assert dither._luts
+    dither.freeLuts()
+    assert not dither._luts
+    # the existing instance keeps working, a new one builds its table again
+    out = bytearray(2)
+    d.row(0, bytes((0, 0, 255, 255, 255, 0)), out)
+    assert list(out) == [3, 5]
+    dither.ColorDither(dither.NONE, 2, INKS)
+    assert len(dither._luts) == 1
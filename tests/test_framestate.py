@@ -0,0 +1,92 @@
+import os
+import random
+
+import framestate
+import rle
+
+ROW = 100
+ROWS = 30
+
+
+def _frame(seed=1):
+    rnd = random.Random(seed)
+    fb = bytearray(ROW * ROWS)
+    for i in range(0, len(fb), 7):
+        n = rnd.randrange(1, 5)
+        fb[i : i + n] = bytes([rnd.randrange(256)]) * n
+    return fb
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "state")
+    fb = _frame()
+    framestate.save(path, (1, -2, 3), b"extra", fb, ROW)
+    info, extra = framestate.header(path)
+    assert list(info) == [1, -2, 3] and extra == b"extra"
+    out = bytearray(len(fb))
+    assert framestate.load(path, out, ROW)
+    assert out == fb
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_precoded(tmp_path):
+    # a frame already coded by compress_rows is written as is, and reads back the same
+    path = str(tmp_path / "state")
+    fb = _frame(2)
+    out, offsets = rle.compress_rows(fb, ROW, bytearray(4 * len(fb)))
+    framestate.save(path, (), b"", fb, ROW, out, offsets)
+    plain = str(tmp_path / "plain")
+    framestate.save(plain, (), b"", fb, ROW)
+    with open(path, "rb") as a, open(plain, "rb") as b:
+        assert a.read() == b.read()
+    got = bytearray(len(fb))
+    assert framestate.load(path, got, ROW) and got == fb
+
+
+def test_overwrite(tmp_path):
+    path = str(tmp_path / "state")
+    framestate.save(path, (1,), b"", _frame(1), ROW)
+    framestate.save(path, (2,), b"", _frame(3), ROW)
+    out = bytearray(ROW * ROWS)
+    assert list(framestate.header(path)[0]) == [2]
+    assert framestate.load(path, out, ROW) and out == _frame(3)
+
+
+def test_mismatch(tmp_path):
+    path = str(tmp_path / "state")
+    framestate.save(path, (), b"", _frame(), ROW)
+    assert not framestate.load(path, bytearray(ROW * ROWS), ROW // 2)
+    assert not framestate.load(path, bytearray(ROW * (ROWS - 1)), ROW)
+    assert framestate.header(str(tmp_path / "missing")) is None
+    assert not framestate.load(str(tmp_path / "missing"), bytearray(ROW * ROWS), ROW)
+    other = tmp_path / "other"
+    other.write_bytes(b"not a saved frame at all")
+    assert framestate.header(str(other)) is None
+
+
+def test_truncated(tmp_path):
+    path = str(tmp_path / "state")
+    framestate.save(path, (7, 8), b"ghost", _frame(), ROW)
+    with open(path, "rb") as f:
+        data = f.read()
+    cut = str(tmp_path / "cut")
+    out = bytearray(ROW * ROWS)
+    for n in range(0, len(data), 13):
+        with open(cut, "wb") as f:
+            f.write(data[:n])
+        assert not framestate.load(cut, out, ROW), n
+    # the header alone is enough for header(), not for load()
+    with open(cut, "wb") as f:
+        f.write(data[: 4 * 5 + 4 * 2 + 5])
+    assert framestate.header(cut) == (framestate.header(path)[0], b"ghost")
+    assert not framestate.load(cut, out, ROW)
+
+
+def test_corrupt(tmp_path):
+    path = str(tmp_path / "state")
+    framestate.save(path, (), b"", bytes(ROW * ROWS), ROW)
+    with open(path, "r+b") as f:
+        # the first row claims to be longer than any coded row can be
+        f.seek(4 * 5 + 4)
+        f.write((rle.bound(ROW) + 1).to_bytes(4, "little"))
+    assert not framestate.load(path, bytearray(ROW * ROWS), ROW)
@@ -0,0 +1,66 @@
+import i2cbus
+
+
+class _I2C:
+    def __init__(self):
+        self.mem = {}
+        self.sent = []
+
+    def writeto(self, addr, buf, stop=True):
+        self.sent.append((addr, bytes(buf)))
+        return 1
+
+    def writeto_mem(self, addr, reg, buf):
+        self.mem[addr, reg] = bytes(buf)
+
+    def readfrom_mem_into(self, addr, reg, buf):
+        buf[:] = self.mem.get((addr, reg), bytes(len(buf)))
+
+
+def test_bytes_and_stats():
+    i2c = _I2C()
+    bus = i2cbus.I2CBus(i2c)
+    bus.write8(0x20, 7)
+    bus.writeReg8(0x48, 0x0D, 0x80)
+    assert bus.readReg8(0x48, 0x0D) == 0x80
+    assert i2c.sent == [(0x20, b"\x07")]
+    assert bus.stats() == {0x20: (1, 1), 0x48: (2, 4)}
+    bus.resetStats()
+    assert bus.stats() == {}
+
+
+def test_defer():
+    bus = i2cbus.I2CBus(_I2C(), queue=2)
+    ran = []
+    assert bus.defer(ran.append, "now")
+    assert ran == ["now"]
+    bus.acquire(i2cbus.DISPLAY)
+    assert bus.busy() and bus.busy(i2cbus.DISPLAY)
+
+    def low(a):
+        ran.append(("low", a))
+
+    assert bus.defer(low, 1, i2cbus.BACKGROUND)
+    assert bus.defer(ran.append, "input")
+    # a job already waiting is not queued twice, a full queue refuses new ones
+    assert bus.defer(low, 2, i2cbus.BACKGROUND)
+    assert not bus.defer(ran.append, "late", i2cbus.DISPLAY)
+    assert ran == ["now"]
+    bus.release()
+    assert not bus.busy(i2cbus.BACKGROUND)
+    assert ran == ["now", "input", ("low", 1)]
+
+
+def test_nested():
+    bus = i2cbus.I2CBus(_I2C())
+    ran = []
+    bus.acquire(i2cbus.INPUT)
+    bus.acquire(i2cbus.DISPLAY)
+    bus.defer(ran.append, 1)
+    bus.release()
+    assert ran == [] and bus.busy()
+    bus.release()
+    assert ran == [1]
+    # an unbalanced release is harmless
+    bus.release()
+    assert not bus.busy(i2cbus.BACKGROUND)
@@ -0,0 +1,151 @@
+import io
+import struct
+
+import pytest
+
+import jpeg
+
+# the standard luminance DC table, and an AC table holding only the end-of-block code
+_DC_BITS = (0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0)
+_AC_BITS = (1,) + (0,) * 15
+
+
+def _dc_codes():
+    codes = {}
+    code = k = 0
+    for length, count in enumerate(_DC_BITS, 1):
+        for _ in range(count):
+            codes[k] = (code, length)
+            code += 1
+            k += 1
+        code <<= 1
+    return codes
+
+
+class _Bits:
+    def __init__(self):
+        self.out = bytearray()
+        self._acc = self._n = 0
+
+    def put(self, v, length):
+        for i in range(length - 1, -1, -1):
+            self._acc = (self._acc << 1) | ((v >> i) & 1)
+            self._n += 1
+            if self._n == 8:
+                self.out.append(self._acc)
+                if self._acc == 0xFF:
+                    self.out.append(0)
+                self._acc = self._n = 0
+
+    def flush(self):
+        while self._n:
+            self.put(1, 1)
+
+
+# _encode builds a baseline JPEG whose 8 x 8 blocks are flat: blocks[c][by][bx] is the value of
+# every pixel of block (bx, by) of component c. Every block is coded as its DC coefficient only,
+# with all quantizers 1, so the decoder has to reproduce the values exactly.
+def _encode(w, h, blocks, restart=0):
+    n = len(blocks)
+    out = bytearray(b"\xff\xd8")
+    out += b"\xff\xfe" + struct.pack(">H", 6) + b"test"
+    out += b"\xff\xdb" + struct.pack(">HB", 67, 0) + bytes([1] * 64)
+    out += b"\xff\xc0" + struct.pack(">HBHHB", 8 + 3 * n, 8, h, w, n)
+    for c in range(n):
+        out += bytes((c + 1, 0x11, 0))
+    out += b"\xff\xc4" + struct.pack(">HB", 31, 0x00) + bytes(_DC_BITS) + bytes(range(12))
+    out += b"\xff\xc4" + struct.pack(">HB", 20, 0x10) + bytes(_AC_BITS) + b"\x00"
+    if restart:
+        out += b"\xff\xdd" + struct.pack(">HH", 4, restart)
+    out += b"\xff\xda" + struct.pack(">HB", 6 + 2 * n, n)
+    for c in range(n):
+        out += bytes((c + 1, 0x00))
+    out += bytes((0, 63, 0))
+    dc = _dc_codes()
+    bits = _Bits()
+    pred = [0] * n
+    mcu = 0
+    for by in range(len(blocks[0])):
+        for bx in range(len(blocks[0][0])):
+            if restart and mcu and mcu % restart == 0:
+                bits.flush()
+                bits.out += bytes((0xFF, 0xD0 + (mcu // restart - 1) % 8))
+                pred = [0] * n
+            mcu += 1
+            for c in range(n):
+                v = 8 * (blocks[c][by][bx] - 128)
+                d = v - pred[c]
+                pred[c] = v
+                size = abs(d).bit_length()
+                bits.put(*dc[size])
+                if size:
+                    bits.put(d if d > 0 else d + (1 << size) - 1, size)
+                bits.put(0, 1)  # end of block
+    bits.flush()
+    return bytes(out + bits.out) + b"\xff\xd9"
+
+
+W, H = 20, 12
+GREY = [[0, 40, 255], [128, 200, 7]]
+
+
+def _grey(x, y):
+    return GREY[y // 8][x // 8]
+
+
+@pytest.mark.parametrize("restart", (0, 1, 2))
+def test_grey(restart):
+    j = jpeg.JPEG(io.BytesIO(_encode(W, H, [GREY], restart)))
+    assert (j.width, j.height) == (W, H)
+    got = [(y, bytes(row)) for y, row in j.rows()]
+    assert got == [(y, bytes(_grey(x, y) for x in range(W))) for y in range(H)]
+
+
+def test_grey_rgb():
+    j = jpeg.JPEG(io.BytesIO(_encode(W, H, [GREY])))
+    for y, row in j.rows(rgb=True):
+        assert bytes(row) == bytes(_grey(x, y) for x in range(W) for _ in range(3))
+
+
+def test_scale():
+    # an 8x downscale uses the DC coefficients only: one pixel per block
+    j = jpeg.JPEG(io.BytesIO(_encode(W, H, [GREY])))
+    j.setScale(8)
+    assert (j.width, j.height) == (3, 2)
+    assert [bytes(row) for _, row in j.rows()] == [bytes(r) for r in GREY]
+    j = jpeg.JPEG(io.BytesIO(_encode(W, H, [GREY])))
+    j.setScale(2)
+    assert (j.width, j.height) == (10, 6)
+    for y, row in j.rows():
+        assert bytes(row) == bytes(_grey(2 * x, 2 * y) for x in range(10))
+
+
+def test_window():
+    j = jpeg.JPEG(io.BytesIO(_encode(W, H, [GREY])))
+    got = [(y, bytes(row)) for y, row in j.rows(x0=5, y0=6, x1=18, y1=10)]
+    assert got == [(y, bytes(_grey(x, y) for x in range(5, 18))) for y in range(6, 10)]
+
+
+def test_color():
+    # neutral chroma in the first block row, red and blue in the second
+    y = [[60, 200], [76, 29]]
+    cb = [[128, 128], [85, 255]]
+    cr = [[128, 128], [255, 107]]
+    j = jpeg.JPEG(io.BytesIO(_encode(16, 16, [y, cb, cr])))
+    rows = {r: bytes(row) for r, row in j.rows(rgb=True)}
+    assert rows[0][:3] == bytes((60,) * 3) and rows[0][-3:] == bytes((200,) * 3)
+    for got, exp in ((rows[15][:3], (255, 0, 0)), (rows[15][-3:], (0, 0, 255))):
+        assert all(abs(a - b) <= 2 for a, b in zip(got, exp)), (got, exp)
+    j = jpeg.JPEG(io.BytesIO(_encode(16, 16, [y, cb, cr])))
+    assert [row[0] for _, row in j.rows()] == [60] * 8 + [76] * 8
+
+
+def test_bad_files():
+    with pytest.raises(ValueError):
+        jpeg.JPEG(io.BytesIO(b"\x89PNG\r\n\x1a\n"))
+    data = _encode(W, H, [GREY])
+    with pytest.raises(ValueError):
+        jpeg.JPEG(io.BytesIO(data[: data.index(b"\xff\xc4")]))
+    # progressive
+    with pytest.raises(ValueError):
+        jpeg.JPEG(io.BytesIO(data.replace(b"\xff\xc0", b"\xff\xc2")))
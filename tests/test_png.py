@@ -0,0 +1,164 @@
+import io
+import random
+import struct
+import zlib
+
+import pytest
+
+import png
+
+W, H = 13, 7
+
+
+def _chunk(kind, data):
+    crc = zlib.crc32(kind + data)
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+# _encode builds a PNG from raw scanlines, each row with a random filter so all of them are
+# exercised, and the image data split over several IDAT chunks
+def _encode(ctype, depth, rows, plte=None, trns=None, seed=0):
+    rnd = random.Random(seed)
+    bpp = max(1, {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[ctype] * depth // 8)
+    raw = b""
+    prev = bytes(len(rows[0]))
+    for r in rows:
+        f = rnd.randrange(5)
+        line = bytearray([f])
+        for i, x in enumerate(r):
+            a = r[i - bpp] if i >= bpp else 0
+            b = prev[i]
+            c = prev[i - bpp] if i >= bpp else 0
+            pred = (0, a, b, (a + b) // 2, _paeth(a, b, c))[f]
+            line.append((x - pred) & 0xFF)
+        raw += line
+        prev = r
+    z = zlib.compress(raw)
+    data = png.SIGNATURE + _chunk(b"IHDR", struct.pack(">IIBBBBB", W, H, depth, ctype, 0, 0, 0))
+    if plte:
+        data += _chunk(b"PLTE", plte)
+    if trns:
+        data += _chunk(b"tRNS", trns)
+    data += _chunk(b"tEXt", b"Comment\x00test")
+    for i in range(0, len(z), 37):
+        data += _chunk(b"IDAT", z[i : i + 37])
+    return data + _chunk(b"IEND", b"")
+
+
+def _pack(values, depth):
+    out = bytearray()
+    bits = n = 0
+    for v in values:
+        bits = (bits << depth) | v
+        n += depth
+        if n == 8:
+            out.append(bits)
+            bits = n = 0
+    if n:
+        out.append(bits << (8 - n))
+    return bytes(out)
+
+
+def _luma(r, g, b):
+    return (54 * r + 183 * g + 19 * b) >> 8
+
+
+# a 3 x 2 RGB image, the first row unfiltered (red, green, blue) and the second with the Up
+# filter (red, green, then blue + 255 wrapping around)
+GOLDEN = bytes.fromhex(
+    "89504e470d0a1a0a0000000d49484452000000030000000208020000001216f14d00000015494441"
+    "5478da63f8cfc0c000c64c0c60f0ffff7f0032f505fd62fc628e0000000049454e44ae426082"
+)
+
+
+def test_golden():
+    p = png.PNG(io.BytesIO(GOLDEN))
+    got = [(y, bytes(row)) for y, row in p.rows(rgb=True)]
+    assert got == [
+        (0, bytes((255, 0, 0, 0, 255, 0, 0, 0, 255))),
+        (1, bytes((255, 0, 0, 0, 255, 0, 255, 255, 254))),
+    ]
+    p = png.PNG(io.BytesIO(GOLDEN))
+    assert [bytes(row) for _, row in p.rows()] == [bytes((53, 182, 18)), bytes((53, 182, 254))]
+
+
+def test_rgb8():
+    rnd = random.Random(1)
+    rows = [bytes(rnd.randrange(256) for _ in range(3 * W)) for _ in range(H)]
+    data = _encode(2, 8, rows)
+    p = png.PNG(io.BytesIO(data))
+    assert (p.width, p.height) == (W, H)
+    for y, row in p.rows(rgb=True):
+        assert bytes(row) == rows[y]
+    p = png.PNG(io.BytesIO(data))
+    for y, row in p.rows():
+        r = rows[y]
+        assert bytes(row) == bytes(_luma(*r[3 * i : 3 * i + 3]) for i in range(W))
+
+
+@pytest.mark.parametrize("depth", (1, 2, 4, 8))
+def test_grey(depth):
+    rnd = random.Random(depth)
+    top = (1 << depth) - 1
+    values = [[rnd.randrange(top + 1) for _ in range(W)] for _ in range(H)]
+    p = png.PNG(io.BytesIO(_encode(0, depth, [_pack(v, depth) for v in values])))
+    got = [list(row) for _, row in p.rows()]
+    assert got == [[v * 255 // top for v in vs] for vs in values]
+
+
+def test_palette_trns():
+    rnd = random.Random(3)
+    plte = bytes(rnd.randrange(256) for _ in range(16 * 3))
+    trns = bytes((0, 128, 255))
+    values = [[rnd.randrange(16) for _ in range(W)] for _ in range(H)]
+    p = png.PNG(io.BytesIO(_encode(3, 4, [_pack(v, 4) for v in values], plte, trns)))
+    for y, row in p.rows(rgb=True):
+        for x, v in enumerate(values[y]):
+            exp = plte[3 * v : 3 * v + 3]
+            if v < len(trns):
+                exp = [png._over_white(c, trns[v]) for c in exp]
+            assert list(row[3 * x : 3 * x + 3]) == list(exp)
+    # fully transparent is white, fully opaque is unchanged
+    assert png._over_white(0, 0) == 255 and png._over_white(77, 255) == 77
+
+
+def test_rgba16():
+    rnd = random.Random(4)
+    rows = [bytes(rnd.randrange(256) for _ in range(8 * W)) for _ in range(H)]
+    p = png.PNG(io.BytesIO(_encode(6, 16, rows)))
+    for y, row in p.rows(rgb=True):
+        r = rows[y]
+        for x in range(W):
+            a = r[8 * x + 6]
+            for c in range(3):
+                assert row[3 * x + c] == round((r[8 * x + 2 * c] * a + 255 * (255 - a)) / 255)
+
+
+def test_window():
+    rnd = random.Random(5)
+    rows = [bytes(rnd.randrange(256) for _ in range(W)) for _ in range(H)]
+    p = png.PNG(io.BytesIO(_encode(0, 8, rows)))
+    got = [(y, bytes(row)) for y, row in p.rows(x0=3, y0=2, x1=9, y1=5)]
+    assert got == [(y, rows[y][3:9]) for y in range(2, 5)]
+
+
+def test_bad_files():
+    with pytest.raises(ValueError):
+        png.PNG(io.BytesIO(b"GIF89a" + bytes(20)))
+    data = _encode(0, 8, [bytes(W)] * H)
+    with pytest.raises(ValueError):
+        png.PNG(io.BytesIO(data[:40]))
+    # cut inside the image data
+    cut = data[: data.index(b"IDAT") + 20]
+    p = png.PNG(io.BytesIO(cut))
+    with pytest.raises(ValueError):
+        for _ in p.rows():
+            pass
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+import rle
+
+
+def _samples():
+    rnd = random.Random(1)
+    yield b""
+    yield b"\x00"
+    yield bytes(60000)
+    yield bytes(range(256)) * 3
+    for n in (1, 2, 3, 127, 128, 129, 130, 257, 1000):
+        yield bytes(rnd.randrange(256) for _ in range(n))
+        yield bytes(rnd.choice((0, 0, 0, 255, 7)) for _ in range(n))
+        runs = bytearray()
+        while len(runs) < n:
+            runs += bytes([rnd.randrange(4)]) * rnd.randrange(1, 400)
+        yield bytes(runs[:n])
+
+
+@pytest.mark.parametrize("data", list(_samples()))
+def test_round_trip(data):
+    coded = rle.compress(data)
+    assert len(coded) <= rle.bound(len(data))
+    out = bytearray(len(data))
+    assert rle.decompress(coded, out)
+    assert out == data
+
+
+def test_golden():
+    # a run of 4, 3 literals, then a run of the longest length
+    data = b"\xff" * 4 + b"\x01\x02\x03" + b"\x00" * 129
+    coded = rle.compress(data)
+    assert coded == b"\x82\xff\x02\x01\x02\x03\xff\x00"
+    # short repeats stay literals
+    assert rle.compress(b"\x05\x05\x06") == b"\x02\x05\x05\x06"
+
+
+def test_truncated():
+    data = b"\xaa" * 10 + bytes(range(40)) + b"\x55" * 10
+    coded = rle.compress(data)
+    out = bytearray(len(data))
+    for n in range(len(coded)):
+        assert not rle.decompress(coded[:n], out)
+    # a literal or a run cut short
+    assert not rle.decompress(b"\x05\x01\x02", bytearray(6))
+    assert not rle.decompress(b"\x85", bytearray(7))
+
+
+def test_wrong_size():
+    coded = rle.compress(bytes(100))
+    assert not rle.decompress(coded, bytearray(99))
+    assert not rle.decompress(coded, bytearray(101))
+
+
+def test_compress_rows():
+    rnd = random.Random(2)
+    rowLen = 50
+    data = bytearray(rnd.choice(b"\x00\x00\xff\x12") for _ in range(rowLen * 7 + 13))
+    out, offsets = rle.compress_rows(data, rowLen)
+    rows = (len(data) + rowLen - 1) // rowLen
+    assert len(offsets) == rows + 1 and offsets[0] == 0
+    for i in range(rows):
+        row = data[i * rowLen : (i + 1) * rowLen]
+        got = bytearray(len(row))
+        rle.decompress_row(out, offsets, i, got)
+        assert got == row
+        assert out[offsets[i] : offsets[i + 1]] == rle.compress(row)
+    # reusing the buffers of a larger frame must not allocate new ones
+    again, offs = rle.compress_rows(data[: rowLen * 3], rowLen, out, offsets)
+    assert again is out and offs is offsets
+    coded = [rle.compress(data[i * rowLen : (i + 1) * rowLen]) for i in range(3)]
+    assert offs[3] == sum(len(c) for c in coded)
+
+
+def test_compress_rows_grows():
+    out, offsets = rle.compress_rows(bytes(range(256)) * 4, 256, bytearray(3))
+    assert len(out) >= offsets[4] == 4 * rle.bound(256)
@@ -0,0 +1,171 @@
+# TextReader shows a long text file one screen page at a time. The first time a book is opened
+# the file is streamed through the same line breaking that draws the text, and the byte offset
+# at which every page starts is written to a sidecar index next to it (path + ".idx"), with
+# the file's size and modification time and the layout settings. It is written to a temporary
+# file first, so an index cut short by a reset or an SD card error is never used. Later opens
+# check it and jump straight to any page: two offsets are read from the index, then only that
+# page's bytes from the book. Nothing but the current page is ever held in memory.
+# Text is treated as ASCII, other bytes are drawn as "?".
+import os
+from uarray import array
+
+_MAGIC = 0x31495854  # "TXI1"
+_CHUNK = 1024  # bytes read at a time while indexing
+
+# Layout of the index header, followed by the page offsets (page count + 1 entries, the last
+# one being the file size)
+_H_MAGIC = 0
+_H_SIZE = 1
+_H_MTIME = 2
+_H_LAYOUT = 3  # checksum of the layout settings and font
+_H_PAGES = 4
+_HEADER = 5
+
+
+# _breakLine finds the end of the line starting at buf[i], given per-byte advances and the
+# width available. It returns (end, next): the line is buf[i:end] and the next one starts at
+# next. If the line could continue past n and the data is not final, end is -1.
+def _breakLine(buf, i, n, adv, width, final):
+    x = 0
+    space = -1
+    j = i
+    while j < n:
+        c = buf[j]
+        if c == 10:
+            return j, j + 1
+        x += adv[c]
+        if x > width:
+            if space > i:
+                return space, space + 1
+            # a single word wider than the line is broken anywhere
+            return max(j, i + 1), max(j, i + 1)
+        if c == 32:
+            space = j
+        j += 1
+    if final:
+        return n, n
+    return -1, -1
+
+
+class TextReader:
+    # display is an Inkplate; text is drawn with textSize size in the box (x, y, w, h), which
+    # defaults to the rest of the screen, with spacing pixels between lines
+    def __init__(self, display, path, x=0, y=0, w=None, h=None, size=1, spacing=2):
+        self._display = display
+        self.path = path
+        self._x = x
+        self._y = y
+        self._w = w if w is not None else display.width() - x
+        self._h = h if h is not None else display.height() - y
+        self._size = size
+        font = display.GFX.font
+        self._lineHeight = size * font["a"][1] + spacing
+        self._rows = max(1, self._h // self._lineHeight)
+        # advance of every byte value, as in GFX._very_slow_text
+        adv = bytearray(256)
+        for c in range(256):
+            ch = chr(c) if 32 <= c < 127 else "?"
+            adv[c] = size * (font[ch][0] + 1) if ch in font else 0
+        adv[13] = 0
+        self._adv = adv
+        self._layout = (self._w * 31 + self._h * 7 + size * 3 + spacing + sum(adv)) & 0x7FFFFFFF
+        self._index = path + ".idx"
+        self._open()
+
+    # _open checks the index against the book and rebuilds it if it is missing or stale
+    def _open(self):
+        st = os.stat(self.path)
+        try:
+            with open(self._index, "rb") as f:
+                hdr = array("I", f.read(4 * _HEADER))
+            if (
+                len(hdr) == _HEADER
+                and hdr[_H_MAGIC] == _MAGIC
+                and hdr[_H_SIZE] == st[6]
+                and hdr[_H_MTIME] == st[8]
+                and hdr[_H_LAYOUT] == self._layout
+                and os.stat(self._index)[6] >= 4 * (_HEADER + hdr[_H_PAGES] + 1)
+            ):
+                self.pageCount = hdr[_H_PAGES]
+                return
+        except OSError:
+            pass
+        self._build(st[6], st[8])
+
+    # _build streams the book through the line breaking and writes the index
+    def _build(self, size, mtime):
+        adv = self._adv
+        width = self._w
+        rows = self._rows
+        hdr = array("I", (_MAGIC, size, mtime, self._layout, 0))
+        pages = 0
+        tmp = self._index + ".tmp"
+        with open(self.path, "rb") as book, open(tmp, "wb") as idx:
+            idx.write(hdr)
+            buf = b""
+            base = 0  # file offset of buf[0]
+            i = 0
+            line = 0
+            marked = -1  # line at which the last page offset was written
+            final = False
+            while True:
+                end = -1
+                if i < len(buf):
+                    if line % rows == 0 and marked != line:
+                        idx.write(array("I", (base + i,)))
+                        marked = line
+                        pages += 1
+                    end, nxt = _breakLine(buf, i, len(buf), adv, width, final)
+                elif final:
+                    break
+                if end < 0:
+                    # the line continues past what has been read, fetch more of the book
+                    data = book.read(_CHUNK)
+                    final = not data
+                    base += i
+                    buf = buf[i:] + data
+                    i = 0
+                    continue
+                i = nxt
+                line += 1
+            idx.write(array("I", (size,)))
+            hdr[_H_PAGES] = pages
+            idx.seek(0)
+            idx.write(hdr)
+        try:
+            os.remove(self._index)
+        except OSError:
+            pass
+        os.rename(tmp, self._index)
+        self.pageCount = pages
+
+    # pageRange returns the byte offsets in the book where page n starts and ends
+    def pageRange(self, n):
+        with open(self._index, "rb") as f:
+            f.seek(4 * (_HEADER + n))
+            r = array("I", f.read(8))
+        return r[0], r[1]
+
+    # showPage draws page n (counting from 0) into the framebuffer, clearing the text box
+    # first. It returns False if there is no such page. The caller refreshes the screen.
+    def showPage(self, n):
+        if n < 0 or n >= self.pageCount:
+            return False
+        start, end = self.pageRange(n)
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            buf = f.read(end - start)
+        d = self._display
+        d.fillRect(self._x, self._y, self._w, self._h, d.WHITE)
+        d.setTextSize(self._size)
+        i = 0
+        y = self._y
+        for _ in range(self._rows):
+            if i >= len(buf):
+                break
+            start = i
+            end, i = _breakLine(buf, i, len(buf), self._adv, self._w, True)
+            text = "".join(chr(c) if 32 <= c < 127 else "?" for c in buf[start:end] if c != 13)
+            d.printText(self._x, y, text)
+            y += self._lineHeight
+        return True
@@ -0,0 +1,147 @@
+# Touchpads turns the touchpads on the MCP23017 into press, release and long press events. The
+# MCP23017 is set up to signal pad changes on its INTB output, which raises an interrupt on the
+# ESP32, so the pads are only read over I2C when something happened: the interrupt just flags
+# that the pads need to be read, the read itself (INTF, INTCAP and GPIO in one transaction) and
+# the debouncing happen in get() or event(), outside of interrupt context. Both sleep until the
+# interrupt or a debounce deadline, nothing is polled.
+import time
+from machine import Pin
+from micropython import const
+
+PRESS = const(0)
+RELEASE = const(1)
+LONG_PRESS = const(2)
+
+
+def _asyncio():
+    try:
+        import asyncio
+    except ImportError:
+        import uasyncio as asyncio
+    return asyncio
+
+
+class Touchpads:
+    # mcp is the MCP23017 the pads are on, pins their pin numbers on it (pad 1 first) and intPin
+    # the ESP32 pin wired to its INTB output. A pad has to keep a new state for debounce ms to
+    # count, and be held for longPress ms for a LONG_PRESS event. At most size events are
+    # queued, older ones are dropped.
+    def __init__(self, mcp, pins=(10, 11, 12), intPin=34, debounce=30, longPress=800, size=8):
+        self._mcp = mcp
+        self._pins = pins
+        self._debounce = debounce
+        self._longPress = longPress
+        self._size = size
+        self._events = []
+        n = len(pins)
+        self._raw = bytearray(n)  # last level read
+        self._rawAt = [0] * n  # when the level last changed
+        self._state = bytearray(n)  # debounced level
+        self._pressAt = [0] * n
+        self._long = bytearray(n)  # whether LONG_PRESS was sent for the current press
+        self._flag = None  # asyncio.ThreadSafeFlag once event() is used
+        mask = 0
+        for p in pins:
+            mask |= 1 << p
+        mcp.interrupts(mask)
+        self._pending = True  # read the pads once, which also clears a stale interrupt
+        self._int = Pin(intPin, Pin.IN)
+        self._int.irq(trigger=Pin.IRQ_RISING, handler=self._irq)
+
+    def _irq(self, pin):
+        self._pending = True
+        if self._flag is not None:
+            self._flag.set()
+
+    # _levels records the pad levels found in a 16-bit port value
+    def _levels(self, bits, now):
+        raw = self._raw
+        for i, p in enumerate(self._pins):
+            v = (bits >> p) & 1
+            if v != raw[i]:
+                raw[i] = v
+                self._rawAt[i] = now
+
+    def _push(self, pad, kind):
+        if len(self._events) >= self._size:
+            self._events.pop(0)
+        self._events.append((pad, kind))
+
+    # _service reads the pads if an interrupt came in, turns settled changes into events and
+    # returns the ticks_ms time at which it has to run again, or None if nothing is pending
+    def _service(self):
+        now = time.ticks_ms()
+        if self._pending:
+            self._pending = False
+            intf, intcap, gpio = self._mcp.capture()
+            # the level at the interrupt, then the current one, so a change that came after
+            # the capture isn't missed
+            self._levels(intcap, now)
+            self._levels(gpio, now)
+        raw = self._raw
+        state = self._state
+        wake = None
+        for i in range(len(raw)):
+            if raw[i] != state[i]:
+                at = time.ticks_add(self._rawAt[i], self._debounce)
+                if time.ticks_diff(now, at) < 0:
+                    wake = at if wake is None or time.ticks_diff(at, wake) < 0 else wake
+                    continue
+                state[i] = raw[i]
+                if raw[i]:
+                    self._pressAt[i] = now
+                    self._long[i] = 0
+                self._push(i + 1, PRESS if raw[i] else RELEASE)
+            if state[i] and not self._long[i]:
+                at = time.ticks_add(self._pressAt[i], self._longPress)
+                if time.ticks_diff(now, at) < 0:
+                    wake = at if wake is None or time.ticks_diff(at, wake) < 0 else wake
+                else:
+                    self._long[i] = 1
+                    self._push(i + 1, LONG_PRESS)
+        return wake
+
+    # pressed returns whether pad (1 for the first one) is pressed, after debouncing
+    def pressed(self, pad):
+        self._service()
+        return bool(self._state[pad - 1])
+
+    # get returns the next event as (pad, kind), kind being PRESS, RELEASE or LONG_PRESS. It
+    # waits for up to timeout ms (forever if None) and returns None if no event came. The wait
+    # runs event() on the asyncio scheduler, which sleeps until the pad interrupt or the next
+    # debounce or long press deadline instead of waking up to check. From an asyncio task,
+    # await event() instead.
+    def get(self, timeout=None):
+        self._service()
+        if self._events:
+            return self._events.pop(0)
+        if timeout is not None and timeout <= 0:
+            return None
+        asyncio = _asyncio()
+        if timeout is None:
+            return asyncio.run(self.event())
+        try:
+            return asyncio.run(asyncio.wait_for_ms(self.event(), timeout))
+        except asyncio.TimeoutError:
+            return None
+
+    # event waits for the next event like get() without blocking other asyncio tasks
+    async def event(self):
+        asyncio = _asyncio()
+        if self._flag is None:
+            self._flag = asyncio.ThreadSafeFlag()
+        while True:
+            wake = self._service()
+            if self._events:
+                return self._events.pop(0)
+            if self._pending:
+                continue
+            if wake is None:
+                await self._flag.wait()
+            else:
+                try:
+                    await asyncio.wait_for_ms(
+                        self._flag.wait(), max(0, time.ticks_diff(wake, time.ticks_ms()))
+                    )
+                except asyncio.TimeoutError:
+                    pass
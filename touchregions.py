@@ -0,0 +1,62 @@
+# TouchRegions finds which of many named rectangles a touch falls in without testing all of
+# them: the screen is divided into a coarse grid and every cell lists the regions overlapping
+# it, topmost first, so a lookup only looks at the few regions of one cell. Rectangles are in
+# physical panel coordinates so they stay put when the rotation changes.
+
+
+class TouchRegions:
+    # cols and rows are the size of the panel, cell the size of a grid cell in pixels
+    def __init__(self, cols, rows, cell=64):
+        self._cell = cell
+        self._gw = (cols + cell - 1) // cell
+        self._gh = (rows + cell - 1) // cell
+        self._grid = [[] for _ in range(self._gw * self._gh)]
+        self._regions = {}  # name -> (z, seq, name, x, y, w, h, handler)
+        self._seq = 0
+
+    # _cells returns the indices of the grid cells a rectangle overlaps
+    def _cells(self, x, y, w, h):
+        c = self._cell
+        gx0 = max(0, x // c)
+        gy0 = max(0, y // c)
+        gx1 = min(self._gw - 1, (x + w - 1) // c)
+        gy1 = min(self._gh - 1, (y + h - 1) // c)
+        return [gy * self._gw + gx for gy in range(gy0, gy1 + 1) for gx in range(gx0, gx1 + 1)]
+
+    # add registers the rectangle (x, y, w, h) as name with a handler, replacing a region of
+    # the same name. Where regions overlap the one with the highest z wins, on equal z the one
+    # added last.
+    def add(self, name, x, y, w, h, handler, z=0):
+        self.remove(name)
+        self._seq += 1
+        r = (z, self._seq, name, x, y, w, h, handler)
+        self._regions[name] = r
+        for i in self._cells(x, y, w, h):
+            cell = self._grid[i]
+            k = 0
+            while k < len(cell) and (cell[k][0], cell[k][1]) > (z, self._seq):
+                k += 1
+            cell.insert(k, r)
+
+    def remove(self, name):
+        r = self._regions.pop(name, None)
+        if r is not None:
+            for i in self._cells(r[3], r[4], r[5], r[6]):
+                self._grid[i].remove(r)
+
+    def clear(self):
+        for cell in self._grid:
+            cell.clear()
+        self._regions.clear()
+
+    # find returns (name, handler) of the topmost region containing the point (x, y), or None
+    def find(self, x, y):
+        c = self._cell
+        gx = x // c
+        gy = y // c
+        if x < 0 or y < 0 or gx >= self._gw or gy >= self._gh:
+            return None
+        for r in self._grid[gy * self._gw + gx]:
+            if r[3] <= x < r[3] + r[5] and r[4] <= y < r[4] + r[6]:
+                return r[2], r[7]
+        return None
@@ -0,0 +1,183 @@
+# Touch events for the Inkplate 6PLUS touchscreen. The board driver reads the controller from
+# a callback scheduled by its interrupt and pushes every report, already mapped to screen
+# coordinates, into a TouchRing. Gestures turns the reports into taps, long presses, swipes and
+# two-finger touches for the application, which waits for them instead of polling the
+# controller over I2C.
+import time
+from uarray import array
+from micropython import const
+
+PRESS = const(0)  # first finger down, sent right away so the UI can react
+TAP = const(1)
+LONG_PRESS = const(2)
+SWIPE_LEFT = const(3)
+SWIPE_RIGHT = const(4)
+SWIPE_UP = const(5)
+SWIPE_DOWN = const(6)
+TWO_FINGER = const(7)  # touch with two fingers, at the point between them
+
+_REC = const(6)  # ints per report: fingers, x0, y0, x1, y1, ticks_ms
+
+
+def _asyncio():
+    try:
+        import asyncio
+    except ImportError:
+        import uasyncio as asyncio
+    return asyncio
+
+
+# TouchRing is a fixed size queue of touch reports in a preallocated array. push is meant to be
+# called from a scheduled callback and pop from the application; when the queue is full new
+# reports are dropped so that the two never touch the same index.
+class TouchRing:
+    def __init__(self, size=16):
+        self._buf = array("i", bytes(4 * _REC * size))
+        self._size = size
+        self._head = 0  # reports pushed
+        self._tail = 0  # reports popped
+        self.flag = None  # asyncio.ThreadSafeFlag set on push, if any
+
+    def __len__(self):
+        return self._head - self._tail
+
+    def push(self, fingers, x0, y0, x1, y1, t):
+        if self._head - self._tail >= self._size:
+            return
+        buf = self._buf
+        i = (self._head % self._size) * _REC
+        buf[i] = fingers
+        buf[i + 1] = x0
+        buf[i + 2] = y0
+        buf[i + 3] = x1
+        buf[i + 4] = y1
+        buf[i + 5] = t
+        self._head += 1
+        if self.flag is not None:
+            self.flag.set()
+
+    # pop copies the oldest report into out (6 ints) and returns False if there is none
+    def pop(self, out):
+        if self._head == self._tail:
+            return False
+        i = (self._tail % self._size) * _REC
+        for k in range(_REC):
+            out[k] = self._buf[i + k]
+        self._tail += 1
+        return True
+
+
+# Gestures recognizes gestures in the reports of a TouchRing. Events are (kind, x, y) tuples;
+# x, y is where the touch started, for TWO_FINGER the point between the fingers. A touch that
+# moves by at least swipe pixels is a swipe, one held for longPress ms without moving more than
+# tap pixels a long press, anything else a tap.
+class Gestures:
+    def __init__(self, ring, longPress=700, swipe=80, tap=20, size=8):
+        self._ring = ring
+        self._longPress = longPress
+        self._swipe = swipe
+        self._tap = tap
+        self._size = size
+        self._events = []
+        self._rec = array("i", bytes(4 * _REC))
+        self._down = False
+        self._t0 = 0
+        self._x0 = self._y0 = self._x = self._y = 0
+        self._mx = self._my = 0  # point between the fingers
+        self._fingers = 0  # most fingers seen during the touch
+        self._long = False  # whether LONG_PRESS was sent for the touch
+
+    def _push(self, kind, x, y):
+        if len(self._events) >= self._size:
+            self._events.pop(0)
+        self._events.append((kind, x, y))
+
+    def _report(self, r):
+        fingers = r[0]
+        if fingers:
+            if not self._down:
+                self._down = True
+                self._t0 = r[5]
+                self._x0 = r[1]
+                self._y0 = r[2]
+                self._fingers = 0
+                self._long = False
+                self._push(PRESS, r[1], r[2])
+            self._x = r[1]
+            self._y = r[2]
+            if fingers >= 2:
+                self._mx = (r[1] + r[3]) >> 1
+                self._my = (r[2] + r[4]) >> 1
+            self._fingers = max(self._fingers, fingers)
+            return
+        if not self._down:
+            return
+        self._down = False
+        dx = self._x - self._x0
+        dy = self._y - self._y0
+        if self._fingers >= 2:
+            self._push(TWO_FINGER, self._mx, self._my)
+        elif max(abs(dx), abs(dy)) >= self._swipe:
+            if abs(dx) >= abs(dy):
+                kind = SWIPE_RIGHT if dx > 0 else SWIPE_LEFT
+            else:
+                kind = SWIPE_DOWN if dy > 0 else SWIPE_UP
+            self._push(kind, self._x0, self._y0)
+        elif not self._long:
+            held = time.ticks_diff(r[5], self._t0) >= self._longPress
+            self._push(LONG_PRESS if held else TAP, self._x0, self._y0)
+
+    # _service processes the pending reports and returns the ticks_ms time at which a long
+    # press would be due, or None
+    def _service(self):
+        rec = self._rec
+        while self._ring.pop(rec):
+            self._report(rec)
+        if not self._down or self._long or self._fingers >= 2:
+            return None
+        if max(abs(self._x - self._x0), abs(self._y - self._y0)) > self._tap:
+            return None
+        due = time.ticks_add(self._t0, self._longPress)
+        if time.ticks_diff(time.ticks_ms(), due) < 0:
+            return due
+        self._long = True
+        self._push(LONG_PRESS, self._x0, self._y0)
+        return None
+
+    # get returns the next event, waiting for up to timeout ms (forever if None); it returns
+    # None if no event came. The wait runs event() on the asyncio scheduler, which sleeps until
+    # a report comes in or a long press is due. From an asyncio task, await event() instead.
+    def get(self, timeout=None):
+        self._service()
+        if self._events:
+            return self._events.pop(0)
+        if timeout is not None and timeout <= 0:
+            return None
+        asyncio = _asyncio()
+        if timeout is None:
+            return asyncio.run(self.event())
+        try:
+            return asyncio.run(asyncio.wait_for_ms(self.event(), timeout))
+        except asyncio.TimeoutError:
+            return None
+
+    # event waits for the next event like get() without blocking other asyncio tasks
+    async def event(self):
+        asyncio = _asyncio()
+        if self._ring.flag is None:
+            self._ring.flag = asyncio.ThreadSafeFlag()
+        while True:
+            due = self._service()
+            if self._events:
+                return self._events.pop(0)
+            if len(self._ring):
+                continue
+            if due is None:
+                await self._ring.flag.wait()
+            else:
+                try:
+                    await asyncio.wait_for_ms(
+                        self._ring.flag.wait(), max(0, time.ticks_diff(due, time.ticks_ms()))
+                    )
+                except asyncio.TimeoutError:
+                    pass
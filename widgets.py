@@ -0,0 +1,242 @@
+# Retained-mode widgets for the Inkplate wrappers. Widgets keep their state; changing it with
+# set() only marks the widget dirty. Screen.commit() then clears and redraws the dirty widgets
+# (and whatever other widgets overlap them) and refreshes just the rectangle around them, with a
+# partial update where the display supports it. Widgets are drawn in the order they were added.
+#
+#   screen = Screen(display)
+#   count = screen.add(Value(10, 10, 0, "Count: %d", size=2))
+#   ...
+#   count.set(value=n)
+#   screen.commit()
+
+
+# _textSize returns the width and height of string s drawn with GFX font at text size size
+def _textSize(font, s, size):
+    w = 0
+    for c in s:
+        if c in font:
+            w += size * (font[c][0] + 1)
+    return w, size * font["a"][1]
+
+
+def _overlap(a, b):
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+def _union(a, b):
+    x = min(a[0], b[0])
+    y = min(a[1], b[1])
+    return x, y, max(a[0] + a[2], b[0] + b[2]) - x, max(a[1] + a[3], b[1] + b[3]) - y
+
+
+class Widget:
+    def __init__(self, x, y, w, h):
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.visible = True
+        self._screen = None
+
+    def rect(self):
+        return self.x, self.y, self.w, self.h
+
+    def contains(self, x, y):
+        return self.x <= x < self.x + self.w and self.y <= y < self.y + self.h
+
+    # set changes properties, e.g. label.set(text="Hi"), and marks the widget dirty if any of
+    # them actually changed
+    def set(self, **props):
+        old = self.rect()
+        changed = False
+        for k, v in props.items():
+            if getattr(self, k) != v:
+                setattr(self, k, v)
+                changed = True
+        if changed and self._screen is not None:
+            self.layout(self._screen.display)
+            self._screen.invalidate(self, old)
+
+    # layout updates the size of the widget from its content, if it depends on it
+    def layout(self, d):
+        pass
+
+    # draw draws the widget on display d; its rectangle has been cleared to white
+    def draw(self, d):
+        pass
+
+    def _text(self, d, x, y, s, size, c):
+        d.GFX._very_slow_text(x, y, s, size, c)
+
+
+# Label is a line of text. Its size follows the text unless w and h are given.
+class Label(Widget):
+    def __init__(self, x, y, text="", size=1, w=None, h=None):
+        super().__init__(x, y, w or 0, h or 0)
+        self.text = text
+        self.size = size
+        self._auto = w is None, h is None
+
+    def _string(self):
+        return self.text
+
+    def layout(self, d):
+        tw, th = _textSize(d.GFX.font, self._string(), self.size)
+        if self._auto[0]:
+            self.w = tw
+        if self._auto[1]:
+            self.h = th
+
+    def draw(self, d):
+        self._text(d, self.x, self.y, self._string(), self.size, d.BLACK)
+
+
+# Value is a label showing value formatted with fmt
+class Value(Label):
+    def __init__(self, x, y, value=0, fmt="%s", size=1, w=None, h=None):
+        super().__init__(x, y, "", size, w, h)
+        self.value = value
+        self.fmt = fmt
+
+    def _string(self):
+        return self.fmt % self.value
+
+
+# Button is a framed text, drawn inverted while pressed
+class Button(Widget):
+    def __init__(self, x, y, w, h, text="", size=1, pressed=False):
+        super().__init__(x, y, w, h)
+        self.text = text
+        self.size = size
+        self.pressed = pressed
+
+    def draw(self, d):
+        fg, bg = (d.WHITE, d.BLACK) if self.pressed else (d.BLACK, d.WHITE)
+        if self.pressed:
+            d.fillRect(self.x, self.y, self.w, self.h, bg)
+        d.drawRect(self.x, self.y, self.w, self.h, d.BLACK)
+        tw, th = _textSize(d.GFX.font, self.text, self.size)
+        self._text(
+            d, self.x + (self.w - tw) // 2, self.y + (self.h - th) // 2, self.text, self.size, fg
+        )
+
+
+# ProgressBar fills the part value/maximum of its frame
+class ProgressBar(Widget):
+    def __init__(self, x, y, w, h, value=0, maximum=100):
+        super().__init__(x, y, w, h)
+        self.value = value
+        self.maximum = maximum
+
+    def draw(self, d):
+        d.drawRect(self.x, self.y, self.w, self.h, d.BLACK)
+        v = max(0, min(self.value, self.maximum))
+        fw = (self.w - 4) * v // self.maximum if self.maximum else 0
+        if fw > 0:
+            d.fillRect(self.x + 2, self.y + 2, fw, self.h - 4, d.BLACK)
+
+
+# Icon is a 1-bit bitmap as taken by drawBitmap
+class Icon(Widget):
+    def __init__(self, x, y, w, h, data):
+        super().__init__(x, y, w, h)
+        self.data = data
+
+    def draw(self, d):
+        d.drawBitmap(self.x, self.y, self.data, self.w, self.h)
+
+
+# ListBox shows items one per row starting with item top, the selected one inverted
+class ListBox(Widget):
+    def __init__(self, x, y, w, h, items=(), size=1, selected=-1, top=0):
+        super().__init__(x, y, w, h)
+        self.items = items
+        self.size = size
+        self.selected = selected
+        self.top = top
+        self._rowHeight = 1
+
+    def layout(self, d):
+        self._rowHeight = self.size * d.GFX.font["a"][1] + 4
+
+    # itemAt returns the index of the item at the point (x, y), or -1
+    def itemAt(self, x, y):
+        if not self.contains(x, y):
+            return -1
+        i = self.top + (y - self.y) // self._rowHeight
+        return i if i < len(self.items) else -1
+
+    def draw(self, d):
+        rh = self._rowHeight
+        y = self.y
+        i = self.top
+        while i < len(self.items) and y + rh <= self.y + self.h:
+            fg = d.BLACK
+            if i == self.selected:
+                d.fillRect(self.x, y, self.w, rh, d.BLACK)
+                fg = d.WHITE
+            self._text(d, self.x + 2, y + 2, str(self.items[i]), self.size, fg)
+            y += rh
+            i += 1
+
+
+class Screen:
+    def __init__(self, display):
+        self.display = display
+        self._widgets = []
+        self._dirty = []  # widgets to redraw
+        self._damage = []  # rectangles to clear, e.g. where a widget was before it moved
+
+    # add adds widgets to the screen, drawn at the next commit, and returns the first one
+    def add(self, *widgets):
+        for w in widgets:
+            w._screen = self
+            w.layout(self.display)
+            self._widgets.append(w)
+            self.invalidate(w)
+        return widgets[0]
+
+    def remove(self, w):
+        self._widgets.remove(w)
+        w._screen = None
+        if w in self._dirty:
+            self._dirty.remove(w)
+        self._damage.append(w.rect())
+
+    # invalidate marks a widget for redrawing; old is the rectangle it covered before, if it
+    # moved or changed size
+    def invalidate(self, w, old=None):
+        if w not in self._dirty:
+            self._dirty.append(w)
+        if old is not None and old != w.rect():
+            self._damage.append(old)
+
+    # commit redraws what changed and refreshes the rectangle around it, with a full refresh if
+    # full is set or the display can't do a partial one. It returns the refreshed rectangle, or
+    # None if nothing changed.
+    def commit(self, full=False):
+        if not self._dirty and not self._damage:
+            if full:
+                self.display.display()
+            return None
+        d = self.display
+        rects = self._damage + [w.rect() for w in self._dirty]
+        self._dirty = []
+        self._damage = []
+        for r in rects:
+            d.fillRect(r[0], r[1], r[2], r[3], d.WHITE)
+        for w in self._widgets:
+            if w.visible:
+                r = w.rect()
+                for dr in rects:
+                    if _overlap(r, dr):
+                        w.draw(d)
+                        break
+        area = rects[0]
+        for r in rects[1:]:
+            area = _union(area, r)
+        if full or not hasattr(d, "partialUpdate") or d.displayMode != 0:
+            d.display()
+        else:
+            d.partialUpdate(*area)
+        return area